@@ -0,0 +1,393 @@
+import hmac
+import http.server
+import json
+import sys
+import threading
+from pathlib import Path
+from typing import TYPE_CHECKING, Dict, List, Optional, Set, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+import config
+from bandwidth_scheduler import JobPriority
+from download_queue import DownloadJob, JobStatus, Section, format_sections, parse_sections
+
+if TYPE_CHECKING:
+    from downloader_core import DownloaderCore
+
+DEFAULT_SAVE_FOLDER = Path.home() / "Downloads"
+
+
+def job_state(job: DownloadJob) -> dict:
+    """APIで返すジョブの状態"""
+    return {
+        "job_id": job.job_id,
+        "url": job.url,
+        "title": job.title,
+        "status": job.status.value,
+        "priority": job.priority.name.lower(),
+        "progress": round(job.progress, 1),
+        "speed": job.speed,
+        "bytes": job.downloaded_bytes,
+        "save_folder": job.save_folder,
+        "quality": job.quality,
+        "clips": format_sections(job.sections) or None,
+        "output_path": job.output_path,
+        "output_paths": job.output_paths,
+        "duplicate_of": job.duplicate_of,
+        "error": job.error,
+        "started_at": job.started_at,
+        "finished_at": job.finished_at,
+    }
+
+
+class ApiError(Exception):
+    def __init__(self, status: int, message: str) -> None:
+        super().__init__(message)
+        self.status = status
+
+
+def parse_priority(value) -> JobPriority:
+    try:
+        return JobPriority[str(value).upper()]
+    except KeyError:
+        raise ApiError(400, f"優先度が正しくありません: {value}")
+
+
+def parse_clips(value) -> List[Section]:
+    """clips の "1:30-2:00,10:00-10:30" 形式の指定を読む。省略時は動画全体"""
+    if not value:
+        return []
+    try:
+        return parse_sections(str(value))
+    except ValueError as e:
+        raise ApiError(400, str(e))
+
+
+class _EventClient:
+    """
+    SSEの接続1件分の送信待ちの状態。ジョブごとに最新の状態だけを残すため、
+    受信側が遅くてもメモリは増えず、終了の状態も失われない
+    """
+
+    def __init__(self) -> None:
+        self._pending: Dict[int, dict] = {}
+        self._condition = threading.Condition()
+        self.closed = False
+
+    def push(self, state: dict) -> None:
+        with self._condition:
+            self._pending[state["job_id"]] = state
+            self._condition.notify()
+
+    def take(self, timeout: float) -> List[dict]:
+        with self._condition:
+            if not self._pending and not self.closed:
+                self._condition.wait(timeout)
+            states = list(self._pending.values())
+            self._pending.clear()
+            return states
+
+    def close(self) -> None:
+        with self._condition:
+            self.closed = True
+            self._condition.notify()
+
+
+class ApiHTTPServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address) -> None:
+        # SSEのクライアントが切断しただけの場合はトレースバックを出さない (BrokenPipeError も ConnectionError に含まれる)
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+def host_name(host: str) -> str:
+    """Host ヘッダーからポートを除いた名前を返す。IPv6 アドレスは [::1] のように角括弧ごと返す"""
+    if host.startswith("["):
+        end = host.find("]")
+        return host[: end + 1] if end != -1 else host
+    return host.rsplit(":", 1)[0]
+
+
+def token_matches(given: Optional[str], expected: str) -> bool:
+    # 比較にかかる時間からトークンを推測されないよう、一定時間で比較する
+    return given is not None and hmac.compare_digest(given.encode("utf-8"), expected.encode("utf-8"))
+
+
+class ApiRequestHandler(http.server.BaseHTTPRequestHandler):
+    """
+    JSONのAPIの要求を api.handle() に渡すハンドラ。api には ApiServer と同じ属性 (token, allowed_origins,
+    loopback_only) と handle() を持つオブジェクトを設定する
+    """
+
+    api: "ApiServer"
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+    def _send_json(self, status: int, body) -> None:
+        data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self._send_cors_headers()
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_cors_headers(self) -> None:
+        origin = self.headers.get("Origin")
+        if origin and origin in self.api.allowed_origins:
+            self.send_header("Access-Control-Allow-Origin", origin)
+            self.send_header("Vary", "Origin")
+
+    def _check_request(self, query: dict) -> None:
+        # DNSリバインディングで他のサイトから呼ばれないよう、Host はループバックの名前に限る
+        host = host_name(self.headers.get("Host") or "")
+        if self.api.loopback_only and host not in ("127.0.0.1", "localhost", "[::1]"):
+            raise ApiError(403, "Host が許可されていません")
+        origin = self.headers.get("Origin")
+        if origin and origin not in self.api.allowed_origins:
+            raise ApiError(403, "Origin が許可されていません")
+        if self.api.token:
+            authorization = self.headers.get("Authorization") or ""
+            token = authorization[len("Bearer ") :] if authorization.startswith("Bearer ") else None
+            if not token_matches(token, self.api.token) and not token_matches(
+                query.get("token", [None])[0], self.api.token
+            ):
+                raise ApiError(401, "トークンが正しくありません")
+
+    def _read_json(self) -> dict:
+        # application/json 以外を受け付けないことで、ブラウザの単純リクエストによる投入を防ぐ
+        if (self.headers.get("Content-Type") or "").split(";")[0].strip() != "application/json":
+            raise ApiError(415, "Content-Type は application/json にしてください")
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+        except ValueError:
+            raise ApiError(400, "Content-Length が正しくありません")
+        if length < 0:
+            raise ApiError(400, "Content-Length が正しくありません")
+        try:
+            body = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            raise ApiError(400, "JSONが正しくありません")
+        if not isinstance(body, dict):
+            raise ApiError(400, "JSONオブジェクトを送ってください")
+        return body
+
+    def _dispatch(self, method: str) -> None:
+        url = urlsplit(self.path)
+        query = parse_qs(url.query)
+        parts = [part for part in url.path.split("/") if part]
+        try:
+            self._check_request(query)
+            if parts == ["events"] and method == "GET":
+                self._stream_events()
+                return
+            read_body = self._read_json if method in ("POST", "PATCH") else dict
+            status, body = self.api.handle(method, parts, query, read_body)
+        except ApiError as e:
+            status, body = e.status, {"error": str(e)}
+        except (ValueError, TypeError, KeyError) as e:
+            # 数値であるべき値に文字列が送られた場合など、要求の内容の誤り
+            status, body = 400, {"error": f"要求が正しくありません: {e}"}
+        except Exception as e:
+            print(f"APIの要求の処理中にエラーが発生しました: {e}")
+            status, body = 500, {"error": str(e)}
+        self._send_json(status, body)
+
+    def do_GET(self) -> None:
+        self._dispatch("GET")
+
+    def do_POST(self) -> None:
+        self._dispatch("POST")
+
+    def do_PATCH(self) -> None:
+        self._dispatch("PATCH")
+
+    def do_DELETE(self) -> None:
+        self._dispatch("DELETE")
+
+    def do_OPTIONS(self) -> None:
+        # 許可したオリジンからのCORSのプリフライト
+        origin = self.headers.get("Origin")
+        if not origin or origin not in self.api.allowed_origins:
+            self._send_json(403, {"error": "Origin が許可されていません"})
+            return
+        self.send_response(204)
+        self._send_cors_headers()
+        self.send_header("Access-Control-Allow-Methods", "GET, POST, PATCH, DELETE")
+        self.send_header("Access-Control-Allow-Headers", "Content-Type, Authorization")
+        self.end_headers()
+
+    def _stream_events(self) -> None:
+        """
+        server-sent events でジョブの状態を送り続ける。接続直後に全ジョブの状態を送り、以降は変化したジョブだけを送る
+        """
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream; charset=utf-8")
+        self.send_header("Cache-Control", "no-cache")
+        self._send_cors_headers()
+        self.end_headers()
+        client = self.api.subscribe()
+        try:
+            for job in list(self.api.core.queue.jobs.values()):
+                client.push(job_state(job))
+            while not client.closed:
+                states = client.take(self.api.HEARTBEAT_INTERVAL)
+                if states:
+                    for state in states:
+                        self.wfile.write(f"event: job\ndata: {json.dumps(state, ensure_ascii=False)}\n\n".encode())
+                else:
+                    # 切断を検出するため、変化がなくても定期的にコメント行を送る
+                    self.wfile.write(b": keep-alive\n\n")
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            self.api.unsubscribe(client)
+
+
+class ApiServer:
+    """
+    DownloaderCore をローカルのHTTP/JSON APIとして公開するサーバー。
+    GUIやCLIと同じキューにジョブを投入できるため、ブラウザの拡張機能やスクリプトから
+    アプリを複数起動せずに同時ダウンロード数・帯域の管理を共有できる。
+
+        GET    /jobs           ジョブの一覧 (?status=running で絞り込み)
+        POST   /jobs           URLを投入する {"urls": [...], "save_folder", "quality", "priority", "clips", "playlist"}
+        GET    /jobs/<id>      ジョブの状態
+        PATCH  /jobs/<id>      優先度の変更 {"priority": "high"}
+        DELETE /jobs/<id>      ジョブの中止
+        DELETE /jobs           全ジョブの中止
+        GET    /status         状態ごとのジョブ数
+        GET    /events         ジョブの状態の変化 (server-sent events)
+    """
+
+    # SSEで変化がないときにコメント行を送る間隔 (秒)
+    HEARTBEAT_INTERVAL = 15.0
+    # ループバックアドレスの名前以外の Host への要求を拒否する
+    loopback_only = True
+
+    def __init__(
+        self,
+        core: "DownloaderCore",
+        host: str = "127.0.0.1",
+        port: int = config.api_port,
+        token: Optional[str] = config.api_token,
+        allowed_origins: Optional[List[str]] = None,
+        default_save_folder: Optional[str] = None,
+    ) -> None:
+        self.core = core
+        self.host = host
+        self.port = port
+        self.token = token
+        self.allowed_origins = set(config.api_allowed_origins if allowed_origins is None else allowed_origins)
+        self.default_save_folder = default_save_folder or str(DEFAULT_SAVE_FOLDER)
+        self.default_quality = config.quality_options[config.quality_default_idx].split()[0].replace("p", "")
+        self._clients: Set[_EventClient] = set()
+        self._lock = threading.Lock()
+        self._httpd: Optional[ApiHTTPServer] = None
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    def start(self) -> str:
+        """待ち受けを別スレッドで開始し、APIのURLを返す。port が 0 の場合は空いているポートを使う"""
+        server = self
+
+        class Handler(ApiRequestHandler):
+            api = server
+
+        self._httpd = ApiHTTPServer((self.host, self.port), Handler)
+        self.port = self._httpd.server_address[1]
+        self.core.add_job_listener(self._on_job_update)
+        threading.Thread(target=self._httpd.serve_forever, daemon=True).start()
+        return self.url
+
+    def stop(self) -> None:
+        self.core.remove_job_listener(self._on_job_update)
+        with self._lock:
+            clients = list(self._clients)
+        for client in clients:
+            client.close()
+        if self._httpd:
+            self._httpd.shutdown()
+            self._httpd.server_close()
+            self._httpd = None
+
+    def subscribe(self) -> _EventClient:
+        client = _EventClient()
+        with self._lock:
+            self._clients.add(client)
+        return client
+
+    def unsubscribe(self, client: _EventClient) -> None:
+        with self._lock:
+            self._clients.discard(client)
+
+    def _on_job_update(self, job: DownloadJob) -> None:
+        with self._lock:
+            clients = list(self._clients)
+        if clients:
+            state = job_state(job)
+            for client in clients:
+                client.push(state)
+
+    def _get_job(self, job_id: str) -> DownloadJob:
+        job = self.core.queue.jobs.get(int(job_id)) if job_id.isdigit() else None
+        if job is None:
+            raise ApiError(404, f"ジョブがありません: {job_id}")
+        return job
+
+    def handle(self, method: str, parts: List[str], query: dict, read_body) -> Tuple[int, object]:
+        """
+        リクエストを処理して (ステータスコード, JSONにする値) を返す。read_body は送られたJSONを読む関数
+        """
+        jobs = self.core.queue.jobs
+        if parts == ["jobs"] and method == "GET":
+            statuses = set(query.get("status", []))
+            return 200, [job_state(job) for job in list(jobs.values()) if not statuses or job.status.value in statuses]
+        if parts == ["jobs"] and method == "POST":
+            return self._submit(read_body())
+        if parts == ["jobs"] and method == "DELETE":
+            self.core.cancel_all()
+            return 202, {"cancelled": True}
+        if len(parts) == 2 and parts[0] == "jobs":
+            job = self._get_job(parts[1])
+            if method == "GET":
+                return 200, job_state(job)
+            if method == "DELETE":
+                self.core.cancel(job.job_id)
+                return 202, job_state(job)
+            if method == "PATCH":
+                body = read_body()
+                if "priority" in body:
+                    self.core.set_priority(job.job_id, parse_priority(body["priority"]))
+                return 200, job_state(job)
+        if parts == ["status"] and method == "GET":
+            counts = self.core.queue.counts()
+            return 200, {
+                "jobs": {status.value: counts[status] for status in JobStatus},
+                "playlists_expanding": len(self.core.playlist_expansions),
+            }
+        raise ApiError(404 if method == "GET" else 405, f"{method} /{'/'.join(parts)} は使えません")
+
+    def _submit(self, body: dict) -> Tuple[int, dict]:
+        urls = body.get("urls") or ([body["url"]] if body.get("url") else [])
+        if not isinstance(urls, list) or not urls or not all(isinstance(url, str) for url in urls):
+            raise ApiError(400, "url または urls を指定してください")
+        save_folder = str(body.get("save_folder") or self.default_save_folder)
+        quality = str(body.get("quality") or self.default_quality).replace("p", "")
+        priority = parse_priority(body.get("priority", JobPriority.NORMAL.name))
+        sections = parse_clips(body.get("clips"))
+        if body.get("playlist"):
+            if sections:
+                raise ApiError(400, "clips は playlist と同時に指定できません")
+            for url in urls:
+                self.core.expand_playlist(url, save_folder, quality, body.get("match_filter"), priority=priority)
+            # 展開で投入されたジョブは /events や /jobs で確認する
+            return 202, {"jobs": [], "expanding": urls}
+        submitted = [self.core.submit(url, save_folder, quality, priority, sections) for url in urls]
+        return 202, {"jobs": [job_state(job) for job in submitted]}
@@ -0,0 +1,123 @@
+import threading
+import time
+from enum import Enum
+from typing import Callable, Dict, Hashable, Optional
+
+import config
+
+
+class JobPriority(Enum):
+    """ジョブの優先度。値は帯域を配分するときの重み"""
+
+    LOW = 1
+    NORMAL = 2
+    HIGH = 4
+
+
+class _JobBucket:
+    def __init__(self, priority: JobPriority, now: float) -> None:
+        self.priority = priority
+        self.tokens = 0.0
+        self.updated_at = now
+        # ストリーム (出力ファイル) ごとの取得済みバイト数。進捗フックの累計値から増分を求める
+        self.seen: Dict[str, int] = {}
+
+
+class BandwidthScheduler:
+    """
+    全ジョブ合計の帯域を rate_limit (バイト/秒) に抑えるトークンバケット。
+    帯域は実行中のジョブに優先度の重みで配分し、ジョブの開始・終了や優先度の変更のたびに配り直す。
+    yt-dlp の進捗フックから report() を呼ぶと、割り当てを超えた分だけダウンロードのスレッドを待たせる。
+    rate_limit が None の間は制限しない
+    """
+
+    # 待機中に上限や優先度の変更・キャンセルを確認する間隔 (秒)
+    WAIT_SLICE = 0.25
+
+    def __init__(
+        self,
+        rate_limit: Optional[float] = config.bandwidth_limit,
+        burst_seconds: float = config.bandwidth_burst_seconds,
+    ) -> None:
+        self.rate_limit = rate_limit or None
+        self.burst_seconds = burst_seconds
+        self._jobs: Dict[Hashable, _JobBucket] = {}
+        self._condition = threading.Condition()
+
+    def _share(self, bucket: _JobBucket) -> Optional[float]:
+        if self.rate_limit is None:
+            return None
+        total_weight = sum(job.priority.value for job in self._jobs.values())
+        return self.rate_limit * bucket.priority.value / total_weight
+
+    def _refill_all(self, now: float) -> None:
+        # 配分が変わる前に、それまでの配分で貯まった分を確定させる
+        for bucket in self._jobs.values():
+            share = self._share(bucket)
+            if share is None:
+                bucket.tokens = 0.0
+            else:
+                bucket.tokens = min(share * self.burst_seconds, bucket.tokens + share * (now - bucket.updated_at))
+            bucket.updated_at = now
+
+    def set_rate_limit(self, rate_limit: Optional[float]) -> None:
+        """全体の上限を変更する。0 または None で無制限"""
+        with self._condition:
+            self._refill_all(time.monotonic())
+            self.rate_limit = rate_limit or None
+            self._condition.notify_all()
+
+    def register(self, job_id: Hashable, priority: JobPriority = JobPriority.NORMAL) -> None:
+        with self._condition:
+            now = time.monotonic()
+            self._refill_all(now)
+            self._jobs[job_id] = _JobBucket(priority, now)
+            self._condition.notify_all()
+
+    def unregister(self, job_id: Hashable) -> None:
+        """ジョブの終了時に呼ぶ。そのジョブの割り当ては残りのジョブに配り直される"""
+        with self._condition:
+            self._refill_all(time.monotonic())
+            self._jobs.pop(job_id, None)
+            self._condition.notify_all()
+
+    def set_priority(self, job_id: Hashable, priority: JobPriority) -> None:
+        with self._condition:
+            if job_id in self._jobs:
+                self._refill_all(time.monotonic())
+                self._jobs[job_id].priority = priority
+                self._condition.notify_all()
+
+    def share(self, job_id: Hashable) -> Optional[float]:
+        """ジョブに現在割り当てられている帯域 (バイト/秒)。無制限なら None"""
+        with self._condition:
+            bucket = self._jobs.get(job_id)
+            return self._share(bucket) if bucket else None
+
+    def report(
+        self,
+        job_id: Hashable,
+        stream: str,
+        downloaded_bytes: int,
+        cancelled: Optional[Callable[[], bool]] = None,
+    ) -> None:
+        """
+        進捗フックで受け取った累計バイト数を報告する。割り当てを超えていれば超えた分が解消するまで待つ。
+        cancelled が True を返すと待機を打ち切る
+        """
+        with self._condition:
+            bucket = self._jobs.get(job_id)
+            if bucket is None:
+                return
+            previous = bucket.seen.get(stream, 0)
+            bucket.seen[stream] = downloaded_bytes
+            # 最初からやり直した場合は累計値が減るため、その値をそのまま増分とする
+            consumed = downloaded_bytes - previous if downloaded_bytes >= previous else downloaded_bytes
+            bucket.tokens -= consumed
+
+            while not (cancelled and cancelled()):
+                self._refill_all(time.monotonic())
+                share = self._share(bucket)
+                if share is None or bucket.tokens >= 0 or job_id not in self._jobs:
+                    return
+                self._condition.wait(min(-bucket.tokens / share, self.WAIT_SLICE))
@@ -0,0 +1,414 @@
+"""
+ネットワークに接続せずに実行できるベンチマーク。
+ローカルの StandinServer を相手に、起動時間・ダウンロードのスループット・フラグメントの同時取得数の調整・
+後処理時間・進捗更新中のTkイベントループの遅延を計測し、結果をJSONで出力する。
+
+    python benchmarks/run_benchmarks.py --output results.json
+
+ffmpeg やディスプレイが無い環境では、それを必要とする計測は skipped として記録する
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Dict, List
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from standin_server import StandinServer  # noqa: E402
+
+SECTIONS = ("startup", "throughput", "fragments", "postprocess", "tk_latency")
+
+# 起動時間の予算 (秒)。--check を指定すると、計測値 (p50) が超えた場合に終了コード1で終わる
+STARTUP_BUDGETS = {"import_seconds": 0.3, "window_seconds": 1.0}
+# ウィンドウの表示前に読み込まれていてはいけないモジュール
+DEFERRED_MODULES = ("yt_dlp", "requests")
+
+# 起動時間の計測用に別プロセスで実行するスクリプト。
+# 引数はスタンドインサーバーのURL。ウィンドウが最初のアイドル処理に達するまでの時間を計った後、
+# ツールの取得元をスタンドインサーバーに向けて ToolBootstrap を動かす
+STARTUP_SCRIPT = """
+import json, sys, time
+started = time.perf_counter()
+import yt_downloader
+imported = time.perf_counter()
+loaded = [name for name in %r if name in sys.modules]
+window = None
+import tkinter as tk
+try:
+    root = tk.Tk()
+except tk.TclError:
+    pass
+else:
+    yt_downloader.YouTubeDownloader(root)
+    root.after_idle(root.quit)
+    root.mainloop()
+    window = time.perf_counter() - started
+    root.destroy()
+import asyncio, config, tool_manager
+base_url = sys.argv[1]
+config.ffmpeg_url = base_url + "/tools/ffmpeg.zip"
+config.ffprobe_url = base_url + "/tools/ffprobe.zip"
+config.atomicparsley_url = base_url + "/tools/AtomicParsley.zip"
+config.yt_dlp_url = base_url + "/tools/yt-dlp_macos"
+began = time.perf_counter()
+results = asyncio.run(tool_manager.ToolBootstrap(tool_manager.ToolManager()).run())
+print(json.dumps({
+    "import_seconds": imported - started,
+    "window_seconds": window,
+    "bootstrap_seconds": time.perf_counter() - began,
+    "loaded_before_window": loaded,
+    "tools": results,
+}))
+""" % (DEFERRED_MODULES,)
+
+
+def _summary(values: List[float]) -> dict:
+    if not values:
+        return {}
+    ordered = sorted(values)
+    return {
+        "mean": statistics.fmean(ordered),
+        "p50": ordered[len(ordered) // 2],
+        "p95": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+        "max": ordered[-1],
+    }
+
+
+def environment() -> dict:
+    import yt_dlp.version
+
+    return {
+        "timestamp": time.time(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "yt_dlp": yt_dlp.version.__version__,
+        "ffmpeg": shutil.which("ffmpeg") is not None,
+    }
+
+
+def bench_startup(standin: StandinServer, runs: int) -> dict:
+    """
+    コールド起動 (ツール未取得) とウォーム起動 (取得済み・マニフェストのTTL内) を別プロセスで計測する
+    """
+    results: Dict[str, list] = {"cold": [], "warm": []}
+    for _ in range(runs):
+        home = tempfile.mkdtemp(prefix="yt-downloader-bench-home-")
+        try:
+            for kind in ("cold", "warm"):
+                began = time.perf_counter()
+                completed = subprocess.run(
+                    [sys.executable, "-c", STARTUP_SCRIPT, standin.base_url],
+                    cwd=REPO_ROOT,
+                    env={**os.environ, "HOME": home},
+                    capture_output=True,
+                    text=True,
+                    check=True,
+                )
+                measured = json.loads(completed.stdout.strip().splitlines()[-1])
+                measured["process_seconds"] = time.perf_counter() - began
+                results[kind].append(measured)
+        finally:
+            shutil.rmtree(home, ignore_errors=True)
+
+    summary = {}
+    for kind, measured_runs in results.items():
+        summary[kind] = {
+            key: _summary([run[key] for run in measured_runs if run[key] is not None])
+            for key in ("process_seconds", "import_seconds", "window_seconds", "bootstrap_seconds")
+        }
+        summary[kind]["tools_ready"] = all(all(run["tools"].values()) for run in measured_runs)
+        summary[kind]["loaded_before_window"] = sorted(
+            {name for run in measured_runs for name in run["loaded_before_window"]}
+        )
+    summary["budget"] = check_startup_budget(summary)
+    return summary
+
+
+def check_startup_budget(summary: dict) -> dict:
+    """
+    ウォーム起動の計測値を STARTUP_BUDGETS と比べる。ディスプレイが無く計測できなかった値は判定しない
+    """
+    violations = []
+    for key, budget in STARTUP_BUDGETS.items():
+        measured = summary["warm"][key].get("p50")
+        if measured is not None and measured > budget:
+            violations.append(f"{key}: {measured:.3f}s > {budget}s")
+    for kind in ("cold", "warm"):
+        if summary[kind]["loaded_before_window"]:
+            violations.append(f"{kind}: loaded before window: {', '.join(summary[kind]['loaded_before_window'])}")
+    return {"limits": STARTUP_BUDGETS, "passed": not violations, "violations": violations}
+
+
+def _run_jobs(urls: List[str], concurrency: int, work_dir: Path, sequential: bool = False, **overrides) -> dict:
+    """
+    sequential が True の場合は前のジョブが終わってから次のジョブを投入する。
+    overrides は YoutubeDL のオプションに追加する
+    """
+    from download_queue import JobStatus
+    from downloader_core import DownloaderCore
+
+    # アーカイブやキャッシュ・Cookie が前回の結果や普段の設定を使わないよう、実行ごとに保存先を分ける
+    core = DownloaderCore(
+        data_dir=work_dir / "home",
+        max_workers=concurrency,
+        manage_tools=False,
+        ydl_overrides={
+            "quiet": True,
+            "verbose": False,
+            "no_warnings": True,
+            "noprogress": True,
+            "postprocessors": [],
+            **overrides,
+        },
+    )
+    try:
+        began = time.perf_counter()
+        jobs = []
+        for index, url in enumerate(urls):
+            # 汎用抽出器ではタイトルが同じになるため、ジョブごとに保存先を分ける
+            jobs.append(core.submit(url, str(work_dir / f"job{index}"), "1080"))
+            while sequential and not jobs[-1].is_finished:
+                time.sleep(0.02)
+        while not all(job.is_finished for job in jobs):
+            time.sleep(0.02)
+        elapsed = time.perf_counter() - began
+    finally:
+        core.cancel_all()
+        core.close()
+
+    failed = [job.error for job in jobs if job.status != JobStatus.DONE]
+    total_bytes = sum(job.downloaded_bytes for job in jobs)
+    per_job = [
+        job.downloaded_bytes / (job.finished_at - job.started_at)
+        for job in jobs
+        if job.status == JobStatus.DONE and job.finished_at > job.started_at
+    ]
+    return {
+        "jobs": len(jobs),
+        "failed": len(failed),
+        "errors": failed[:3],
+        "bytes": total_bytes,
+        "elapsed": elapsed,
+        "aggregate_bytes_per_second": total_bytes / elapsed if elapsed > 0 else 0.0,
+        "per_job_bytes_per_second": _summary(per_job),
+        "fragment_concurrency": [max(job.metrics.fragment_concurrency.values(), default=None) for job in jobs],
+    }
+
+
+def bench_throughput(standin: StandinServer, concurrency_levels: List[int], jobs: int) -> dict:
+    """
+    直接ダウンロードとHLSのフラグメント配信について、同時ダウンロード数ごとのスループットを計測する。
+    URLはクエリ文字列で区別し、重複ジョブの統合やアーカイブのスキップが起きないようにする
+    """
+    results: Dict[str, dict] = {}
+    streams = {"direct": "media/video.mp4", "hls": "hls/index.m3u8"}
+    for name, path in streams.items():
+        results[name] = {}
+        for concurrency in concurrency_levels:
+            work_dir = Path(tempfile.mkdtemp(prefix="yt-downloader-bench-"))
+            try:
+                urls = [standin.url(f"{path}?c={concurrency}&n={index}") for index in range(jobs)]
+                results[name][str(concurrency)] = _run_jobs(urls, concurrency, work_dir)
+            finally:
+                shutil.rmtree(work_dir, ignore_errors=True)
+    return results
+
+
+def bench_fragments(standin: StandinServer, jobs: int) -> dict:
+    """
+    HLSのジョブを1件ずつ順に実行し、フラグメントを1つずつ取得する場合 (以前の動作) と
+    FragmentTuner が同時取得数を調整する場合のスループットを比べる。
+    スタンドインサーバーは接続ごとに帯域を制限するため、同時取得数を増やすほど速くなる
+    """
+    results: Dict[str, dict] = {}
+    modes = {"sequential_fragments": {"concurrent_fragment_downloads": 1}, "auto_tuned": {}}
+    for name, overrides in modes.items():
+        work_dir = Path(tempfile.mkdtemp(prefix="yt-downloader-bench-"))
+        try:
+            urls = [standin.url(f"hls/index.m3u8?mode={name}&n={index}") for index in range(jobs)]
+            results[name] = _run_jobs(urls, 1, work_dir, sequential=True, **overrides)
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    baseline = results["sequential_fragments"]["aggregate_bytes_per_second"]
+    if baseline > 0:
+        results["speedup"] = results["auto_tuned"]["aggregate_bytes_per_second"] / baseline
+    return results
+
+
+def bench_postprocess(standin: StandinServer, runs: int) -> dict:
+    """
+    mkv -> mp4 の後処理について、以前の FFmpegVideoConvertor (全ストリームの再エンコード) と
+    MediaPlanner (必要な処理だけを行う) の処理時間を比べる
+    """
+    if not standin.prepare_real_media():
+        return {"skipped": "ffmpeg not found"}
+
+    from yt_dlp import YoutubeDL
+    from yt_dlp.postprocessor import FFmpegVideoConvertorPP
+
+    from media_planner import MediaPlannerPP
+
+    source = standin.root_dir / "media" / "real.mkv"
+    results = {"input_bytes": source.stat().st_size}
+    with YoutubeDL({"quiet": True, "no_warnings": True}) as ydl:
+        postprocessors = {
+            "video_convertor": lambda: FFmpegVideoConvertorPP(ydl, preferedformat="mp4"),
+            "media_planner": lambda: MediaPlannerPP(ydl, on_plan=lambda plan: results.update(media_plan=plan)),
+        }
+        for name, create in postprocessors.items():
+            durations = []
+            for _ in range(runs):
+                work_dir = Path(tempfile.mkdtemp(prefix="yt-downloader-bench-pp-"))
+                try:
+                    target = work_dir / "real.mkv"
+                    shutil.copyfile(source, target)
+                    began = time.perf_counter()
+                    create().run({"filepath": str(target), "ext": "mkv", "__files_to_move": {}})
+                    durations.append(time.perf_counter() - began)
+                finally:
+                    shutil.rmtree(work_dir, ignore_errors=True)
+            results[f"{name}_seconds"] = _summary(durations)
+    return results
+
+
+def _measure_tk_latency(
+    root, publish: Callable[[int, Callable[[], None]], None], jobs: int, rate: int, duration: float
+) -> dict:
+    """
+    jobs 個のスレッドがそれぞれ rate 回/秒で進捗を通知する間、
+    10ms ごとの after() がどれだけ遅れて実行されるかを計測する
+    """
+    delays: List[float] = []
+    applied = [0]
+    stop = threading.Event()
+
+    def apply() -> None:
+        applied[0] += 1
+
+    def producer(job_id: int) -> None:
+        while not stop.is_set():
+            publish(job_id, apply)
+            time.sleep(1 / rate)
+
+    def probe(expected: float) -> None:
+        now = time.perf_counter()
+        delays.append(max(0.0, now - expected))
+        if stop.is_set():
+            root.quit()
+            return
+        root.after(10, probe, now + 0.010)
+
+    threads = [threading.Thread(target=producer, args=(job_id,), daemon=True) for job_id in range(jobs)]
+    for thread in threads:
+        thread.start()
+    root.after(10, probe, time.perf_counter() + 0.010)
+    root.after(int(duration * 1000), stop.set)
+    root.mainloop()
+    for thread in threads:
+        thread.join()
+    return {"delay_seconds": _summary(delays), "published": jobs * rate * duration, "applied": applied[0]}
+
+
+def bench_tk_latency(jobs: int, rate: int, duration: float) -> dict:
+    """
+    進捗の通知を ProgressBus で間引いた場合と、通知ごとに after(0) する場合のイベントループの遅延を比べる
+    """
+    import tkinter as tk
+
+    try:
+        root = tk.Tk()
+    except tk.TclError as e:
+        return {"skipped": f"Tk unavailable: {e}"}
+
+    from progress_bus import ProgressBus
+
+    results = {}
+    try:
+        root.withdraw()
+        bus = ProgressBus(root)
+        bus.start()
+        results["progress_bus"] = _measure_tk_latency(root, bus.publish, jobs, rate, duration)
+        bus.stop()
+        results["after_per_update"] = _measure_tk_latency(
+            root, lambda _, callback: root.after(0, callback), jobs, rate, duration
+        )
+    finally:
+        root.destroy()
+    return results
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="ローカルのスタンドインサーバーを使ってベンチマークを実行する")
+    parser.add_argument("--output", help="結果のJSONの出力先 (省略時は標準出力)")
+    parser.add_argument("--sections", nargs="+", choices=SECTIONS, default=list(SECTIONS), help="実行する計測")
+    parser.add_argument("--runs", type=int, default=3, help="起動時間・後処理の計測回数")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4, 8], help="同時ダウンロード数")
+    parser.add_argument("--jobs", type=int, default=8, help="スループット計測のジョブ数")
+    parser.add_argument("--media-size", type=int, default=8 * 1024 * 1024, help="直接ダウンロードする動画のサイズ")
+    parser.add_argument("--hls-segments", type=int, default=16, help="HLSのセグメント数")
+    parser.add_argument(
+        "--fragment-jobs", type=int, default=6, help="フラグメントの同時取得数の調整を計測するジョブ数"
+    )
+    parser.add_argument(
+        "--rate-limit", type=int, default=8 * 1024 * 1024, help="スタンドインサーバーの接続ごとの帯域上限 (バイト/秒)"
+    )
+    parser.add_argument("--tk-jobs", type=int, default=8, help="Tk遅延の計測で進捗を通知するジョブ数")
+    parser.add_argument("--tk-rate", type=int, default=200, help="ジョブごとの進捗通知の頻度 (回/秒)")
+    parser.add_argument("--tk-duration", type=float, default=3.0, help="Tk遅延の計測時間 (秒)")
+    parser.add_argument("--check", action="store_true", help="起動時間が予算を超えた場合に終了コード1で終わる")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    report = {"environment": environment(), "results": {}}
+
+    with StandinServer(rate_limit=args.rate_limit) as standin:
+        standin.prepare_tools()
+        standin.prepare_media(args.media_size)
+        standin.prepare_hls(args.hls_segments)
+
+        benches: Dict[str, Callable[[], dict]] = {
+            "startup": lambda: bench_startup(standin, args.runs),
+            "throughput": lambda: bench_throughput(standin, args.concurrency, args.jobs),
+            "fragments": lambda: bench_fragments(standin, args.fragment_jobs),
+            "postprocess": lambda: bench_postprocess(standin, args.runs),
+            "tk_latency": lambda: bench_tk_latency(args.tk_jobs, args.tk_rate, args.tk_duration),
+        }
+        for section in args.sections:
+            print(f"running {section}...", file=sys.stderr)
+            try:
+                report["results"][section] = benches[section]()
+            except Exception as e:
+                report["results"][section] = {"error": repr(e)}
+
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        Path(args.output).write_text(output + "\n", encoding="utf-8")
+    else:
+        print(output)
+    if any("error" in result for result in report["results"].values()):
+        return 1
+    budget = report["results"].get("startup", {}).get("budget")
+    if args.check and budget and not budget["passed"]:
+        print("startup budget exceeded: " + "; ".join(budget["violations"]), file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,246 @@
+"""
+ベンチマーク用のローカルHTTPサーバー。
+ツールのZIP、直接ダウンロードできる動画ファイル、HLSのフラグメント配信を合成データで提供する。
+Range リクエストと接続ごとの帯域制限・応答遅延に対応する
+"""
+
+import hashlib
+import http.server
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zipfile
+from pathlib import Path
+from typing import Optional
+
+CONTENT_TYPES = {
+    ".zip": "application/zip",
+    ".mp4": "video/mp4",
+    ".mkv": "video/x-matroska",
+    ".m3u8": "application/vnd.apple.mpegurl",
+    ".ts": "video/mp2t",
+}
+
+# 帯域制限時に1回で送るサイズ
+SEND_CHUNK = 64 * 1024
+
+
+def _write_random(path: Path, size: int) -> None:
+    with open(path, "wb") as file:
+        remaining = size
+        while remaining > 0:
+            block = os.urandom(min(remaining, 1024 * 1024))
+            file.write(block)
+            remaining -= len(block)
+
+
+class _QuietHTTPServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address) -> None:
+        # yt-dlp は先頭だけ読んで接続を切ることがあるため、切断はエラーとして表示しない
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+class StandinServer:
+    """
+    合成データを配信するローカルHTTPサーバー。
+    rate_limit (バイト/秒) は接続ごとの上限で、複数接続で並列に取得すると合計の速度が上がる
+    """
+
+    def __init__(
+        self,
+        root_dir: Optional[Path] = None,
+        rate_limit: Optional[int] = None,
+        latency: float = 0.0,
+    ) -> None:
+        self._tmp_dir = None if root_dir else tempfile.mkdtemp(prefix="yt-downloader-standin-")
+        self.root_dir = Path(root_dir or self._tmp_dir)
+        self.rate_limit = rate_limit
+        self.latency = latency
+        self.request_count = 0
+        self._httpd: Optional[_QuietHTTPServer] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def url(self, path: str) -> str:
+        return f"{self.base_url}/{path.lstrip('/')}"
+
+    def prepare_tools(self, tool_size: int = 4 * 1024 * 1024) -> None:
+        """
+        config のURLと同じ構成のツール (ffmpeg, ffprobe, AtomicParsley のZIP と yt-dlp 本体) を作る
+        """
+        tools_dir = self.root_dir / "tools"
+        tools_dir.mkdir(parents=True, exist_ok=True)
+        for name in ("ffmpeg", "ffprobe", "AtomicParsley"):
+            binary = tools_dir / name
+            _write_random(binary, tool_size)
+            with zipfile.ZipFile(tools_dir / f"{name}.zip", "w", zipfile.ZIP_STORED) as zf:
+                zf.write(binary, name)
+            binary.unlink()
+        _write_random(tools_dir / "yt-dlp_macos", tool_size // 4)
+
+    def prepare_media(self, size: int = 16 * 1024 * 1024) -> None:
+        """直接ダウンロード用の動画ファイル (中身は乱数)"""
+        media_dir = self.root_dir / "media"
+        media_dir.mkdir(parents=True, exist_ok=True)
+        _write_random(media_dir / "video.mp4", size)
+
+    def prepare_hls(self, segments: int = 32, segment_size: int = 512 * 1024, segment_duration: int = 4) -> None:
+        """フラグメント配信用のHLSメディアプレイリストとセグメント (中身は乱数)"""
+        hls_dir = self.root_dir / "hls"
+        hls_dir.mkdir(parents=True, exist_ok=True)
+        lines = ["#EXTM3U", "#EXT-X-VERSION:3", f"#EXT-X-TARGETDURATION:{segment_duration}", "#EXT-X-MEDIA-SEQUENCE:0"]
+        for index in range(segments):
+            _write_random(hls_dir / f"segment{index:05d}.ts", segment_size)
+            lines += [f"#EXTINF:{segment_duration}.0,", f"segment{index:05d}.ts"]
+        lines.append("#EXT-X-ENDLIST")
+        (hls_dir / "index.m3u8").write_text("\n".join(lines) + "\n", encoding="utf-8")
+
+    def prepare_real_media(self, duration: int = 10) -> bool:
+        """
+        ffmpeg がある場合、後処理の計測用に実際に再生できる mkv (H.264/AAC) を作る
+        """
+        ffmpeg = shutil.which("ffmpeg")
+        if not ffmpeg:
+            return False
+        media_dir = self.root_dir / "media"
+        media_dir.mkdir(parents=True, exist_ok=True)
+        command = [ffmpeg, "-y", "-loglevel", "error"]
+        command += ["-f", "lavfi", "-i", f"testsrc2=size=1280x720:rate=30:duration={duration}"]
+        command += ["-f", "lavfi", "-i", f"sine=frequency=440:duration={duration}"]
+        command += ["-c:v", "libx264", "-preset", "veryfast", "-c:a", "aac", "-shortest", str(media_dir / "real.mkv")]
+        subprocess.run(command, check=True)
+        return True
+
+    def start(self) -> str:
+        server = self
+
+        class Handler(_StandinHandler):
+            standin = server
+
+        self._httpd = _QuietHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=self._httpd.serve_forever, daemon=True).start()
+        return self.base_url
+
+    def stop(self) -> None:
+        if self._httpd:
+            self._httpd.shutdown()
+            self._httpd.server_close()
+            self._httpd = None
+        if self._tmp_dir:
+            shutil.rmtree(self._tmp_dir, ignore_errors=True)
+
+    def __enter__(self) -> "StandinServer":
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+
+class _StandinHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    standin: StandinServer
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+    def _resolve(self) -> Optional[Path]:
+        # クエリ文字列はURLを区別するためだけに使い、配信するファイルには影響しない
+        relative = self.path.split("?", 1)[0].lstrip("/")
+        path = (self.standin.root_dir / relative).resolve()
+        if self.standin.root_dir.resolve() not in path.parents or not path.is_file():
+            return None
+        return path
+
+    def _send_headers(self, path: Path, status: int, start: int, end: int, size: int) -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", CONTENT_TYPES.get(path.suffix, "application/octet-stream"))
+        self.send_header("Content-Length", str(end - start + 1))
+        self.send_header("Accept-Ranges", "bytes")
+        stat = path.stat()
+        etag = hashlib.md5(f"{path}:{stat.st_size}:{stat.st_mtime_ns}".encode()).hexdigest()
+        self.send_header("ETag", f'"{etag}"')
+        if status == 206:
+            self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        self.end_headers()
+
+    def do_HEAD(self) -> None:
+        path = self._resolve()
+        if path is None:
+            self.send_error(404)
+            return
+        size = path.stat().st_size
+        self._send_headers(path, 200, 0, size - 1, size)
+
+    def do_GET(self) -> None:
+        self.standin.request_count += 1
+        if self.standin.latency:
+            time.sleep(self.standin.latency)
+        path = self._resolve()
+        if path is None:
+            self.send_error(404)
+            return
+
+        size = path.stat().st_size
+        start, end, status = 0, size - 1, 200
+        match = re.match(r"bytes=(\d*)-(\d*)", self.headers.get("Range", ""))
+        if match and (match.group(1) or match.group(2)):
+            if match.group(1):
+                start = int(match.group(1))
+                end = min(int(match.group(2)), size - 1) if match.group(2) else size - 1
+            else:
+                start = max(0, size - int(match.group(2)))
+            if start >= size:
+                self.send_error(416)
+                return
+            status = 206
+        self._send_headers(path, status, start, end, size)
+
+        rate_limit = self.standin.rate_limit
+        with open(path, "rb") as file:
+            file.seek(start)
+            remaining = end - start + 1
+            while remaining > 0:
+                began = time.monotonic()
+                block = file.read(min(SEND_CHUNK, remaining))
+                if not block:
+                    break
+                try:
+                    self.wfile.write(block)
+                except (BrokenPipeError, ConnectionResetError):
+                    return
+                remaining -= len(block)
+                if rate_limit:
+                    delay = len(block) / rate_limit - (time.monotonic() - began)
+                    if delay > 0:
+                        time.sleep(delay)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="ベンチマーク用のローカルHTTPサーバーを起動する")
+    parser.add_argument("--rate-limit", type=int, help="接続ごとの帯域上限 (バイト/秒)")
+    parser.add_argument("--latency", type=float, default=0.0, help="リクエストごとの応答遅延 (秒)")
+    args = parser.parse_args()
+
+    with StandinServer(rate_limit=args.rate_limit, latency=args.latency) as standin:
+        standin.prepare_tools()
+        standin.prepare_media()
+        standin.prepare_hls()
+        print(f"serving {standin.root_dir} at {standin.base_url}")
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            pass
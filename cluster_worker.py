@@ -0,0 +1,184 @@
+import json
+import socket
+import threading
+import time
+import urllib.error
+import urllib.request
+from typing import Dict, List, Optional, Set, Tuple
+
+import config
+from bandwidth_scheduler import JobPriority
+from download_queue import DownloadJob, JobStatus, parse_sections
+from downloader_core import APP_SUPPORT_DIR, DownloaderCore
+
+
+class CoordinatorClient:
+    """コーディネーターのHTTP/JSON APIを呼ぶクライアント"""
+
+    def __init__(self, base_url: str, token: Optional[str] = None, timeout: float = 10.0) -> None:
+        self.base_url = base_url.rstrip("/")
+        self.token = token
+        self.timeout = timeout
+
+    def post(self, path: str, body: dict) -> dict:
+        headers = {"Content-Type": "application/json"}
+        if self.token:
+            headers["Authorization"] = f"Bearer {self.token}"
+        request = urllib.request.Request(
+            self.base_url + path, data=json.dumps(body).encode("utf-8"), headers=headers, method="POST"
+        )
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            return json.loads(response.read().decode("utf-8"))
+
+
+class Worker:
+    """
+    コーディネーターからジョブを借りて DownloaderCore で実行するワーカー。
+    空いている枠の数だけジョブを借り、一定間隔のハートビートで進捗を報告してリースを延長する。
+    コーディネーターが中止を指示したジョブや、リースが切れて他のワーカーに貸し直されたジョブは手元で中止する
+    """
+
+    # 枠が空いているときにジョブを借りに行く間隔 (秒)
+    POLL_INTERVAL = 1.0
+
+    def __init__(
+        self,
+        coordinator_url: str,
+        save_folder: str,
+        worker_id: Optional[str] = None,
+        capacity: int = config.max_concurrent_downloads,
+        token: Optional[str] = None,
+        heartbeat_interval: float = config.worker_heartbeat_interval,
+        manage_tools: bool = True,
+        ydl_overrides: Optional[dict] = None,
+        tool_mirrors: Optional[List[str]] = None,
+    ) -> None:
+        self.client = CoordinatorClient(coordinator_url, token)
+        self.save_folder = save_folder
+        self.worker_id = worker_id or f"{socket.gethostname()}-{threading.get_native_id()}"
+        self.capacity = capacity
+        self.heartbeat_interval = heartbeat_interval
+        # 同じマシンで複数のワーカーを動かせるよう、ジャーナルはワーカーごとに分ける
+        self.core = DownloaderCore(
+            max_workers=capacity,
+            manage_tools=manage_tools,
+            ydl_overrides=ydl_overrides,
+            journal_path=APP_SUPPORT_DIR / f"worker-{self.worker_id}.sqlite3",
+            tool_mirrors=tool_mirrors,
+        )
+        # 前回の未完了ジョブはコーディネーターが貸し直すため、手元では再開しない
+        for record in self.core.journal.unfinished():
+            self.core.journal.remove(record["id"])
+        # ローカルのジョブID -> (ジョブ, コーディネーターのジョブID, リースID)
+        self.leases: Dict[int, Tuple[DownloadJob, int, str]] = {}
+        # コーディネーターから中止を指示されたジョブのID (コーディネーターのジョブID)
+        self._cancel_requested: Set[int] = set()
+        # 報告できていない結果 (送り先のパス, 内容)
+        self._unreported: List[Tuple[str, dict]] = []
+        self._stop = threading.Event()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def run(self) -> None:
+        """
+        stop() が呼ばれるまでジョブを借りて実行する。
+        終了時は実行中のジョブを中止し、別のワーカーが続きを実行できるようコーディネーターに返す
+        """
+        if self.core.manage_tools:
+            self.core.start_tool_bootstrap()
+        next_heartbeat = 0.0
+        try:
+            while not self._stop.is_set():
+                self._collect_finished()
+                self._report_results()
+                if len(self.leases) < self.capacity:
+                    self._lease()
+                if time.monotonic() >= next_heartbeat:
+                    self._heartbeat()
+                    next_heartbeat = time.monotonic() + self.heartbeat_interval
+                self._stop.wait(self.POLL_INTERVAL)
+        finally:
+            self.core.cancel_all()
+            while not all(job.is_finished for job, _, _ in self.leases.values()):
+                time.sleep(0.2)
+            self._collect_finished()
+            self._report_results()
+            self.core.close()
+
+    def _call(self, path: str, body: dict) -> Optional[dict]:
+        try:
+            return self.client.post(path, {"worker_id": self.worker_id, **body})
+        except (urllib.error.URLError, OSError, ValueError) as e:
+            # コーディネーターに届かない間はリースが延長されない。再接続後のハートビートで手放すジョブを知る
+            print(f"Coordinator request failed ({path}): {e}")
+            return None
+
+    def _lease(self) -> None:
+        response = self._call("/lease", {"capacity": self.capacity - len(self.leases)})
+        if response and response.get("lease_seconds"):
+            # リースの期限内に少なくとも数回ハートビートが届くようにする
+            self.heartbeat_interval = min(self.heartbeat_interval, response["lease_seconds"] / 3)
+        for leased in (response or {}).get("jobs", []):
+            job = self.core.submit(
+                leased["url"],
+                self.save_folder,
+                leased["quality"],
+                JobPriority[leased["priority"].upper()],
+                parse_sections(leased.get("clips") or ""),
+            )
+            job.title = job.title or leased.get("title")
+            self.leases[job.job_id] = (job, leased["job_id"], leased["lease_id"])
+
+    def _heartbeat(self) -> None:
+        reports = [
+            {
+                "job_id": cluster_id,
+                "lease_id": lease_id,
+                "title": job.title,
+                "progress": job.progress,
+                "speed": job.speed,
+                "bytes": job.downloaded_bytes,
+            }
+            for job, cluster_id, lease_id in list(self.leases.values())
+        ]
+        response = self._call("/heartbeat", {"jobs": reports})
+        if response is None:
+            return
+        cancel, lost = set(response.get("cancel", [])), set(response.get("lost", []))
+        for local_id, (job, cluster_id, _) in list(self.leases.items()):
+            if cluster_id in lost:
+                # 他のワーカーに貸し直されたジョブは結果を報告せずに手放す
+                del self.leases[local_id]
+                self.core.cancel(local_id)
+            elif cluster_id in cancel:
+                self._cancel_requested.add(cluster_id)
+                self.core.cancel(local_id)
+
+    def _collect_finished(self) -> None:
+        for local_id, (job, cluster_id, lease_id) in list(self.leases.items()):
+            if not job.is_finished:
+                continue
+            del self.leases[local_id]
+            if job.status == JobStatus.CANCELLED and cluster_id not in self._cancel_requested:
+                # ワーカーの終了で中止したジョブは結果として報告せず、待機中に戻してもらう
+                self._unreported.append(("/release", {"job_id": cluster_id, "lease_id": lease_id}))
+                continue
+            self._cancel_requested.discard(cluster_id)
+            result = {
+                "job_id": cluster_id,
+                "lease_id": lease_id,
+                "status": job.status.value,
+                "title": job.title,
+                "output_path": job.output_path,
+                "output_paths": job.output_paths,
+                "error": job.error,
+                "bytes": job.downloaded_bytes,
+            }
+            self._unreported.append(("/complete", result))
+
+    def _report_results(self) -> None:
+        while self._unreported:
+            if self._call(*self._unreported[0]) is None:
+                return
+            self._unreported.pop(0)
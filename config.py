@@ -3,6 +3,8 @@ quality_options = [
     "720p (HD)",
     "480p (SD)",
     "360p (低画質)",
+    "audio (音声のみ)",
+    "metadata (情報・サムネイル・字幕のみ)",
 ]
 quality_default_idx = 0
 
@@ -12,3 +14,80 @@ atomicparsley_url = (
     r"https://github.com/wez/atomicparsley/releases/download/20240608.083822.1ed9031/AtomicParsleyMacOS.zip"
 )
 yt_dlp_url = r"https://github.com/yt-dlp/yt-dlp/releases/latest/download/yt-dlp_macos"
+
+max_concurrent_downloads = 3
+max_concurrent_downloads_limit = 8
+
+# 進捗をUIに反映する頻度 (回/秒)
+progress_fps = 20
+
+# ツールダウンロード (file_fetcher) の設定
+fetch_connections = 4
+fetch_chunk_size = 1024 * 1024
+fetch_parallel_min_size = 16 * 1024 * 1024
+fetch_retries = 3
+fetch_timeout = 30
+# 再開用の進捗 (.part.json) を書き出す間隔 (秒)。強制終了されても、この間隔より前の進捗から再開できる
+fetch_checkpoint_interval = 2.0
+
+# インストール済みツールの更新・整合性を確認する間隔 (秒)
+tool_update_check_ttl = 24 * 60 * 60
+# ツールの取得元のミラー。上の公開URLより先に順に試す。ローカル・共有フォルダのパスか、LAN内のHTTPサーバーのURL。
+# python tool_mirror.py export <フォルダ> で作ったフォルダ、または公開URLと同じ名前のファイルを置いたフォルダを指定する
+tool_mirrors = []
+# 取得したツールのファイルを内容のハッシュで tools/cache に残し、再インストール時にダウンロードせずに使う
+tool_cache_enabled = True
+
+# extract_info 結果のキャッシュ (info_cache) の設定
+info_cache_ttl = 60 * 60
+info_cache_max_bytes = 50 * 1024 * 1024
+# URL入力時に先読みするURLの最大件数
+prefetch_max_urls = 5
+
+# ジョブごとの計測結果 (job_metrics) のログの最大サイズ。超えたら1世代だけ残してローテーションする
+metrics_log_max_bytes = 10 * 1024 * 1024
+
+# 1080p の動画1秒を再エンコードするのにかかるCPU時間 (秒) の目安。後処理で節約したCPU時間の見積もりに使う
+transcode_cpu_seconds_per_second = 2.0
+
+# 全ダウンロード合計の帯域の上限 (バイト/秒)。None で無制限
+bandwidth_limit = None
+# 帯域制限中に一度に使える量 (秒分)。大きいほど速度の揺れを許す
+bandwidth_burst_seconds = 1.0
+
+# 中止したジョブの途中のファイル (.part など) を残すか。残すと同じ動画を再度ダウンロードしたときに続きから取得する
+keep_partial_files_on_cancel = False
+
+# HLS/DASH のフラグメントを同時に取得する数の初期値。以降は速度とエラー率から自動で調整する
+fragment_concurrency_initial = 4
+# 全ジョブ合計のフラグメント取得の同時接続数の上限
+fragment_connections_limit = 16
+# フラグメントのリトライの割合がこれを超えたら同時接続数を半分にする
+fragment_error_rate_limit = 0.05
+
+# 後処理 (結合・変換・サムネイル埋め込み) を同時に行う数。None でCPUのコア数
+postprocess_workers = None
+
+# 取得途中のファイルを置く、保存フォルダ内の作業フォルダ。保存フォルダと同じボリュームにあるため、完成したファイルは名前の変更だけで移動できる
+staging_dir_name = ".yt-downloader-staging"
+# ダウンロード前に確認する空き容量 (ストリームの合計サイズに対する倍率)。結合・変換中は元のファイルと出力が両方存在する
+disk_space_factor = 2.2
+
+# ローカルHTTP API (api_server) の待ち受けポート
+api_port = 8765
+# APIのトークン。設定すると Authorization: Bearer <トークン> (SSEでは ?token=) が必要になる
+api_token = None
+# ブラウザからAPIを呼べるオリジン (例: "chrome-extension://<拡張機能のID>")。ここにないオリジンからの要求は拒否する
+api_allowed_origins = []
+
+# 分散モード (coordinator / cluster_worker) の設定
+coordinator_port = 8766
+# ワーカーに貸し出したジョブの有効期間 (秒)。ハートビートで延長され、途絶えると別のワーカーに貸し直す
+lease_seconds = 30
+# 期限切れで貸し直す回数の上限。超えたジョブは失敗にする
+lease_max_attempts = 3
+# ワーカーがハートビートを送る間隔 (秒)
+worker_heartbeat_interval = 5
+
+# metadata モードで保存する字幕の言語 (yt-dlp の subtitleslangs 形式)。ライブチャットは容量が大きいため除く
+metadata_subtitle_langs = ["all", "-live_chat"]
@@ -0,0 +1,362 @@
+import itertools
+import secrets
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import config
+from api_server import ApiError, ApiHTTPServer, ApiRequestHandler, parse_clips, parse_priority
+from bandwidth_scheduler import JobPriority
+from download_queue import JobStatus, Section, format_sections
+
+# ワーカーが報告できる終了状態
+FINISHED_STATUSES = {JobStatus.DONE, JobStatus.FAILED, JobStatus.CANCELLED, JobStatus.SKIPPED}
+
+
+class ClusterJob:
+    """コーディネーターが管理する1件のジョブ"""
+
+    def __init__(
+        self,
+        job_id: int,
+        url: str,
+        quality: str,
+        priority: JobPriority,
+        title: Optional[str],
+        sections: Optional[List[Section]] = None,
+    ) -> None:
+        self.job_id = job_id
+        self.url = url
+        self.quality = quality
+        self.priority = priority
+        self.sections = list(sections or [])
+        self.title = title
+        self.status = JobStatus.QUEUED
+        self.progress = 0.0
+        self.speed: Optional[float] = None
+        self.downloaded_bytes = 0
+        self.output_path: Optional[str] = None
+        self.output_paths: List[str] = []
+        self.error: Optional[str] = None
+        self.cancel_requested = False
+        self.worker_id: Optional[str] = None
+        # 貸し出しごとに変わる識別子。期限切れ後に元のワーカーから届いた報告を区別する
+        self.lease_id: Optional[str] = None
+        self.lease_expires = 0.0
+        self.attempts = 0
+        self.created_at = time.time()
+        self.finished_at: Optional[float] = None
+
+    @property
+    def is_finished(self) -> bool:
+        return self.status in FINISHED_STATUSES
+
+    def to_dict(self) -> dict:
+        return {
+            "job_id": self.job_id,
+            "url": self.url,
+            "title": self.title,
+            "quality": self.quality,
+            "clips": format_sections(self.sections) or None,
+            "priority": self.priority.name.lower(),
+            "status": self.status.value,
+            "progress": round(self.progress, 1),
+            "speed": self.speed,
+            "bytes": self.downloaded_bytes,
+            "output_path": self.output_path,
+            "output_paths": self.output_paths,
+            "error": self.error,
+            "worker_id": self.worker_id,
+            "attempts": self.attempts,
+        }
+
+    def lease_dict(self) -> dict:
+        """ワーカーに渡すジョブの内容"""
+        return {
+            "job_id": self.job_id,
+            "lease_id": self.lease_id,
+            "url": self.url,
+            "quality": self.quality,
+            "clips": format_sections(self.sections) or None,
+            "priority": self.priority.name.lower(),
+            "title": self.title,
+        }
+
+
+class Coordinator:
+    """
+    複数のマシンのワーカーにジョブを貸し出す (リース) キュー。
+    ワーカーはリースの期限内にハートビートで進捗を報告して期限を延長し、終わったら結果を報告する。
+    期限が切れたジョブはワーカーが止まったとみなして待機中に戻し、別のワーカーに貸し直す。
+    期限切れの確認は各操作の最初に行う
+    """
+
+    def __init__(
+        self, lease_seconds: float = config.lease_seconds, max_attempts: int = config.lease_max_attempts
+    ) -> None:
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.jobs: Dict[int, ClusterJob] = {}
+        # ワーカーID -> 最後にハートビートを受け取った時刻
+        self.workers: Dict[str, float] = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def submit(
+        self,
+        url: str,
+        quality: str,
+        priority: JobPriority = JobPriority.NORMAL,
+        title: Optional[str] = None,
+        sections: Optional[List[Section]] = None,
+    ) -> ClusterJob:
+        with self._lock:
+            job = ClusterJob(next(self._ids), url, quality, priority, title, sections)
+            self.jobs[job.job_id] = job
+            return job
+
+    def cancel(self, job_id: int) -> Optional[ClusterJob]:
+        """待機中なら即座に中止する。貸し出し中ならワーカーへの次のハートビートの応答で中止を指示する"""
+        with self._lock:
+            job = self.jobs.get(job_id)
+            if job is None or job.is_finished:
+                return job
+            job.cancel_requested = True
+            if job.status == JobStatus.QUEUED:
+                self._finish(job, JobStatus.CANCELLED)
+            return job
+
+    def _finish(self, job: ClusterJob, status: JobStatus) -> None:
+        job.status = status
+        job.speed = None
+        job.lease_id = None
+        job.finished_at = time.time()
+
+    def _expire(self, now: float) -> None:
+        for job in self.jobs.values():
+            if job.status != JobStatus.RUNNING or job.lease_expires > now:
+                continue
+            if job.cancel_requested:
+                self._finish(job, JobStatus.CANCELLED)
+            elif job.attempts >= self.max_attempts:
+                job.error = f"ワーカーからの応答が {job.attempts} 回途絶えました"
+                self._finish(job, JobStatus.FAILED)
+            else:
+                self._requeue(job)
+
+    def _requeue(self, job: ClusterJob) -> None:
+        job.status = JobStatus.QUEUED
+        job.lease_id = None
+        job.worker_id = None
+        job.progress = 0.0
+        job.speed = None
+
+    def lease(self, worker_id: str, capacity: int) -> List[ClusterJob]:
+        """待機中のジョブを優先度の高い順、同じ優先度なら投入順に最大 capacity 件貸し出す"""
+        now = time.time()
+        with self._lock:
+            self._expire(now)
+            self.workers[worker_id] = now
+            queued = [job for job in self.jobs.values() if job.status == JobStatus.QUEUED]
+            queued.sort(key=lambda job: (-job.priority.value, job.job_id))
+            leased = queued[: max(0, capacity)]
+            for job in leased:
+                job.status = JobStatus.RUNNING
+                job.worker_id = worker_id
+                job.lease_id = secrets.token_hex(8)
+                job.lease_expires = now + self.lease_seconds
+                job.attempts += 1
+            return leased
+
+    def _leased_job(self, worker_id: str, job_id: int, lease_id: Optional[str]) -> Optional[ClusterJob]:
+        job = self.jobs.get(job_id)
+        if job is None or job.status != JobStatus.RUNNING or job.worker_id != worker_id or job.lease_id != lease_id:
+            return None
+        return job
+
+    def heartbeat(self, worker_id: str, reports: List[dict]) -> Tuple[List[int], List[int]]:
+        """
+        ワーカーが実行中のジョブの進捗を報告し、リースを延長する。
+        (中止すべきジョブID, 既に他に貸し直したなどで手放すべきジョブID) を返す
+        """
+        now = time.time()
+        cancel, lost = [], []
+        with self._lock:
+            self._expire(now)
+            self.workers[worker_id] = now
+            for report in reports:
+                job = self._leased_job(worker_id, report.get("job_id"), report.get("lease_id"))
+                if job is None:
+                    lost.append(report.get("job_id"))
+                    continue
+                job.lease_expires = now + self.lease_seconds
+                job.title = report.get("title") or job.title
+                job.progress = float(report.get("progress") or 0.0)
+                job.speed = report.get("speed")
+                job.downloaded_bytes = int(report.get("bytes") or 0)
+                if job.cancel_requested:
+                    cancel.append(job.job_id)
+        return cancel, lost
+
+    def complete(self, worker_id: str, result: dict) -> bool:
+        """ジョブの結果を受け取る。リースが既に無効なら受け付けずに False を返す"""
+        try:
+            status = JobStatus(result.get("status"))
+        except ValueError:
+            raise ApiError(400, f"状態が正しくありません: {result.get('status')}")
+        if status not in FINISHED_STATUSES:
+            raise ApiError(400, f"終了していない状態は報告できません: {status.value}")
+        with self._lock:
+            self.workers[worker_id] = time.time()
+            job = self._leased_job(worker_id, result.get("job_id"), result.get("lease_id"))
+            if job is None:
+                return False
+            job.title = result.get("title") or job.title
+            job.output_path = result.get("output_path")
+            job.output_paths = [str(path) for path in result.get("output_paths") or []]
+            job.error = result.get("error")
+            job.downloaded_bytes = int(result.get("bytes") or 0)
+            if status == JobStatus.DONE:
+                job.progress = 100.0
+            self._finish(job, status)
+            return True
+
+    def release(self, worker_id: str, job_id: int, lease_id: Optional[str]) -> bool:
+        """
+        終了するワーカーが途中のジョブを返す。ワーカーの障害ではないため、試行回数に数えずに待機中に戻す。
+        リースが既に無効なら False を返す
+        """
+        with self._lock:
+            self.workers[worker_id] = time.time()
+            job = self._leased_job(worker_id, job_id, lease_id)
+            if job is None:
+                return False
+            if job.cancel_requested:
+                self._finish(job, JobStatus.CANCELLED)
+            else:
+                job.attempts -= 1
+                self._requeue(job)
+            return True
+
+    def snapshot(self) -> List[ClusterJob]:
+        with self._lock:
+            self._expire(time.time())
+            return list(self.jobs.values())
+
+
+class _CoordinatorHandler(ApiRequestHandler):
+    def _stream_events(self) -> None:
+        raise ApiError(404, "GET /events は使えません")
+
+
+class CoordinatorServer:
+    """
+    Coordinator をHTTP/JSONで公開するサーバー。ワーカーは別のマシンから接続するため、
+    ループバック以外で待ち受ける場合はトークンが必要
+
+        POST   /jobs       URLを投入する {"urls": [...], "quality", "priority", "clips"}
+        GET    /jobs       ジョブの一覧
+        GET    /jobs/<id>  ジョブの状態
+        DELETE /jobs/<id>  ジョブの中止
+        GET    /workers    ワーカーごとの最終応答時刻と実行中のジョブ
+        POST   /lease      {"worker_id", "capacity"} -> {"jobs": [...]}
+        POST   /heartbeat  {"worker_id", "jobs": [{"job_id", "lease_id", "progress", ...}]} -> {"cancel", "lost"}
+        POST   /complete   {"worker_id", "job_id", "lease_id", "status", "output_path", "output_paths", "error",
+                           "bytes"}
+        POST   /release    {"worker_id", "job_id", "lease_id"} 終了するワーカーが途中のジョブを返す
+    """
+
+    loopback_only = False
+    allowed_origins: set = set()
+
+    def __init__(
+        self,
+        coordinator: Coordinator,
+        host: str = "127.0.0.1",
+        port: int = config.coordinator_port,
+        token: Optional[str] = None,
+    ) -> None:
+        if host not in ("127.0.0.1", "localhost", "::1") and not token:
+            raise ValueError("ループバック以外で待ち受ける場合はトークンを指定してください")
+        self.coordinator = coordinator
+        self.host = host
+        self.port = port
+        self.token = token
+        self.default_quality = config.quality_options[config.quality_default_idx].split()[0].replace("p", "")
+        self._httpd: Optional[ApiHTTPServer] = None
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    def start(self) -> str:
+        server = self
+
+        class Handler(_CoordinatorHandler):
+            api = server
+
+        self._httpd = ApiHTTPServer((self.host, self.port), Handler)
+        self.port = self._httpd.server_address[1]
+        threading.Thread(target=self._httpd.serve_forever, daemon=True).start()
+        return self.url
+
+    def stop(self) -> None:
+        if self._httpd:
+            self._httpd.shutdown()
+            self._httpd.server_close()
+            self._httpd = None
+
+    @staticmethod
+    def _worker_id(body: dict) -> str:
+        worker_id = body.get("worker_id")
+        if not isinstance(worker_id, str) or not worker_id:
+            raise ApiError(400, "worker_id を指定してください")
+        return worker_id
+
+    def handle(self, method: str, parts: List[str], query: dict, read_body) -> Tuple[int, object]:
+        coordinator = self.coordinator
+        if parts == ["jobs"] and method == "GET":
+            return 200, [job.to_dict() for job in coordinator.snapshot()]
+        if parts == ["jobs"] and method == "POST":
+            body = read_body()
+            urls = body.get("urls") or ([body["url"]] if body.get("url") else [])
+            if not isinstance(urls, list) or not urls or not all(isinstance(url, str) for url in urls):
+                raise ApiError(400, "url または urls を指定してください")
+            priority = parse_priority(body.get("priority", JobPriority.NORMAL.name))
+            sections = parse_clips(body.get("clips"))
+            quality = str(body.get("quality") or self.default_quality).replace("p", "")
+            jobs = [coordinator.submit(url, quality, priority, sections=sections) for url in urls]
+            return 202, {"jobs": [job.to_dict() for job in jobs]}
+        if len(parts) == 2 and parts[0] == "jobs":
+            job = coordinator.jobs.get(int(parts[1])) if parts[1].isdigit() else None
+            if job is None:
+                raise ApiError(404, f"ジョブがありません: {parts[1]}")
+            if method == "GET":
+                return 200, job.to_dict()
+            if method == "DELETE":
+                return 202, coordinator.cancel(job.job_id).to_dict()
+        if parts == ["workers"] and method == "GET":
+            jobs = coordinator.snapshot()
+            return 200, {
+                worker_id: {
+                    "last_seen": last_seen,
+                    "jobs": [job.job_id for job in jobs if job.worker_id == worker_id and not job.is_finished],
+                }
+                for worker_id, last_seen in list(coordinator.workers.items())
+            }
+        if parts == ["lease"] and method == "POST":
+            body = read_body()
+            jobs = coordinator.lease(self._worker_id(body), int(body.get("capacity") or 1))
+            return 200, {"jobs": [job.lease_dict() for job in jobs], "lease_seconds": coordinator.lease_seconds}
+        if parts == ["heartbeat"] and method == "POST":
+            body = read_body()
+            cancel, lost = coordinator.heartbeat(self._worker_id(body), body.get("jobs") or [])
+            return 200, {"cancel": cancel, "lost": lost}
+        if parts == ["complete"] and method == "POST":
+            body = read_body()
+            return 200, {"accepted": coordinator.complete(self._worker_id(body), body)}
+        if parts == ["release"] and method == "POST":
+            body = read_body()
+            accepted = coordinator.release(self._worker_id(body), body.get("job_id"), body.get("lease_id"))
+            return 200, {"accepted": accepted}
+        raise ApiError(404 if method == "GET" else 405, f"{method} /{'/'.join(parts)} は使えません")
@@ -0,0 +1,80 @@
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Optional, Tuple
+
+from tool_manifest import file_sha256
+
+# (抽出器名, 動画ID, フォーマット) の組
+ArchiveKey = Tuple[str, str, str]
+
+
+class DownloadArchive:
+    """
+    ダウンロード済み動画の索引をSQLiteで管理するクラス。
+    (抽出器名, 動画ID, フォーマット) を主キーとし、保存先・サイズ・ハッシュを記録する
+    """
+
+    def __init__(self, db_path: Optional[Path] = None) -> None:
+        if db_path is None:
+            db_path = Path.home() / "Library" / "Application Support" / "yt-downloader" / "archive.sqlite3"
+        self.db_path = Path(db_path)
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        # 複数のスレッドから使うため、接続は1つにしてロックで保護する
+        if self._conn is None:
+            self.db_path.parent.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS downloads (
+                    extractor TEXT NOT NULL,
+                    video_id TEXT NOT NULL,
+                    format TEXT NOT NULL,
+                    path TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    sha256 TEXT NOT NULL,
+                    downloaded_at REAL NOT NULL,
+                    PRIMARY KEY (extractor, video_id, format)
+                )
+                """
+            )
+        return self._conn
+
+    def find(self, key: ArchiveKey) -> Optional[dict]:
+        """
+        ダウンロード済みならその記録を返す。記録済みでもファイルが無くなっていれば None を返す
+        """
+        with self._lock:
+            row = self._connect().execute(
+                "SELECT path, size, sha256, downloaded_at FROM downloads"
+                " WHERE extractor = ? AND video_id = ? AND format = ?",
+                key,
+            ).fetchone()
+        if row is None:
+            return None
+        path, size, sha256, downloaded_at = row
+        try:
+            if Path(path).stat().st_size != size:
+                return None
+        except OSError:
+            return None
+        return {"path": path, "size": size, "sha256": sha256, "downloaded_at": downloaded_at}
+
+    def record(self, key: ArchiveKey, path: str) -> None:
+        """
+        ダウンロードが完了したファイルを記録する
+        """
+        size = Path(path).stat().st_size
+        sha256 = file_sha256(Path(path))
+        with self._lock:
+            conn = self._connect()
+            conn.execute(
+                "INSERT OR REPLACE INTO downloads VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (*key, path, size, sha256, time.time()),
+            )
+            conn.commit()
@@ -0,0 +1,330 @@
+import asyncio
+import concurrent.futures
+import itertools
+import time
+from enum import Enum
+from typing import Awaitable, Callable, Dict, Hashable, List, Optional, Set, Tuple
+
+from bandwidth_scheduler import JobPriority
+from job_metrics import JobMetrics
+
+
+# 動画の一部だけを取得する場合の (開始, 終了) の秒数
+Section = Tuple[float, float]
+
+
+def parse_sections(text: str) -> List[Section]:
+    """
+    "1:30-2:00, 10:00-10:30" のような時間の範囲の指定を (開始, 終了) の秒数のリストに変換する。
+    指定が正しくなければ ValueError を送出する
+    """
+    from yt_dlp.utils import parse_duration
+
+    sections = []
+    for part in text.replace(",", " ").split():
+        start, sep, end = part.partition("-")
+        start_seconds, end_seconds = parse_duration(start or "0"), parse_duration(end)
+        if not sep or start_seconds is None or end_seconds is None or end_seconds <= start_seconds:
+            raise ValueError(f"範囲の指定が正しくありません: {part}")
+        sections.append((float(start_seconds), float(end_seconds)))
+    return sections
+
+
+def format_sections(sections: List[Section]) -> str:
+    return ",".join(f"{start:g}-{end:g}" for start, end in sections)
+
+
+class JobStatus(Enum):
+    """ダウンロードジョブの状態"""
+
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+    CANCELLED = "cancelled"
+    SKIPPED = "skipped"
+
+
+class JobCancelled(Exception):
+    """ジョブのキャンセル要求により処理を中断したことを示す例外"""
+
+
+class JobSkipped(Exception):
+    """ダウンロード済みなどの理由でジョブを実行しないことを示す例外"""
+
+
+class DownloadJob:
+    """1件のダウンロードジョブの状態を管理するクラス"""
+
+    def __init__(
+        self, job_id: int, url: str, save_folder: str, quality: str, priority: JobPriority = JobPriority.NORMAL
+    ) -> None:
+        self.job_id = job_id
+        self.url = url
+        self.save_folder = save_folder
+        self.quality = quality
+        self.priority = priority
+        # 取得する時間の範囲。空なら動画全体を取得する
+        self.sections: List[Section] = []
+        self.title: Optional[str] = None
+        self.status = JobStatus.QUEUED
+        self.progress = 0.0
+        self.speed: Optional[float] = None
+        self.error: Optional[str] = None
+        self.cancel_requested = False
+        self.output_path: Optional[str] = None
+        # 保存したファイル。範囲を指定したジョブでは範囲ごとのファイルが並び、output_path は最後のファイル
+        self.output_paths: List[str] = []
+        # 取得が完了したストリームの合計バイト数
+        self.downloaded_bytes = 0
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        # admit が返した重複判定用のキー
+        self.key: Optional[Hashable] = None
+        # 同じ動画を取得中の別ジョブに合流している場合、そのジョブのID
+        self.duplicate_of: Optional[int] = None
+        # 工程ごとの所要時間と転送の統計
+        self.metrics = JobMetrics()
+
+    @property
+    def is_finished(self) -> bool:
+        return self.status in (JobStatus.DONE, JobStatus.FAILED, JobStatus.CANCELLED, JobStatus.SKIPPED)
+
+    def check_cancelled(self) -> None:
+        """キャンセル要求があれば JobCancelled を送出する"""
+        if self.cancel_requested:
+            raise JobCancelled("Download cancelled")
+
+
+class DownloadQueue:
+    """
+    asyncioループ上で動くダウンロードキュー。
+    最大 max_workers 件のジョブを並列に実行し、残りは投入順に待機させる。
+    公開メソッドは任意のスレッドから呼び出せる。
+
+    admit を指定すると、投入されたジョブごとに別スレッドで呼び出される。
+    admit は重複判定用のキーを返すか、JobSkipped を送出してジョブを実行せずに終わらせる。
+    同じキーのジョブが待機中・実行中の場合、新しいジョブは新たに実行されずにそのジョブの結果を共有する。
+    """
+
+    def __init__(
+        self,
+        loop: asyncio.AbstractEventLoop,
+        run_job: Callable[[DownloadJob], Awaitable[None]],
+        max_workers: int = 1,
+        on_update: Optional[Callable[[DownloadJob], None]] = None,
+        admit: Optional[Callable[[DownloadJob], Optional[Hashable]]] = None,
+    ) -> None:
+        self.loop = loop
+        self.run_job = run_job
+        self.max_workers = max(1, max_workers)
+        self.on_update = on_update
+        self.admit = admit
+        self.jobs: Dict[int, DownloadJob] = {}
+        self._pending: List[DownloadJob] = []
+        self._running: Dict[int, asyncio.Task] = {}
+        # 実行中のうち、ダウンロードを終えて後処理に進んだため並列数に数えないジョブ
+        self._released: Set[int] = set()
+        # 枠を返した後、次の動画や範囲を取得するために枠を待っているジョブ
+        self._reacquiring: List[Tuple[int, asyncio.Future]] = []
+        self._ids = itertools.count(1)
+        self._admitting: Optional[asyncio.Queue] = None
+        self._leaders: Dict[Hashable, DownloadJob] = {}
+        self._followers: Dict[int, List[DownloadJob]] = {}
+
+    def submit(
+        self,
+        url: str,
+        save_folder: str,
+        quality: str,
+        title: Optional[str] = None,
+        priority: JobPriority = JobPriority.NORMAL,
+        sections: Optional[List[Section]] = None,
+    ) -> DownloadJob:
+        """ジョブをキューに追加する"""
+        job = DownloadJob(next(self._ids), url, save_folder, quality, priority)
+        job.title = title
+        job.sections = list(sections or [])
+        self.jobs[job.job_id] = job
+        self._notify(job)
+        self.loop.call_soon_threadsafe(self._enqueue, job)
+        return job
+
+    def cancel(self, job_id: int) -> None:
+        """指定ジョブをキャンセルする。実行中の場合は進捗フックで中断される"""
+        job = self.jobs.get(job_id)
+        if job is None or job.is_finished:
+            return
+        job.cancel_requested = True
+        self.loop.call_soon_threadsafe(self._cancel_pending, job)
+
+    def cancel_all(self) -> None:
+        for job_id in list(self.jobs):
+            self.cancel(job_id)
+
+    def set_max_workers(self, max_workers: int) -> None:
+        """並列数を変更する。減らした場合は実行中のジョブが終わるのを待って反映される"""
+        self.max_workers = max(1, max_workers)
+        self.loop.call_soon_threadsafe(self._dispatch)
+
+    def release_worker(self, job_id: int) -> None:
+        """
+        実行中のジョブの枠を空け、次のジョブを開始させる。ジョブ自体は完了まで実行を続ける。
+        ダウンロードを終えて後処理だけが残ったジョブから呼ぶ
+        """
+        self.loop.call_soon_threadsafe(self._release, job_id)
+
+    def reacquire_worker(self, job_id: int) -> "concurrent.futures.Future[None]":
+        """
+        release_worker で返した枠を取り直す。枠が空くと完了する Future を返す。
+        プレイリストの次の動画や次の範囲のダウンロードを始める前に呼ぶ。待機中の新しいジョブより先に枠を得る
+        """
+        return asyncio.run_coroutine_threadsafe(self._reacquire(job_id), self.loop)
+
+    def counts(self) -> Dict[JobStatus, int]:
+        result = {status: 0 for status in JobStatus}
+        for job in list(self.jobs.values()):
+            result[job.status] += 1
+        return result
+
+    @property
+    def pending_count(self) -> int:
+        """実行待ちのジョブ数。asyncioループ上から呼ぶこと"""
+        return len(self._pending)
+
+    @property
+    def is_idle(self) -> bool:
+        return all(job.is_finished for job in list(self.jobs.values()))
+
+    def _notify(self, job: DownloadJob) -> None:
+        if self.on_update:
+            self.on_update(job)
+
+    def _enqueue(self, job: DownloadJob) -> None:
+        if self.admit is None:
+            self._admit_done(job, None)
+            return
+        # 投入順を保つため、判定は1つのタスクで順番に行う
+        if self._admitting is None:
+            self._admitting = asyncio.Queue()
+            self.loop.create_task(self._admit_loop())
+        self._admitting.put_nowait(job)
+
+    async def _admit_loop(self) -> None:
+        while True:
+            job = await self._admitting.get()
+            if job.cancel_requested:
+                self._finish(job, JobStatus.CANCELLED)
+                continue
+            try:
+                key = await asyncio.to_thread(self.admit, job)
+            except JobSkipped as e:
+                job.error = str(e) or None
+                self._finish(job, JobStatus.SKIPPED)
+                continue
+            except Exception as e:
+                job.error = str(e)
+                self._finish(job, JobStatus.FAILED)
+                continue
+            self._admit_done(job, key)
+
+    def _admit_done(self, job: DownloadJob, key: Optional[Hashable]) -> None:
+        if job.cancel_requested:
+            self._finish(job, JobStatus.CANCELLED)
+            return
+        leader = self._leaders.get(key) if key is not None else None
+        if leader is not None:
+            job.duplicate_of = leader.job_id
+            self._followers.setdefault(leader.job_id, []).append(job)
+            self._notify(job)
+            return
+        job.key = key
+        if key is not None:
+            self._leaders[key] = job
+        self._pending.append(job)
+        self._dispatch()
+
+    def _cancel_pending(self, job: DownloadJob) -> None:
+        if job in self._pending:
+            self._pending.remove(job)
+            self._finish(job, JobStatus.CANCELLED)
+        elif job.duplicate_of is not None and job in self._followers.get(job.duplicate_of, []):
+            self._followers[job.duplicate_of].remove(job)
+            self._finish(job, JobStatus.CANCELLED)
+
+    def _release(self, job_id: int) -> None:
+        if job_id in self._running:
+            self._released.add(job_id)
+            self._dispatch()
+
+    async def _reacquire(self, job_id: int) -> None:
+        if job_id not in self._released:
+            return
+        waiter = self.loop.create_future()
+        entry = (job_id, waiter)
+        self._reacquiring.append(entry)
+        try:
+            self._dispatch()
+            await waiter
+        finally:
+            if entry in self._reacquiring:
+                self._reacquiring.remove(entry)
+
+    def _dispatch(self) -> None:
+        while self._reacquiring and len(self._running) - len(self._released) < self.max_workers:
+            job_id, waiter = self._reacquiring.pop(0)
+            if not waiter.done():
+                self._released.discard(job_id)
+                waiter.set_result(None)
+        if self._reacquiring:
+            return
+        while self._pending and len(self._running) - len(self._released) < self.max_workers:
+            job = self._pending.pop(0)
+            job.status = JobStatus.RUNNING
+            job.started_at = time.time()
+            self._notify(job)
+            self._running[job.job_id] = self.loop.create_task(self._run(job))
+
+    async def _run(self, job: DownloadJob) -> None:
+        try:
+            await self.run_job(job)
+            job.check_cancelled()
+            job.progress = 100.0
+            self._finish(job, JobStatus.DONE)
+        except Exception as e:
+            if job.cancel_requested:
+                self._finish(job, JobStatus.CANCELLED)
+            else:
+                job.error = str(e)
+                self._finish(job, JobStatus.FAILED)
+        finally:
+            self._running.pop(job.job_id, None)
+            self._released.discard(job.job_id)
+            self._dispatch()
+
+    def _finish(self, job: DownloadJob, status: JobStatus) -> None:
+        job.status = status
+        job.speed = None
+        job.finished_at = time.time()
+        self._notify(job)
+
+        key = job.key
+        if key is not None and self._leaders.get(key) is job:
+            del self._leaders[key]
+        followers = self._followers.pop(job.job_id, [])
+        if status == JobStatus.CANCELLED and followers:
+            # 合流先がキャンセルされた場合は、合流していたジョブの1件目が代わりに実行する
+            new_leader, *rest = followers
+            new_leader.duplicate_of = None
+            for follower in rest:
+                follower.duplicate_of = new_leader.job_id
+            self._followers[new_leader.job_id] = rest
+            self._admit_done(new_leader, key)
+            return
+        for follower in followers:
+            follower.title = follower.title or job.title
+            follower.progress = job.progress
+            follower.output_path = job.output_path
+            follower.output_paths = list(job.output_paths)
+            follower.error = job.error
+            self._finish(follower, status)
@@ -0,0 +1,764 @@
+import asyncio
+import glob
+import hashlib
+import importlib
+import os
+import shutil
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from pathlib import Path
+from threading import Lock, Thread
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional, Set, Tuple
+
+import config
+import tool_manager
+from bandwidth_scheduler import BandwidthScheduler, JobPriority
+from download_archive import ArchiveKey, DownloadArchive
+from download_queue import DownloadJob, DownloadQueue, JobSkipped, Section, format_sections
+from fragment_tuner import FragmentTuner
+from info_cache import InfoCache, is_single_video, resolve_video_key
+from job_journal import JobJournal
+from job_metrics import MetricsRecorder
+from postprocess_pool import PostprocessPool
+from ydl_sessions import YdlSessionPool
+from tool_manager import BootstrapCallback
+
+# yt-dlp は全抽出器を読み込むため import が重い。起動を速くするため使う直前まで読み込まない
+if TYPE_CHECKING:
+    from yt_dlp import YoutubeDL
+
+APP_SUPPORT_DIR = Path.home() / "Library" / "Application Support" / "yt-downloader"
+COOKIE_FILE = APP_SUPPORT_DIR / "cookies.txt"
+
+# 画質 (高さ) の代わりに指定するモード。映像を取得せずに音声だけ、または動画の情報ファイルだけを保存する
+AUDIO_ONLY = "audio"
+METADATA_ONLY = "metadata"
+
+
+def available_heights(info: dict) -> List[int]:
+    """
+    動画情報から選択可能な解像度 (高さ) を降順で返す
+    """
+    return sorted(
+        {f["height"] for f in info.get("formats") or [] if f.get("height") and f.get("vcodec") != "none"},
+        reverse=True,
+    )
+
+
+def staging_dir(job: DownloadJob) -> str:
+    """
+    ジョブの取得途中のファイルを置く作業フォルダ。保存フォルダの中に作るため、完成したファイルの移動は名前の変更で済む。
+    再開したジョブが同じフォルダを使うよう、フォルダ名はURLと画質と範囲から決める
+    """
+    source = f"{job.url}\n{job.quality}"
+    if job.sections:
+        source += f"\n{format_sections(job.sections)}"
+    digest = hashlib.sha1(source.encode("utf-8")).hexdigest()[:16]
+    return os.path.join(job.save_folder, config.staging_dir_name, digest)
+
+
+def format_options(quality: str) -> dict:
+    """
+    画質またはモードに応じたフォーマットの選択と後処理の YoutubeDL オプションを返す。
+    音声のみのモードはm4a (なければopus) の音声ストリームだけを取得し、変換せずにタグとサムネイルを埋め込む。
+    情報のみのモードはメディアを取得せず、情報JSON・サムネイル・字幕だけを書き出す
+    """
+    if quality == AUDIO_ONLY:
+        return {
+            "format": "bestaudio[ext=m4a]/bestaudio[acodec=opus]/bestaudio/best",
+            "writethumbnail": True,
+            # best は元のコーデックのまま取り出すため、m4a・opus ならストリームのコピーで済む
+            "postprocessors": [
+                {"key": "FFmpegExtractAudio", "preferredcodec": "best"},
+                {"key": "FFmpegMetadata", "add_metadata": True},
+                # opus への埋め込みには mutagen が必要なため、埋め込めなくても失敗にしない
+                {"key": "EmbedThumbnail", "optional": True},
+            ],
+        }
+    if quality == METADATA_ONLY:
+        return {
+            "skip_download": True,
+            # フォーマットの無い動画 (配信予定など) でも情報は書き出す
+            "ignore_no_formats_error": True,
+            "writeinfojson": True,
+            "writethumbnail": True,
+            "writesubtitles": True,
+            "subtitleslangs": config.metadata_subtitle_langs,
+            "postprocessors": [],
+        }
+    return {
+        "format": f"bv*[vcodec*=avc1][height<={quality}]+bestaudio[ext=m4a]/"
+        f"bv*[vcodec*=avc1][height<={quality}]+234/best",
+        "merge_output_format": "mp4",
+        "postprocessors": [
+            {
+                "key": "EmbedThumbnail",
+            },
+        ],
+    }
+
+
+def required_tools(job: DownloadJob) -> Tuple[str, ...]:
+    """
+    ジョブの実行前に準備できている必要があるツールをフォーマットと後処理から決める。
+    映像と音声の結合・範囲の切り出し・ffmpeg の後処理には ffmpeg と ffprobe を、
+    省略できない (optional でない) サムネイルの埋め込みには AtomicParsley を使う。情報のみのモードはツールを待たない
+    """
+    options = format_options(job.quality)
+    postprocessors = options.get("postprocessors", [])
+    tools: List[str] = []
+    if not options.get("skip_download") and (
+        job.sections
+        or "+" in options.get("format", "")
+        or any(pp["key"].startswith("FFmpeg") for pp in postprocessors)
+    ):
+        tools += ["ffmpeg", "ffprobe"]
+    if any(pp["key"] == "EmbedThumbnail" and not pp.get("optional") for pp in postprocessors):
+        tools.append("AtomicParsley")
+    return tuple(tools)
+
+
+def format_key(job: DownloadJob) -> str:
+    """アーカイブのキーに使うフォーマット。画質と範囲で決まる"""
+    return f"{job.quality}@{format_sections(job.sections)}" if job.sections else job.quality
+
+
+def archive_keys(key: ArchiveKey, job: DownloadJob) -> List[ArchiveKey]:
+    """
+    ジョブの保存したファイルをアーカイブに記録するキーを返す。
+    範囲を指定したジョブは範囲ごとにファイルができるため、範囲の番号を付けたキーをファイルごとに使う
+    """
+    if not job.sections:
+        return [key]
+    extractor, video_id, format_key = key
+    return [(extractor, video_id, f"{format_key}#{index}") for index in range(len(job.sections))]
+
+
+def _preload_yt_dlp() -> None:
+    from yt_dlp.extractor import gen_extractor_classes
+
+    gen_extractor_classes()
+    for module in ("job_ydl", "media_planner", "playlist_expander"):
+        importlib.import_module(module)
+
+
+def metrics_entry(job: DownloadJob) -> dict:
+    """
+    ジョブの計測結果をログに記録する形式で返す。待機時間は queue 工程として加える
+    """
+    entry = {
+        "job_id": job.job_id,
+        "url": job.url,
+        "title": job.title,
+        "status": job.status.value,
+        "duplicate_of": job.duplicate_of,
+        "error": job.error,
+        "started_at": job.started_at,
+        "finished_at": job.finished_at,
+        "bytes": job.downloaded_bytes,
+        **job.metrics.to_dict(),
+    }
+    # 範囲を指定したジョブで、動画全体を取得した場合と比べて取得せずに済んだバイト数
+    full_bytes = entry["full_bytes"]
+    entry["bytes_avoided"] = max(0, full_bytes - job.downloaded_bytes) if full_bytes is not None else None
+    if job.started_at is not None:
+        entry["stages"]["queue"] = job.started_at - job.metrics.created_at
+    return entry
+
+
+class DownloaderCore:
+    """
+    UIに依存しないダウンロード処理の本体。
+    専用スレッドのasyncioループ上でダウンロードキュー、ツールの準備、動画情報の先読みを動かす。
+    状態の変化はコールバックで通知され、コールバックは任意のスレッドから呼ばれる
+    """
+
+    def __init__(
+        self,
+        max_workers: int = config.max_concurrent_downloads,
+        on_job_update: Optional[Callable[[DownloadJob], None]] = None,
+        on_tool_progress: Optional[BootstrapCallback] = None,
+        manage_tools: bool = True,
+        ydl_overrides: Optional[dict] = None,
+        journal_path: Optional[Path] = None,
+        tool_mirrors: Optional[List[str]] = None,
+        data_dir: Optional[Path] = None,
+    ) -> None:
+        """
+        manage_tools が False の場合はツールのダウンロードを行わず、PATH上のffmpeg等を使う。
+        ydl_overrides はジョブごとの YoutubeDL オプションに最後に上書きされる。
+        journal_path は未完了のジョブを記録するファイルで、省略時は data_dir の jobs.sqlite3 を使う。
+        tool_mirrors はツールの取得元のミラーで、省略時は config.tool_mirrors を使う。
+        data_dir はツール・キャッシュ・アーカイブ・Cookie などを置くフォルダで、省略時はGUIと同じ APP_SUPPORT_DIR を使う
+        """
+        data_dir = Path(data_dir) if data_dir is not None else APP_SUPPORT_DIR
+        self.on_job_update = on_job_update
+        # on_job_update の他にジョブの状態の変化を受け取るコールバック (APIサーバーなど)
+        self._job_listeners: List[Callable[[DownloadJob], None]] = []
+        self.manage_tools = manage_tools
+        self.ydl_overrides = ydl_overrides or {}
+        self.tool_manager = tool_manager.ToolManager(data_dir / "tools", mirrors=tool_mirrors)
+        self.tool_bootstrap = tool_manager.ToolBootstrap(self.tool_manager, on_progress=on_tool_progress)
+        self.info_cache = InfoCache(data_dir / "cache" / "info")
+        self.archive = DownloadArchive(data_dir / "archive.sqlite3")
+        self.metrics_recorder = MetricsRecorder(data_dir / "metrics")
+        self.bandwidth = BandwidthScheduler()
+        self.fragment_tuner = FragmentTuner()
+        self.postprocess_pool = PostprocessPool()
+        self.sessions = YdlSessionPool(data_dir / COOKIE_FILE.name)
+        self.journal = JobJournal(journal_path or data_dir / "jobs.sqlite3")
+        # ジャーナルへの書き込みは呼び出し元 (Tkやasyncioループ) を待たせないよう、順番を保って1つのスレッドで行う
+        self._journal_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="journal")
+        # ジョブID -> 最後に記録した状態
+        self._journal_snapshots: Dict[int, tuple] = {}
+        self._journal_lock = Lock()
+        # ジョブID -> ジャーナルの記録ID。ジャーナルのスレッドだけが使う
+        self._journal_records: Dict[int, int] = {}
+        # ジョブID -> 取得途中のファイル
+        self._partials: Dict[int, Set[str]] = {}
+        # 後処理に進んでダウンロードの枠と帯域を返したジョブ
+        self._handed_off: Set[int] = set()
+        self.playlist_expansions: List[Future] = []
+        self._prefetch_tasks: Dict[str, asyncio.Task] = {}
+
+        self.loop = asyncio.new_event_loop()
+        self.thread = Thread(target=self._start_asyncio_loop, daemon=True)
+        self.thread.start()
+
+        self.queue = DownloadQueue(
+            self.loop,
+            self.download_video,
+            max_workers=max_workers,
+            on_update=self._notify_job,
+            admit=self._admit_job,
+        )
+
+    def _start_asyncio_loop(self) -> None:
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def close(self) -> None:
+        """
+        残っているタスクを止めてasyncioループのスレッドを終了する。
+        実行中のジョブは先に cancel_all() で止めておくこと
+        """
+
+        async def cancel_tasks() -> None:
+            tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        asyncio.run_coroutine_threadsafe(cancel_tasks(), self.loop).result(timeout=10)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(timeout=5)
+        self._journal_executor.shutdown(wait=True)
+        self.sessions.close()
+
+    def preload(self) -> Future:
+        """
+        yt-dlp とその抽出器の読み込みをバックグラウンドで済ませておく。
+        ウィンドウの表示後に呼ぶと、最初のダウンロードや先読みで読み込みを待たずに済む
+        """
+        return asyncio.run_coroutine_threadsafe(asyncio.to_thread(_preload_yt_dlp), self.loop)
+
+    def resume_unfinished(self) -> List[DownloadJob]:
+        """
+        前回の終了時に終わっていなかったジョブを投入し直す。
+        保存先のファイル名が同じになるため、yt-dlp は途中のファイル (.part など) から続きを取得する
+        """
+        jobs = []
+        for record in self.journal.unfinished():
+            self.journal.remove(record["id"])
+            job = self.queue.submit(
+                record["url"],
+                record["save_folder"],
+                record["quality"],
+                title=record["title"],
+                priority=JobPriority[record["priority"]],
+                sections=[tuple(section) for section in record["sections"]],
+            )
+            jobs.append(job)
+        return jobs
+
+    def start_tool_bootstrap(self) -> Future:
+        """不足しているツールの取得をバックグラウンドで開始する"""
+        return asyncio.run_coroutine_threadsafe(self.tool_bootstrap.run(), self.loop)
+
+    def submit(
+        self,
+        url: str,
+        save_folder: str,
+        quality: str,
+        priority: JobPriority = JobPriority.NORMAL,
+        sections: Optional[List[Section]] = None,
+    ) -> DownloadJob:
+        """sections を指定すると、その時間の範囲だけを取得して範囲ごとのファイルに保存する"""
+        return self.queue.submit(url, save_folder, quality, priority=priority, sections=sections)
+
+    def expand_playlist(
+        self,
+        url: str,
+        save_folder: str,
+        quality: str,
+        match_filter: Optional[str] = None,
+        on_job: Optional[Callable[[DownloadJob], None]] = None,
+        priority: JobPriority = JobPriority.NORMAL,
+    ) -> Future:
+        """
+        プレイリストを展開しながらジョブを投入する。最初のページからダウンロードが始まる。
+        戻り値の Future は展開が終わると投入した件数を返す
+        """
+        from playlist_expander import expand_into_queue
+
+        expansion = asyncio.run_coroutine_threadsafe(
+            expand_into_queue(
+                self.queue,
+                url,
+                save_folder,
+                quality,
+                self.cookie_options(),
+                match_filter,
+                on_job=on_job,
+                priority=priority,
+            ),
+            self.loop,
+        )
+        self.playlist_expansions.append(expansion)
+        expansion.add_done_callback(self.playlist_expansions.remove)
+        return expansion
+
+    def cancel(self, job_id: int) -> None:
+        self.queue.cancel(job_id)
+
+    def cancel_all(self) -> None:
+        """展開中のプレイリストも含めて全ジョブを中止する"""
+        for expansion in list(self.playlist_expansions):
+            expansion.cancel()
+        self.queue.cancel_all()
+
+    def set_max_workers(self, max_workers: int) -> None:
+        self.queue.set_max_workers(max_workers)
+
+    def set_bandwidth_limit(self, rate_limit: Optional[float]) -> None:
+        """全体の帯域の上限 (バイト/秒) を変更する。実行中のジョブにもすぐに反映される。0 または None で無制限"""
+        self.bandwidth.set_rate_limit(rate_limit)
+
+    def set_priority(self, job_id: int, priority: JobPriority) -> None:
+        """ジョブの優先度を変更する。実行中なら帯域の配分がすぐに変わる"""
+        job = self.queue.jobs.get(job_id)
+        if job is None or job.is_finished:
+            return
+        job.priority = priority
+        self.bandwidth.set_priority(job_id, priority)
+        self._notify_job(job)
+
+    def prefetch(self, url: str) -> Future:
+        """
+        動画情報をバックグラウンドで取得してキャッシュする。戻り値の Future は動画情報を返す
+        """
+        return asyncio.run_coroutine_threadsafe(self._prefetch(url), self.loop)
+
+    async def _prefetch(self, url: str) -> dict:
+        task = self._prefetch_tasks.get(url)
+        if task is None:
+            task = self.loop.create_task(self._get_info(url))
+            self._prefetch_tasks[url] = task
+            task.add_done_callback(lambda _: self._prefetch_tasks.pop(url, None))
+        info, _ = await task
+        return info
+
+    async def _get_info(self, url: str) -> Tuple[dict, bool]:
+        """
+        キャッシュにあればそれを、なければ extract_info で取得してキャッシュした動画情報を返す。
+        プレイリストやチャンネルの項目は解決しない。watch?v=…&list=… のようなURLは動画の情報だけを取得する。
+        2つ目の値は、その情報を url のジョブにそのまま使えるか (url 自体が1本の動画か)
+        """
+        key = await asyncio.to_thread(resolve_video_key, url)
+        info = await asyncio.to_thread(self.info_cache.get, key)
+        if info is not None:
+            return info, True
+
+        def extract() -> Tuple[dict, Optional[str]]:
+            from job_ydl import JobYoutubeDL
+
+            options = {**self.cookie_options(), "quiet": True, "no_warnings": True, "noplaylist": True}
+            with JobYoutubeDL(options, sessions=self.sessions) as ydl:
+                # 加工前の結果を取得し、プレイリストの項目をここで全て取得しないようにする
+                info = ydl.extract_info(url, download=False, process=False)
+                followed = None
+                if info.get("_type") in ("url", "url_transparent"):
+                    followed = info["url"]
+                    info = ydl.extract_info(followed, download=False, process=False, ie_key=info.get("ie_key"))
+                if info.get("_type", "video") != "video":
+                    return {"_type": info["_type"], "id": info.get("id"), "title": info.get("title")}, followed
+                return ydl.sanitize_info(info, remove_private_keys=True), followed
+
+        info, followed = await asyncio.to_thread(extract)
+        if info.get("_type", "video") != "video":
+            return info, False
+        if followed is not None:
+            # 別のURLの動画の情報なので、その動画として保存する。url のジョブ (プレイリスト全体など) には使わない
+            key = await asyncio.to_thread(resolve_video_key, followed)
+        await asyncio.to_thread(self.info_cache.put, key, info)
+        return info, followed is None
+
+    async def _get_cached_info(self, url: str) -> Optional[dict]:
+        # 先読み中なら完了を待って結果を使う
+        task = self._prefetch_tasks.get(url)
+        if task is not None:
+            try:
+                info, direct = await asyncio.shield(task)
+            except Exception:
+                return None
+            return info if direct else None
+        key = await asyncio.to_thread(resolve_video_key, url)
+        return await asyncio.to_thread(self.info_cache.get, key)
+
+    def _admit_job(self, job: DownloadJob) -> Optional[ArchiveKey]:
+        """
+        キュー投入時に別スレッドで呼ばれる。ダウンロード済みの動画はスキップし、
+        取得中の動画との重複判定に使うキーを返す。
+        プレイリストやチャンネルは後から動画が増えるため、URL全体ではスキップも重複判定もしない。
+        取得済みの動画はダウンロード中に項目ごとに飛ばす
+        """
+        if not is_single_video(job.url):
+            return None
+        extractor, video_id = resolve_video_key(job.url)
+        key = (extractor, video_id, format_key(job))
+        records = [self.archive.find(output_key) for output_key in archive_keys(key, job)]
+        if all(records):
+            job.output_paths = [record["path"] for record in records]
+            job.output_path = job.output_paths[-1]
+            raise JobSkipped(", ".join(job.output_paths))
+        return key
+
+    async def download_video(self, job: DownloadJob) -> None:
+        if self.manage_tools:
+            with job.metrics.span("tools"):
+                await self.tool_bootstrap.wait_for(required_tools(job))
+        job.check_cancelled()
+        with job.metrics.span("info_cache"):
+            info = await self._get_cached_info(job.url)
+        if info is not None and info.get("_type", "video") == "video":
+            job.title = info.get("title") or job.title
+        else:
+            info = None
+        self.bandwidth.register(job.job_id, job.priority)
+        try:
+            with self.create_ydl(job) as ydl:
+                job.check_cancelled()
+                await asyncio.to_thread(self._run_ydl, ydl, job, info)
+        except Exception:
+            # 失敗や中止で終わったジョブは再開されないため、作業フォルダごと消す。
+            # 終了時の中断 (CancelledError) はジャーナルから再開するのでここを通らず残る。
+            # yt-dlp のスレッドが終わってから消すため、消し残しや書き込み中のファイルは生じない
+            if not (job.cancel_requested and config.keep_partial_files_on_cancel):
+                await asyncio.to_thread(self._remove_partials, job)
+                await asyncio.to_thread(self._remove_staging, job)
+            raise
+        finally:
+            self.bandwidth.unregister(job.job_id)
+            self._handed_off.discard(job.job_id)
+            self._partials.pop(job.job_id, None)
+        # 完成したファイルは保存フォルダに移動済みのため、残った中間ファイルは作業フォルダごと消す
+        await asyncio.to_thread(self._remove_staging, job)
+        job.check_cancelled()
+
+    def _run_ydl(self, ydl: "YoutubeDL", job: DownloadJob, info: Optional[dict]) -> None:
+        """
+        キャッシュ済みの動画情報があれば再抽出せずにダウンロードする。
+        キャッシュのURLが期限切れなどで失敗した場合はURLから抽出し直す
+        """
+        from yt_dlp.utils import DownloadError
+
+        if info is not None:
+            try:
+                ydl.process_ie_result(info, download=True)
+                return
+            except DownloadError:
+                self.info_cache.invalidate(resolve_video_key(job.url))
+        # 抽出とダウンロードの時間を分けて計測するため、ydl.download() と同じ処理を2段階で行う
+        with job.metrics.span("extract"):
+            ie_result = ydl.extract_info(job.url, download=False, process=False)
+        ydl.process_ie_result(ie_result, download=True)
+
+    def create_ydl(self, job: DownloadJob) -> "YoutubeDL":
+        """
+        ジョブ用の YoutubeDL を作る。MP4への変換 (MediaPlanner) は postprocessors の指定より先に実行する。
+        音声のみ・情報のみのモードでは変換しない。
+        ydl_overrides で concurrent_fragment_downloads を指定した場合は、フラグメントの同時取得数を自動で調整しない
+        """
+        from yt_dlp.postprocessor import get_postprocessor
+
+        from job_ydl import JobYoutubeDL
+        from media_planner import MediaPlannerPP, OptionalEmbedThumbnailPP
+
+        ydl_opts = self.create_ydl_options(job)
+        postprocessors = ydl_opts.pop("postprocessors", [])
+        fragment_tuner = None if "concurrent_fragment_downloads" in self.ydl_overrides else self.fragment_tuner
+        ydl = JobYoutubeDL(
+            ydl_opts,
+            fragment_tuner=fragment_tuner,
+            metrics=job.metrics,
+            postprocess_pool=self.postprocess_pool,
+            on_download_finished=lambda: self._on_download_finished(job),
+            on_download_started=lambda: self._on_download_started(job),
+            is_archived=lambda info: self._is_archived(job, info),
+            on_entry_downloaded=lambda info, paths: self._record_entry(job, info, paths),
+            throttle=lambda stream, received: self._throttle_ffmpeg(job, stream, received),
+            sessions=self.sessions,
+        )
+        if job.quality not in (AUDIO_ONLY, METADATA_ONLY):
+            ydl.add_post_processor(
+                MediaPlannerPP(ydl, on_plan=lambda plan: setattr(job.metrics, "media_plan", plan))
+            )
+        for pp_def in postprocessors:
+            pp_def = dict(pp_def)
+            when = pp_def.pop("when", "post_process")
+            key = pp_def.pop("key")
+            if pp_def.pop("optional", False) and key == "EmbedThumbnail":
+                pp_class = OptionalEmbedThumbnailPP
+            else:
+                pp_class = get_postprocessor(key)
+            ydl.add_post_processor(pp_class(ydl, **pp_def), when=when)
+        return ydl
+
+    def create_ydl_options(self, job: DownloadJob) -> dict:
+        ydl_opts = {
+            "outtmpl": "%(title)s (%(section_start)d-%(section_end)d).%(ext)s" if job.sections else "%(title)s.%(ext)s",
+            # 中間ファイルは作業フォルダに書き、後処理が終わったファイルだけを保存フォルダに移す
+            "paths": {"home": job.save_folder, "temp": staging_dir(job)},
+            "no_check_certificates": True,
+            "verbose": True,
+            "no_warnings": False,
+            "progress_hooks": [
+                job.metrics.on_progress,
+                lambda data: self.update_progress(job, data),
+                lambda data: self._track_partial(job, data),
+                lambda data: self._throttle(job, data),
+            ],
+            "postprocessor_hooks": [job.metrics.on_postprocessor, lambda data: self._on_postprocessor(job, data)],
+            "retry_sleep_functions": {"http": job.metrics.on_retry, "fragment": job.metrics.on_retry},
+            # 全ての後処理が終わった最終的なファイルパスを受け取る
+            "post_hooks": [lambda path: self._on_output(job, path)],
+            "quiet": False,
+            **format_options(job.quality),
+        }
+
+        if job.sections:
+            from yt_dlp.utils import download_range_func
+
+            # ffmpeg で範囲を含む部分だけを取得する。再エンコードせず、範囲の直前のキーフレームから切り出す
+            ydl_opts["download_ranges"] = download_range_func(None, job.sections)
+            ydl_opts["force_keyframes_at_cuts"] = False
+
+        if self.manage_tools:
+            ydl_opts["ffmpeg_location"] = str(self.tool_manager.save_dir / "ffmpeg")
+
+        ydl_opts.update(self.cookie_options())
+        ydl_opts.update(self.ydl_overrides)
+        return ydl_opts
+
+    def cookie_options(self) -> dict:
+        return self.sessions.cookie_options()
+
+    def add_job_listener(self, listener: Callable[[DownloadJob], None]) -> None:
+        """ジョブの状態の変化を受け取るコールバックを追加する。任意のスレッドから呼ばれる"""
+        self._job_listeners.append(listener)
+
+    def remove_job_listener(self, listener: Callable[[DownloadJob], None]) -> None:
+        if listener in self._job_listeners:
+            self._job_listeners.remove(listener)
+
+    def save_cookies(self, text: str) -> None:
+        """Cookie の設定を保存する。以降に始まるジョブから新しい Cookie を使う"""
+        self.sessions.save_cookie_file(text)
+
+    def _notify_job(self, job: DownloadJob) -> None:
+        self._journal_job(job)
+        if job.is_finished:
+            # 終了の通知はasyncioループ上で1回だけ呼ばれる
+            job.metrics.close(job.error)
+            self.loop.run_in_executor(None, self.metrics_recorder.record, metrics_entry(job))
+        if self.on_job_update:
+            self.on_job_update(job)
+        for listener in list(self._job_listeners):
+            listener(job)
+
+    def update_progress(self, job: DownloadJob, data: dict) -> None:
+        if job.cancel_requested:
+            from yt_dlp.utils import DownloadCancelled
+
+            raise DownloadCancelled("Download cancelled")
+
+        if data["status"] == "downloading":
+            self._update_download_progress(job, data)
+        elif data["status"] == "finished":
+            self._update_finished_progress(job, data)
+
+    def _on_download_finished(self, job: DownloadJob) -> None:
+        # 後処理の間は帯域を使わないため、帯域とダウンロードの枠を次のジョブに回す
+        self.bandwidth.unregister(job.job_id)
+        self.queue.release_worker(job.job_id)
+        self._handed_off.add(job.job_id)
+
+    def _on_download_started(self, job: DownloadJob) -> None:
+        """
+        プレイリストの2件目以降や2つ目以降の範囲は、前の後処理で返した枠を取り直してからダウンロードする。
+        yt-dlp のスレッドから呼ばれ、枠が空くまで待つ
+        """
+        if job.job_id not in self._handed_off:
+            return
+        future = self.queue.reacquire_worker(job.job_id)
+        while True:
+            try:
+                future.result(timeout=0.25)
+                break
+            except FutureTimeoutError:
+                if job.cancel_requested:
+                    future.cancel()
+                    from yt_dlp.utils import DownloadCancelled
+
+                    raise DownloadCancelled("Download cancelled")
+        self._handed_off.discard(job.job_id)
+        self.bandwidth.register(job.job_id, job.priority)
+
+    def _entry_keys(self, job: DownloadJob, info: dict) -> List[ArchiveKey]:
+        # 汎用抽出器のIDはファイル名などから作られ動画を区別できないため、アーカイブに使わない
+        extractor = info.get("extractor_key") or info.get("ie_key")
+        if not extractor or extractor == "Generic" or not info.get("id"):
+            return []
+        return archive_keys((extractor, str(info["id"]), format_key(job)), job)
+
+    def _is_archived(self, job: DownloadJob, info: dict) -> bool:
+        """yt-dlp のスレッドから動画ごとに呼ばれる。全てのファイルがアーカイブにあれば True"""
+        keys = self._entry_keys(job, info)
+        return bool(keys) and all(self.archive.find(key) for key in keys)
+
+    def _record_entry(self, job: DownloadJob, info: dict, paths: List[str]) -> None:
+        """yt-dlp のスレッドから動画ごとに呼ばれ、保存したファイルをその動画のキーでアーカイブに記録する"""
+        keys = self._entry_keys(job, info)
+        if len(paths) != len(keys) or not all(os.path.exists(path) for path in paths):
+            return
+        with job.metrics.span("archive"):
+            for key, path in zip(keys, paths):
+                self.archive.record(key, path)
+
+    def _on_output(self, job: DownloadJob, path: str) -> None:
+        # 範囲を指定したジョブやプレイリストでは、ファイルごとに呼ばれる
+        if path not in job.output_paths:
+            job.output_paths.append(path)
+        job.output_path = path
+
+    def _journal_job(self, job: DownloadJob) -> None:
+        """
+        ジョブの状態の変化をジャーナルに書く。進捗だけの通知は高頻度なので書き込まない
+        """
+        snapshot = (job.status, job.priority, job.title, job.output_path)
+        with self._journal_lock:
+            previous = self._journal_snapshots.get(job.job_id)
+            if previous is None:
+                if job.is_finished:
+                    return
+                action = "add"
+            elif job.is_finished:
+                action = "remove"
+            elif previous != snapshot:
+                action = "update"
+            else:
+                return
+            if action == "remove":
+                del self._journal_snapshots[job.job_id]
+            else:
+                self._journal_snapshots[job.job_id] = snapshot
+        self._journal_executor.submit(self._write_journal, action, job)
+
+    def _write_journal(self, action: str, job: DownloadJob) -> None:
+        """ジャーナルのスレッドで1件の変更を書き込む"""
+        try:
+            if action == "add":
+                self._journal_records[job.job_id] = self.journal.add(job)
+                return
+            record_id = self._journal_records.get(job.job_id)
+            if record_id is None:
+                return
+            if action == "remove":
+                del self._journal_records[job.job_id]
+                self.journal.remove(record_id)
+            elif action == "update":
+                self.journal.update(record_id, job)
+        except Exception as e:
+            print(f"ジャーナルへの書き込みに失敗しました: {e}")
+
+    def _track_partial(self, job: DownloadJob, data: dict) -> None:
+        # 中止したときに消す途中のファイルを覚えておく。再開時は yt-dlp が同じ名前のファイルから続きを取得する
+        if data["status"] != "downloading":
+            return
+        tmpfilename = data.get("tmpfilename")
+        if tmpfilename:
+            self._partials.setdefault(job.job_id, set()).add(tmpfilename)
+
+    def _on_postprocessor(self, job: DownloadJob, data: dict) -> None:
+        # 後処理中は進捗フックが呼ばれないため、各後処理の前後でもキャンセルを確認する
+        if job.cancel_requested:
+            from yt_dlp.utils import DownloadCancelled
+
+            raise DownloadCancelled("Download cancelled")
+
+    def _remove_partials(self, job: DownloadJob) -> None:
+        """
+        中止したジョブの途中のファイルを消す。フラグメント形式では断片と再開用の .ytdl ファイルも消す
+        """
+        for tmpfilename in self._partials.get(job.job_id, ()):
+            final = tmpfilename[: -len(".part")] if tmpfilename.endswith(".part") else tmpfilename
+            paths = [tmpfilename, f"{final}.ytdl", *glob.glob(glob.escape(tmpfilename) + "-Frag*")]
+            for path in paths:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                except OSError as e:
+                    print(f"途中のファイルを削除できませんでした: {path}: {e}")
+
+    def _remove_staging(self, job: DownloadJob) -> None:
+        path = staging_dir(job)
+        shutil.rmtree(path, ignore_errors=True)
+        try:
+            # 他のジョブが使っていなければ作業フォルダの親も消す
+            os.rmdir(os.path.dirname(path))
+        except OSError:
+            pass
+
+    def _throttle(self, job: DownloadJob, data: dict) -> None:
+        # 帯域の割り当てを超えていれば、ダウンロードのスレッドをここで待たせる
+        if data["status"] == "downloading":
+            self.bandwidth.report(
+                job.job_id,
+                data.get("filename") or "",
+                data.get("downloaded_bytes") or 0,
+                cancelled=lambda: job.cancel_requested,
+            )
+
+    def _throttle_ffmpeg(self, job: DownloadJob, stream: str, received: int) -> None:
+        # ffmpeg で取得する範囲は ThrottleProxy の中継スレッドから呼ばれ、進捗フックと同じ割り当てで待たせる。
+        # 進捗フックが呼ばれず中止を確認できないため、ここで例外を送出して接続を切る
+        self._throttle(job, {"status": "downloading", "filename": stream, "downloaded_bytes": received})
+        job.check_cancelled()
+
+    def _update_download_progress(self, job: DownloadJob, data: dict) -> None:
+        try:
+            job.title = (data.get("info_dict") or {}).get("title") or job.title
+            downloaded = data.get("downloaded_bytes", 0)
+            total = data.get("total_bytes") or data.get("total_bytes_estimate", 0)
+
+            if total > 0:
+                job.progress = (downloaded / total) * 100
+                job.speed = data.get("speed")
+                self._notify_job(job)
+        except Exception:
+            pass
+
+    def _update_finished_progress(self, job: DownloadJob, data: dict) -> None:
+        job.progress = 100.0
+        job.downloaded_bytes += data.get("downloaded_bytes") or data.get("total_bytes") or 0
+        self._notify_job(job)
@@ -0,0 +1,262 @@
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, List, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import config
+
+# ダウンロード進捗の通知先 (downloaded_bytes, total_bytes)。total不明時は0
+ProgressCallback = Callable[[int, int], None]
+
+
+class _Segment:
+    """並列ダウンロードで1接続が担当するバイト範囲"""
+
+    def __init__(self, start: int, end: int, done: int = 0) -> None:
+        self.start = start
+        self.end = end  # 終端を含む
+        self.done = done
+
+    @property
+    def remaining(self) -> int:
+        return self.end - self.start + 1 - self.done
+
+
+class FileFetcher:
+    """
+    ツールのダウンロードに使うHTTP取得エンジン。
+    - セッションを使い回し、接続をプールする
+    - 途中までの内容は <保存先>.part に書き込み、完了後に保存先へリネームする
+    - 中断された場合は次回 Range リクエストで続きから再開する。再開用の進捗 (<保存先>.part.json) は
+      取得の開始時と一定間隔ごとに書き出すため、プロセスが強制終了されても再開できる
+    - 大きなファイルは複数のバイト範囲に分けて並列に取得する
+    """
+
+    def __init__(
+        self,
+        connections: int = config.fetch_connections,
+        chunk_size: int = config.fetch_chunk_size,
+        parallel_min_size: int = config.fetch_parallel_min_size,
+        retries: int = config.fetch_retries,
+        session: Optional[requests.Session] = None,
+        checkpoint_interval: float = config.fetch_checkpoint_interval,
+    ) -> None:
+        self.connections = max(1, connections)
+        self.chunk_size = chunk_size
+        self.parallel_min_size = parallel_min_size
+        self.retries = retries
+        self.checkpoint_interval = checkpoint_interval
+        self.session = session or self._create_session()
+
+    def _create_session(self) -> requests.Session:
+        session = requests.Session()
+        # 並列接続数分の接続をホストごとにプールしておく
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=self.connections * 2)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
+    def fetch(self, url: str, save_path: str, progress_callback: Optional[ProgressCallback] = None) -> None:
+        """
+        url の内容を save_path に保存する。失敗時は requests.RequestException か OSError を送出する。
+        失敗しても .part ファイルは残し、次回の呼び出しで再開に使う
+        """
+        dest = Path(save_path)
+        part_path = dest.with_name(dest.name + ".part")
+        meta_path = dest.with_name(dest.name + ".part.json")
+
+        size, validator, accepts_ranges = self._probe(url)
+        segments = self._load_segments(meta_path, url, size, validator) if part_path.exists() else None
+        if segments is None:
+            part_path.unlink(missing_ok=True)
+            segments = self._plan_segments(size, accepts_ranges)
+
+        checkpoint = None
+        if size and accepts_ranges:
+            checkpoint = _Checkpoint(
+                lambda: self._save_segments(meta_path, url, size, validator, segments), self.checkpoint_interval
+            )
+            checkpoint.save()
+        reporter = _ProgressReporter(size or 0, sum(s.done for s in segments), progress_callback, checkpoint)
+        try:
+            if size and accepts_ranges and len(segments) > 1:
+                self._fetch_segments(url, part_path, segments, validator, reporter)
+            else:
+                self._fetch_single(url, part_path, segments[0], validator, accepts_ranges, reporter)
+        finally:
+            if checkpoint is not None:
+                checkpoint.save()
+
+        os.replace(part_path, dest)
+        meta_path.unlink(missing_ok=True)
+
+    def _probe(self, url: str):
+        """
+        サイズ、検証用のETag/Last-Modified、Range対応の有無を取得する
+        """
+        response = self.session.head(url, allow_redirects=True, timeout=config.fetch_timeout)
+        if response.status_code >= 400:
+            # HEADを受け付けないサーバー向けに内容を読まずにGETで確認する
+            response = self.session.get(url, stream=True, timeout=config.fetch_timeout)
+            response.close()
+        response.raise_for_status()
+        size = int(response.headers.get("Content-Length") or 0)
+        validator = response.headers.get("ETag") or response.headers.get("Last-Modified")
+        if validator and validator.startswith("W/"):
+            # 弱いETagは If-Range に使えないため Last-Modified で代用する
+            validator = response.headers.get("Last-Modified")
+        accepts_ranges = response.headers.get("Accept-Ranges", "").lower() == "bytes"
+        return size, validator, accepts_ranges
+
+    def _plan_segments(self, size: int, accepts_ranges: bool) -> List[_Segment]:
+        if not size:
+            return [_Segment(0, -1)]
+        count = self.connections if accepts_ranges and size >= self.parallel_min_size else 1
+        step = -(-size // count)
+        return [_Segment(start, min(start + step, size) - 1) for start in range(0, size, step)]
+
+    def _load_segments(self, meta_path: Path, url: str, size: int, validator: Optional[str]):
+        """
+        前回の進捗を読み込む。サーバー側の内容が変わっていれば None を返して最初からやり直す
+        """
+        try:
+            meta = json.loads(meta_path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return None
+        if meta.get("url") != url or meta.get("size") != size or meta.get("validator") != validator:
+            return None
+        return [_Segment(*segment) for segment in meta["segments"]]
+
+    def _save_segments(self, meta_path: Path, url: str, size: int, validator, segments: List[_Segment]) -> None:
+        meta = {
+            "url": url,
+            "size": size,
+            "validator": validator,
+            "segments": [[s.start, s.end, s.done] for s in segments],
+        }
+        # 書き込み中に強制終了されても前回の内容が残るよう、別名で書いてから置き換える
+        tmp_path = meta_path.with_name(meta_path.name + ".tmp")
+        tmp_path.write_text(json.dumps(meta), encoding="utf-8")
+        os.replace(tmp_path, meta_path)
+
+    def _fetch_segments(self, url, part_path: Path, segments, validator, reporter) -> None:
+        # 各スレッドが自分の範囲の位置へ書き込めるよう、先に最終サイズのファイルを用意する
+        with open(part_path, "ab") as file:
+            file.truncate(segments[-1].end + 1)
+
+        with ThreadPoolExecutor(max_workers=len(segments)) as executor:
+            futures = [
+                executor.submit(self._fetch_range, url, part_path, segment, validator, reporter)
+                for segment in segments
+                if segment.remaining > 0
+            ]
+            for future in futures:
+                future.result()
+
+    def _fetch_range(self, url, part_path: Path, segment: _Segment, validator, reporter) -> None:
+        for attempt in range(self.retries + 1):
+            try:
+                headers = {"Range": f"bytes={segment.start + segment.done}-{segment.end}"}
+                if validator:
+                    headers["If-Range"] = validator
+                with self.session.get(url, headers=headers, stream=True, timeout=config.fetch_timeout) as response:
+                    response.raise_for_status()
+                    if response.status_code != 206:
+                        raise requests.RequestException("サーバーが範囲指定に対応していません")
+                    with open(part_path, "r+b") as file:
+                        file.seek(segment.start + segment.done)
+                        for chunk in response.iter_content(chunk_size=self.chunk_size):
+                            chunk = chunk[: segment.remaining]
+                            file.write(chunk)
+                            # 書き出した分だけを進捗に数え、記録した進捗がファイルの内容を超えないようにする
+                            file.flush()
+                            segment.done += len(chunk)
+                            reporter.add(len(chunk))
+                            if segment.remaining <= 0:
+                                break
+                if segment.remaining <= 0:
+                    return
+            except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError):
+                if attempt == self.retries:
+                    raise
+        raise requests.RequestException("範囲のダウンロードが途中で終了しました")
+
+    def _fetch_single(self, url, part_path: Path, segment: _Segment, validator, accepts_ranges, reporter) -> None:
+        for attempt in range(self.retries + 1):
+            headers = {}
+            if accepts_ranges and segment.done:
+                headers["Range"] = f"bytes={segment.done}-"
+                if validator:
+                    headers["If-Range"] = validator
+            try:
+                with self.session.get(url, headers=headers, stream=True, timeout=config.fetch_timeout) as response:
+                    response.raise_for_status()
+                    if response.status_code != 206 and segment.done:
+                        # 再開できない場合は最初から取得し直す
+                        reporter.add(-segment.done)
+                        segment.done = 0
+                    with open(part_path, "r+b" if segment.done else "wb") as file:
+                        # 記録済みの位置より後ろに残った書きかけの内容は捨てる
+                        file.seek(segment.done)
+                        file.truncate()
+                        for chunk in response.iter_content(chunk_size=self.chunk_size):
+                            file.write(chunk)
+                            file.flush()
+                            segment.done += len(chunk)
+                            reporter.add(len(chunk))
+                if segment.end < 0 or segment.remaining <= 0:
+                    return
+            except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError):
+                if attempt == self.retries:
+                    raise
+        raise requests.RequestException("ダウンロードが途中で終了しました")
+
+
+class _Checkpoint:
+    """再開用の進捗を、最後に書き出してから interval 秒以上経っていれば書き出す"""
+
+    def __init__(self, save: Callable[[], None], interval: float) -> None:
+        self._save = save
+        self.interval = interval
+        self._saved_at = 0.0
+        self._lock = threading.Lock()
+
+    def save(self) -> None:
+        with self._lock:
+            self._saved_at = time.monotonic()
+            self._save()
+
+    def maybe_save(self) -> None:
+        if time.monotonic() - self._saved_at >= self.interval:
+            self.save()
+
+
+class _ProgressReporter:
+    """複数スレッドからの進捗を合算して通知する"""
+
+    def __init__(
+        self,
+        total: int,
+        downloaded: int,
+        callback: Optional[ProgressCallback],
+        checkpoint: Optional[_Checkpoint] = None,
+    ) -> None:
+        self.total = total
+        self.downloaded = downloaded
+        self.callback = callback
+        self.checkpoint = checkpoint
+        self._lock = threading.Lock()
+
+    def add(self, size: int) -> None:
+        with self._lock:
+            self.downloaded += size
+            if self.callback:
+                self.callback(self.downloaded, self.total)
+        if self.checkpoint is not None:
+            self.checkpoint.maybe_save()
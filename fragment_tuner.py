@@ -0,0 +1,90 @@
+import threading
+from typing import Dict, Optional
+
+import config
+
+
+class _HostState:
+    def __init__(self, concurrency: int) -> None:
+        self.concurrency = concurrency
+        # 前回のストリームの速度 (バイト/秒)。増やした効果を比べる基準
+        self.throughput: Optional[float] = None
+
+
+class FragmentTuner:
+    """
+    HLS/DASH のフラグメントを同時に取得する数をホストごとに調整するクラス (AIMD)。
+    ストリームのダウンロードが終わるたびに速度とリトライの割合を報告させ、
+    速度が伸びていれば同時接続数を少しずつ増やし、エラーが多ければ半分に減らす。
+    全ジョブ合計の同時接続数は connections_limit を超えないように割り当てる
+    """
+
+    # 1回に増やす同時接続数
+    INCREASE_STEP = 2
+    # 速度が伸びた・落ちたとみなす変化の割合
+    GAIN_THRESHOLD = 0.1
+
+    def __init__(
+        self,
+        initial: int = config.fragment_concurrency_initial,
+        connections_limit: int = config.fragment_connections_limit,
+        error_rate_limit: float = config.fragment_error_rate_limit,
+    ) -> None:
+        self.initial = initial
+        self.connections_limit = connections_limit
+        self.error_rate_limit = error_rate_limit
+        self._hosts: Dict[str, _HostState] = {}
+        self._in_use = 0
+        self._lock = threading.Lock()
+
+    def _state(self, host: str) -> _HostState:
+        if host not in self._hosts:
+            self._hosts[host] = _HostState(min(self.initial, self.connections_limit))
+        return self._hosts[host]
+
+    def acquire(self, host: str) -> int:
+        """
+        ストリームのダウンロード開始時に呼び、使ってよい同時接続数を返す。
+        上限に達していても1は割り当てる。終了時に同じ数で release() を呼ぶこと
+        """
+        with self._lock:
+            concurrency = max(1, min(self._state(host).concurrency, self.connections_limit - self._in_use))
+            self._in_use += concurrency
+            return concurrency
+
+    def release(self, concurrency: int) -> None:
+        with self._lock:
+            self._in_use = max(0, self._in_use - concurrency)
+
+    def observe(
+        self, host: str, concurrency: int, downloaded_bytes: int, seconds: float, retries: int, fragments: int
+    ) -> int:
+        """
+        concurrency で取得したストリームの結果を報告し、次のストリームで使う同時接続数を返す。
+        ダウンロードに失敗した場合は retries を fragments 以上にして報告する
+        """
+        throughput = downloaded_bytes / seconds if seconds > 0 else 0.0
+        with self._lock:
+            state = self._state(host)
+            if retries > fragments * self.error_rate_limit:
+                # エラーが多いときは接続数を半分にし、速度の基準も取り直す
+                state.concurrency = max(1, concurrency // 2)
+                state.throughput = None
+                return state.concurrency
+            if concurrency < state.concurrency:
+                # 全体の上限で減らされた、または他のストリームの結果で既に変わった場合は比べられない
+                return state.concurrency
+            if state.throughput is None or throughput > state.throughput * (1 + self.GAIN_THRESHOLD):
+                state.concurrency = min(self.connections_limit, concurrency + self.INCREASE_STEP)
+            elif throughput < state.throughput * (1 - self.GAIN_THRESHOLD):
+                # 増やしても速くならず遅くなった場合は1段階戻す
+                state.concurrency = max(1, concurrency - self.INCREASE_STEP)
+            else:
+                state.concurrency = concurrency
+            state.throughput = throughput
+            return state.concurrency
+
+    def concurrency(self, host: str) -> int:
+        """ホストに次に割り当てる同時接続数 (全体の上限を考慮しない値)"""
+        with self._lock:
+            return self._state(host).concurrency
@@ -0,0 +1,139 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from pathlib import Path
+from typing import Optional, Tuple
+
+import config
+
+
+def resolve_video_key(url: str) -> Tuple[str, str]:
+    """
+    URLからダウンロードせずに (抽出器名, 動画ID) を求める。
+    IDを特定できないURLはURL自体のハッシュをIDとして扱う
+    """
+    from yt_dlp.extractor import gen_extractor_classes
+
+    for ie in gen_extractor_classes():
+        if ie.ie_key() == "Generic" or not ie.suitable(url):
+            continue
+        video_id = ie.get_temp_id(url)
+        if video_id:
+            return ie.ie_key(), video_id
+        break
+    return "url", hashlib.sha1(url.encode("utf-8")).hexdigest()
+
+
+def is_single_video(url: str) -> bool:
+    """
+    URLが1本の動画を指すことが抽出器から分かる場合に True を返す。
+    プレイリスト・チャンネルや、どちらか分からないURL (汎用抽出器など) は False
+    """
+    from yt_dlp.extractor import gen_extractor_classes
+
+    for ie in gen_extractor_classes():
+        if ie.ie_key() == "Generic" or not ie.suitable(url):
+            continue
+        return bool(ie.is_single_video(url))
+    return False
+
+
+def strip_credentials(info: dict) -> dict:
+    """
+    キャッシュに書く前に、info と各フォーマットから Cookie を取り除いた辞書を返す。
+    Cookie は再利用時に yt-dlp が Cookie の保存先から付け直す
+    """
+
+    def strip(entry: dict) -> dict:
+        entry = {k: v for k, v in entry.items() if k != "cookies"}
+        headers = entry.get("http_headers")
+        if isinstance(headers, dict):
+            entry["http_headers"] = {k: v for k, v in headers.items() if k.lower() != "cookie"}
+        return entry
+
+    info = strip(info)
+    for field in ("formats", "requested_formats", "requested_downloads"):
+        if isinstance(info.get(field), list):
+            info[field] = [strip(f) if isinstance(f, dict) else f for f in info[field]]
+    return info
+
+
+class InfoCache:
+    """
+    extract_info の結果を (抽出器名, 動画ID) ごとにJSONファイルとして保存するキャッシュ。
+    Cookie は保存せず、フォルダとファイルは本人だけが読めるようにする。
+    ttl 秒を過ぎたエントリは無効とし、合計サイズが max_bytes を超えたら
+    最後に使われてから最も時間が経ったエントリから削除する
+    """
+
+    def __init__(
+        self,
+        cache_dir: Optional[Path] = None,
+        ttl: float = config.info_cache_ttl,
+        max_bytes: int = config.info_cache_max_bytes,
+    ) -> None:
+        if cache_dir is None:
+            cache_dir = Path.home() / "Library" / "Application Support" / "yt-downloader" / "cache" / "info"
+        self.cache_dir = Path(cache_dir)
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+    def _path(self, key: Tuple[str, str]) -> Path:
+        extractor, video_id = key
+        name = re.sub(r"[^\w.-]", "_", f"{extractor}_{video_id}")
+        return self.cache_dir / f"{name}.json"
+
+    def get(self, key: Tuple[str, str]) -> Optional[dict]:
+        path = self._path(key)
+        with self._lock:
+            try:
+                if time.time() - path.stat().st_mtime > self.ttl:
+                    path.unlink(missing_ok=True)
+                    return None
+                info = json.loads(path.read_text(encoding="utf-8"))
+            except (OSError, ValueError):
+                return None
+            # 最終アクセス時刻を削除順の判定に使う
+            os.utime(path, (time.time(), path.stat().st_mtime))
+        return info
+
+    def put(self, key: Tuple[str, str], info: dict) -> None:
+        """
+        info は YoutubeDL.sanitize_info 済みの辞書を渡すこと
+        """
+        path = self._path(key)
+        data = json.dumps(strip_credentials(info), ensure_ascii=False).encode("utf-8")
+        with self._lock:
+            self.cache_dir.mkdir(mode=0o700, parents=True, exist_ok=True)
+            os.chmod(self.cache_dir, 0o700)
+            # 同じキャッシュを使う他のプロセスと一時ファイルが重ならないよう、プロセスIDを付ける
+            tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+            fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+            self._evict()
+
+    def invalidate(self, key: Tuple[str, str]) -> None:
+        with self._lock:
+            self._path(key).unlink(missing_ok=True)
+
+    def _evict(self) -> None:
+        entries = []
+        for path in self.cache_dir.glob("*.json"):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_atime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            path.unlink(missing_ok=True)
+            total -= size
@@ -0,0 +1,99 @@
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import List, Optional
+
+from download_queue import DownloadJob
+
+
+class JobJournal:
+    """
+    終了していないジョブをSQLiteに記録するクラス。
+    アプリの終了やクラッシュで中断したジョブを、次回の起動時に途中のファイルから再開するために使う。
+    ジョブが終了 (完了・失敗・中止・スキップ) したら記録を削除する
+    """
+
+    def __init__(self, db_path: Optional[Path] = None) -> None:
+        if db_path is None:
+            db_path = Path.home() / "Library" / "Application Support" / "yt-downloader" / "jobs.sqlite3"
+        self.db_path = Path(db_path)
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        # 複数のスレッドから使うため、接続は1つにしてロックで保護する
+        if self._conn is None:
+            self.db_path.parent.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    url TEXT NOT NULL,
+                    save_folder TEXT NOT NULL,
+                    quality TEXT NOT NULL,
+                    priority TEXT NOT NULL,
+                    title TEXT,
+                    status TEXT NOT NULL,
+                    output_path TEXT,
+                    sections TEXT NOT NULL DEFAULT '[]',
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+                """
+            )
+        return self._conn
+
+    def add(self, job: DownloadJob) -> int:
+        """ジョブを記録し、記録のIDを返す"""
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            cursor = conn.execute(
+                "INSERT INTO jobs (url, save_folder, quality, priority, title, status, output_path, sections,"
+                " created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    job.url,
+                    job.save_folder,
+                    job.quality,
+                    job.priority.name,
+                    job.title,
+                    job.status.value,
+                    job.output_path,
+                    json.dumps(job.sections),
+                    now,
+                    now,
+                ),
+            )
+            conn.commit()
+            return cursor.lastrowid
+
+    def update(self, record_id: int, job: DownloadJob) -> None:
+        with self._lock:
+            conn = self._connect()
+            conn.execute(
+                "UPDATE jobs SET priority = ?, title = ?, status = ?, output_path = ?, updated_at = ? WHERE id = ?",
+                (job.priority.name, job.title, job.status.value, job.output_path, time.time(), record_id),
+            )
+            conn.commit()
+
+    def remove(self, record_id: int) -> None:
+        with self._lock:
+            conn = self._connect()
+            conn.execute("DELETE FROM jobs WHERE id = ?", (record_id,))
+            conn.commit()
+
+    def unfinished(self) -> List[dict]:
+        """記録されているジョブを登録順に返す"""
+        if not self.db_path.exists():
+            return []
+        with self._lock:
+            cursor = self._connect().execute("SELECT * FROM jobs ORDER BY id")
+            columns = [column[0] for column in cursor.description]
+            rows = [dict(zip(columns, row)) for row in cursor.fetchall()]
+        for row in rows:
+            row["sections"] = json.loads(row["sections"])
+        return rows
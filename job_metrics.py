@@ -0,0 +1,208 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+
+import config
+from tool_manifest import file_lock
+
+
+class JobMetrics:
+    """
+    1件のジョブの工程ごとの所要時間 (スパン) と転送の統計を集めるクラス。
+    yt-dlp の進捗フック・後処理フックはダウンロード用のスレッドから呼ばれるためロックで保護する
+    """
+
+    def __init__(self) -> None:
+        self.created_at = time.time()
+        self.spans: List[dict] = []
+        self.retries = 0
+        self.peak_speed = 0.0
+        # MediaPlanner が選んだMP4への変換方法とCPU時間
+        self.media_plan: Optional[dict] = None
+        # ストリームごとのフラグメントの同時取得数
+        self.fragment_concurrency: Dict[str, int] = {}
+        # 範囲を指定したジョブで、動画全体を取得した場合の見積もりバイト数
+        self.full_bytes: Optional[int] = None
+        self._open: Dict[str, dict] = {}
+        # ストリーム (出力ファイル) ごとのフラグメント数
+        self._fragments: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def begin(self, stage: str, name: Optional[str] = None) -> None:
+        key = f"{stage}:{name}" if name else stage
+        with self._lock:
+            if key not in self._open:
+                self._open[key] = {"stage": stage, "name": name, "start": time.time()}
+
+    def end(self, stage: str, name: Optional[str] = None, error: Optional[str] = None) -> None:
+        key = f"{stage}:{name}" if name else stage
+        with self._lock:
+            span = self._open.pop(key, None)
+            if span is not None:
+                self._close_span(span, time.time(), error)
+
+    def _close_span(self, span: dict, now: float, error: Optional[str]) -> None:
+        span["end"] = now
+        span["seconds"] = now - span["start"]
+        if error:
+            span["error"] = error
+        self.spans.append(span)
+
+    @contextmanager
+    def span(self, stage: str, name: Optional[str] = None) -> Iterator[None]:
+        self.begin(stage, name)
+        try:
+            yield
+        except BaseException as e:
+            self.end(stage, name, error=str(e) or type(e).__name__)
+            raise
+        self.end(stage, name)
+
+    def close(self, error: Optional[str] = None) -> None:
+        """
+        終了していないスパンを打ち切る。失敗・キャンセルしたジョブの記録前に呼ぶ
+        """
+        now = time.time()
+        with self._lock:
+            for span in self._open.values():
+                self._close_span(span, now, error or "incomplete")
+            self._open.clear()
+
+    def on_progress(self, data: dict) -> None:
+        """yt-dlp の progress_hooks に登録する"""
+        stream = data.get("filename") or ""
+        if data["status"] == "downloading":
+            format_id = (data.get("info_dict") or {}).get("format_id")
+            self.begin("download", format_id or stream)
+            speed = data.get("speed") or 0.0
+            with self._lock:
+                self.peak_speed = max(self.peak_speed, speed)
+                fragments = data.get("fragment_count") or data.get("fragment_index")
+                if fragments:
+                    self._fragments[stream] = max(self._fragments.get(stream, 0), fragments)
+        elif data["status"] in ("finished", "error"):
+            format_id = (data.get("info_dict") or {}).get("format_id")
+            error = "download error" if data["status"] == "error" else None
+            self.end("download", format_id or stream, error=error)
+
+    def on_postprocessor(self, data: dict) -> None:
+        """yt-dlp の postprocessor_hooks に登録する。後処理 (結合・変換・サムネイル埋め込み) ごとにスパンを記録する"""
+        name = data.get("postprocessor")
+        if data["status"] == "started":
+            self.begin("postprocess", name)
+        elif data["status"] == "finished":
+            self.end("postprocess", name)
+
+    def on_retry(self, n: int) -> float:
+        """
+        yt-dlp の retry_sleep_functions に登録してリトライ回数を数える。
+        戻り値はリトライ前の待ち時間で、yt-dlp の既定と同じく待たない
+        """
+        with self._lock:
+            self.retries += 1
+        return 0.0
+
+    def on_fragment_concurrency(self, stream: str, concurrency: int) -> None:
+        with self._lock:
+            self.fragment_concurrency[stream] = concurrency
+
+    @property
+    def fragments(self) -> int:
+        with self._lock:
+            return sum(self._fragments.values())
+
+    def stage_seconds(self) -> Dict[str, float]:
+        """工程ごとの合計時間"""
+        totals: Dict[str, float] = {}
+        with self._lock:
+            for span in self.spans:
+                totals[span["stage"]] = totals.get(span["stage"], 0.0) + span["seconds"]
+        return totals
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            spans = [dict(span) for span in self.spans]
+            fragment_concurrency = dict(self.fragment_concurrency)
+        return {
+            "stages": self.stage_seconds(),
+            "spans": spans,
+            "fragments": self.fragments,
+            "fragment_concurrency": fragment_concurrency,
+            "retries": self.retries,
+            "peak_speed": self.peak_speed,
+            "media_plan": self.media_plan,
+            "full_bytes": self.full_bytes,
+        }
+
+
+class MetricsRecorder:
+    """
+    終了したジョブの計測結果を保存するクラス。
+    ジョブごとの記録を JSON Lines のログに追記し、工程ごとの集計をJSONファイルに書き出す。
+    集計ファイルは他のツールから読めるよう、書き込みのたびに置き換える。
+    同じフォルダを使う他のプロセス (同じマシンのワーカーなど) の集計を失わないよう、
+    記録のたびにファイルをロックして集計を読み直してから加算する
+    """
+
+    def __init__(self, metrics_dir: Optional[Path] = None, max_log_bytes: int = config.metrics_log_max_bytes) -> None:
+        if metrics_dir is None:
+            metrics_dir = Path.home() / "Library" / "Application Support" / "yt-downloader" / "metrics"
+        self.metrics_dir = Path(metrics_dir)
+        self.log_path = self.metrics_dir / "jobs.jsonl"
+        self.summary_path = self.metrics_dir / "summary.json"
+        self.max_log_bytes = max_log_bytes
+        self._lock = threading.Lock()
+
+    def _load_summary(self) -> dict:
+        try:
+            summary = json.loads(self.summary_path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            summary = {}
+        defaults = {
+            "jobs": {},
+            "stages": {},
+            "bytes": 0,
+            "bytes_avoided": 0,
+            "fragments": 0,
+            "retries": 0,
+            "cpu_seconds_saved": 0.0,
+        }
+        for key, default in defaults.items():
+            summary.setdefault(key, default)
+        return summary
+
+    def record(self, entry: dict) -> None:
+        """
+        entry はジョブの情報に JobMetrics.to_dict() の内容を加えた辞書
+        """
+        line = json.dumps(entry, ensure_ascii=False) + "\n"
+        with self._lock, file_lock(self.metrics_dir / "summary.lock"):
+            try:
+                if self.log_path.stat().st_size + len(line) > self.max_log_bytes:
+                    os.replace(self.log_path, self.log_path.with_name(self.log_path.name + ".1"))
+            except OSError:
+                pass
+            with open(self.log_path, "a", encoding="utf-8") as file:
+                file.write(line)
+
+            summary = self._load_summary()
+            summary["jobs"][entry["status"]] = summary["jobs"].get(entry["status"], 0) + 1
+            summary["bytes"] += entry.get("bytes") or 0
+            summary["bytes_avoided"] += entry.get("bytes_avoided") or 0
+            summary["fragments"] += entry.get("fragments") or 0
+            summary["retries"] += entry.get("retries") or 0
+            summary["cpu_seconds_saved"] += (entry.get("media_plan") or {}).get("cpu_seconds_saved", 0.0)
+            for stage, seconds in entry.get("stages", {}).items():
+                total = summary["stages"].setdefault(stage, {"count": 0, "seconds": 0.0, "max": 0.0})
+                total["count"] += 1
+                total["seconds"] += seconds
+                total["max"] = max(total["max"], seconds)
+            summary["updated_at"] = time.time()
+
+            tmp_path = self.summary_path.with_name(self.summary_path.name + ".tmp")
+            tmp_path.write_text(json.dumps(summary, indent=2, ensure_ascii=False), encoding="utf-8")
+            os.replace(tmp_path, self.summary_path)
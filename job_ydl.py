@@ -0,0 +1,228 @@
+import os
+import shutil
+import time
+from typing import Callable, List, Optional
+from urllib.parse import urlsplit
+
+from yt_dlp import YoutubeDL
+from yt_dlp.utils import format_bytes
+
+import config
+
+from fragment_tuner import FragmentTuner
+from job_metrics import JobMetrics
+from postprocess_pool import PostprocessPool
+from throttle_proxy import ThrottleProxy
+from ydl_sessions import YdlSessionPool
+
+# フラグメント単位で取得するプロトコル
+FRAGMENTED_PROTOCOLS = {"m3u8", "m3u8_native", "http_dash_segments", "http_dash_segments_generator"}
+
+
+class InsufficientDiskSpace(Exception):
+    """保存先の空き容量が足りないため、ダウンロードを始めないことを示す例外"""
+
+
+def _existing_dir(path: str) -> str:
+    # 作業フォルダはダウンロード開始時に作られるため、存在する親フォルダで空き容量を調べる
+    path = os.path.abspath(path)
+    while not os.path.isdir(path) and os.path.dirname(path) != path:
+        path = os.path.dirname(path)
+    return path
+
+
+def _dir_size(path: str) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+class JobYoutubeDL(YoutubeDL):
+    """
+    ジョブ用の YoutubeDL。
+    HLS/DASH のストリームは FragmentTuner が決めた数のフラグメントを同時に取得し、結果を FragmentTuner に報告する。
+    後処理は PostprocessPool の枠の中で行い、枠を待つ前に on_download_finished でダウンロードの枠を返す。
+    プレイリストの各動画や各範囲のダウンロードを始める前に on_download_started を呼び、返した枠を取り直す。
+    sessions を指定すると、接続の設定が同じ他の YoutubeDL と Cookie と接続プールを共有する。
+    is_archived は動画ごとに取得済みかを判定し、on_entry_downloaded は動画ごとに保存したファイルを受け取る
+    (プレイリストでは各動画、範囲を指定した場合は範囲ごとのファイルの一覧)。
+    throttle は ffmpeg で取得するストリーム (範囲の指定など) の (ストリーム名, 累計の受信バイト数) を受け取り、
+    帯域の割り当てを超えていれば戻るまで ffmpeg の受信を待たせる
+    """
+
+    def __init__(
+        self,
+        params: Optional[dict] = None,
+        fragment_tuner: Optional[FragmentTuner] = None,
+        metrics: Optional[JobMetrics] = None,
+        postprocess_pool: Optional[PostprocessPool] = None,
+        on_download_finished: Optional[Callable[[], None]] = None,
+        on_download_started: Optional[Callable[[], None]] = None,
+        sessions: Optional[YdlSessionPool] = None,
+        is_archived: Optional[Callable[[dict], bool]] = None,
+        on_entry_downloaded: Optional[Callable[[dict, List[str]], None]] = None,
+        throttle: Optional[Callable[[str, int], None]] = None,
+    ) -> None:
+        self.sessions = sessions
+        self.session = sessions.acquire(params or {}) if sessions else None
+        if self.session is not None:
+            # YoutubeDL はどちらも最初に使うときに作るため、先に共有のものを入れておく
+            self.__dict__["cookiejar"] = self.session.cookiejar
+            self.__dict__["_request_director"] = self.session.request_director
+        try:
+            super().__init__(params)
+        except BaseException:
+            if self.session is not None:
+                sessions.release(self.session)
+            raise
+        self.fragment_tuner = fragment_tuner
+        self.metrics = metrics or JobMetrics()
+        self.postprocess_pool = postprocess_pool
+        self.on_download_finished = on_download_finished
+        self.on_download_started = on_download_started
+        self.is_archived = is_archived
+        self.on_entry_downloaded = on_entry_downloaded
+        self.throttle = throttle
+        # 取得中の動画で保存したファイル。範囲を指定した場合は範囲ごとに増える
+        self._entry_outputs: List[str] = []
+
+    def save_cookies(self):
+        # 共有の Cookie はセッションが使い終わったときにまとめて保存する
+        if self.session is None:
+            super().save_cookies()
+
+    def close(self):
+        if self.session is None:
+            super().close()
+            return
+        # 共有の接続プールは閉じずにセッションに返す
+        self.__dict__.pop("_request_director", None)
+        super().close()
+        self.sessions.release(self.session)
+        self.session = None
+
+    def process_info(self, info_dict):
+        if self.params.get("skip_download"):
+            super().process_info(info_dict)
+            # メディアを取得しない場合は後処理が行われず post_hooks も呼ばれないため、書き出した情報ファイルを渡す
+            infojson = info_dict.get("infojson_filename")
+            if infojson:
+                for hook in self._post_hooks:
+                    hook(infojson)
+            return
+        if self.on_download_started:
+            self.on_download_started()
+        size = self.estimated_size(info_dict)
+        duration = info_dict.get("duration")
+        if "section_start" in info_dict and size:
+            # 比較の基準として、範囲を指定しなかった場合に取得するサイズを記録する
+            self.metrics.full_bytes = int(size)
+            if duration:
+                section = (info_dict.get("section_end") or duration) - info_dict["section_start"]
+                size *= min(1.0, max(0.0, section) / duration)
+        self.check_disk_space(size)
+        result = super().process_info(info_dict)
+        if info_dict.get("filepath"):
+            self._entry_outputs.append(info_dict["filepath"])
+        return result
+
+    def in_download_archive(self, info_dict):
+        # プレイリストの項目も動画ごとにアーカイブを確認し、取得済みの動画は飛ばす
+        if self.is_archived is not None and info_dict.get("id") and self.is_archived(info_dict):
+            return True
+        return super().in_download_archive(info_dict)
+
+    def record_download_archive(self, info_dict):
+        # 動画の全ての範囲を保存し終えたときに1回呼ばれる
+        super().record_download_archive(info_dict)
+        outputs, self._entry_outputs = self._entry_outputs, []
+        if self.on_entry_downloaded is not None and outputs:
+            self.on_entry_downloaded(info_dict, outputs)
+
+    @staticmethod
+    def estimated_size(info_dict: dict) -> Optional[float]:
+        """選ばれたフォーマットの合計サイズ。サイズが分からないフォーマットがある場合は None"""
+        formats = info_dict.get("requested_formats") or [info_dict]
+        sizes = [f.get("filesize") or f.get("filesize_approx") for f in formats]
+        return sum(sizes) if all(sizes) else None
+
+    def check_disk_space(self, size: Optional[float]) -> None:
+        """
+        取得するサイズから必要な空き容量を見積もり、足りなければ InsufficientDiskSpace を送出する。
+        サイズが分からない場合は確認しない。作業フォルダに途中のファイルがあればその分を差し引く
+        """
+        if not size:
+            return
+        paths = self.params.get("paths") or {}
+        temp_dir = paths.get("temp") or paths.get("home") or "."
+        partial = _dir_size(temp_dir) if os.path.isdir(temp_dir) else 0
+        required = size * config.disk_space_factor - partial
+        free = shutil.disk_usage(_existing_dir(temp_dir)).free
+        if required > free:
+            raise InsufficientDiskSpace(
+                f"空き容量が不足しています (必要: {format_bytes(required)}, 空き: {format_bytes(free)})"
+            )
+
+    def post_process(self, filename, info, files_to_move=None):
+        if self.postprocess_pool is None:
+            return super().post_process(filename, info, files_to_move)
+        self.metrics.begin("postprocess_wait")
+        with self.postprocess_pool.slot(self.on_download_finished):
+            self.metrics.end("postprocess_wait")
+            return super().post_process(filename, info, files_to_move)
+
+    def dl(self, name, info, subtitle=False, test=False):
+        if self.throttle is not None and not (subtitle or test) and self._uses_ffmpeg(name, info):
+            return self._dl_with_ffmpeg(name, info)
+        protocol = info.get("protocol")
+        if self.fragment_tuner is None or subtitle or test or protocol not in FRAGMENTED_PROTOCOLS:
+            return super().dl(name, info, subtitle, test)
+
+        host = urlsplit(info.get("url") or "").hostname or ""
+        concurrency = self.fragment_tuner.acquire(host)
+        # yt-dlp はストリームの取得開始時にこの値でスレッドプールを作るため、途中では変えられない
+        self.params["concurrent_fragment_downloads"] = concurrency
+        self.metrics.on_fragment_concurrency(info.get("format_id") or name, concurrency)
+        retries, fragments = self.metrics.retries, self.metrics.fragments
+        began = time.monotonic()
+        success = real_download = False
+        try:
+            success, real_download = super().dl(name, info, subtitle, test)
+            return success, real_download
+        finally:
+            self.fragment_tuner.release(concurrency)
+            # 既に取得済みで何もしなかった場合は報告しない
+            if real_download or not success:
+                fragments = max(1, self.metrics.fragments - fragments)
+                retries = self.metrics.retries - retries if success else fragments
+                size = os.path.getsize(name) if success and os.path.exists(name) else 0
+                self.fragment_tuner.observe(host, concurrency, size, time.monotonic() - began, retries, fragments)
+
+    def _uses_ffmpeg(self, name, info) -> bool:
+        from yt_dlp.downloader import FFmpegFD, get_suitable_downloader
+
+        urls = [f.get("url") or "" for f in info.get("requested_formats") or [info]]
+        return (
+            all(url.startswith(("http://", "https://")) for url in urls)
+            and get_suitable_downloader(info, self.params, to_stdout=name == "-") is FFmpegFD
+        )
+
+    def _dl_with_ffmpeg(self, name, info):
+        """
+        ffmpeg は取得し終わるまで進捗フックを呼ばないため、ThrottleProxy を経由させて受信のたびに帯域を報告する。
+        プロキシが設定されている場合はそのプロキシに直接つなぐため、帯域は抑えない
+        """
+        if self.params.get("proxy"):
+            return super().dl(name, info)
+        with ThrottleProxy(self.throttle) as proxy_url:
+            # FFmpegFD は取得の開始時に proxy を読み、ffmpeg の環境変数 http_proxy に渡す
+            self.params["proxy"] = proxy_url
+            try:
+                return super().dl(name, info)
+            finally:
+                del self.params["proxy"]
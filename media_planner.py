@@ -0,0 +1,147 @@
+import os
+import subprocess
+from typing import Callable, List, Optional, Tuple
+
+from yt_dlp.postprocessor import EmbedThumbnailPP, FFmpegPostProcessor
+from yt_dlp.postprocessor.common import PostProcessor
+from yt_dlp.utils import PostProcessingError, prepend_extension, replace_extension
+
+import config
+
+# QuickTime で再生できる、MP4にそのまま格納するコーデック
+MP4_VIDEO_CODECS = {"h264", "hevc"}
+MP4_AUDIO_CODECS = {"aac", "mp3", "alac", "ac3", "eac3"}
+
+# 変換の方法。安い順に並ぶ
+NO_OP = "none"
+REMUX = "remux"
+TRANSCODE = "transcode"
+
+
+def plan_conversion(metadata: dict, ext: str) -> Tuple[str, List[str]]:
+    """
+    ffprobe の結果からMP4にするための最も安い方法を選び、(方法, ffmpegのコーデック指定) を返す。
+    再エンコードはMP4で扱えないストリームだけに行い、それ以外はコピーする。
+    置き換え前の FFmpegVideoConvertor と同じく、mp4 のファイルはコーデックによらず何もしない
+    """
+    if ext == "mp4":
+        return NO_OP, []
+    streams = metadata.get("streams") or []
+    # サムネイルとして埋め込まれた画像は映像ストリームとして扱わない
+    video = [
+        s for s in streams if s.get("codec_type") == "video" and not (s.get("disposition") or {}).get("attached_pic")
+    ]
+    audio = [s for s in streams if s.get("codec_type") == "audio"]
+    copy_video = all(s.get("codec_name") in MP4_VIDEO_CODECS for s in video)
+    copy_audio = all(s.get("codec_name") in MP4_AUDIO_CODECS for s in audio)
+
+    if copy_video and copy_audio:
+        return REMUX, ["-c", "copy"]
+    # 映像の既定のエンコーダーは FFmpegVideoConvertor と同じくffmpegに任せる
+    codec_args = ["-c:v", "copy"] if copy_video else []
+    codec_args += ["-c:a", "copy"] if copy_audio else ["-c:a", "aac"]
+    return TRANSCODE, codec_args
+
+
+def estimate_transcode_cpu(metadata: dict) -> float:
+    """
+    全ストリームを再エンコードした場合のCPU時間 (秒) を動画の長さと解像度から見積もる
+    """
+    duration = float((metadata.get("format") or {}).get("duration") or 0)
+    pixels = max(
+        (int(s.get("width") or 0) * int(s.get("height") or 0) for s in metadata.get("streams") or []),
+        default=0,
+    )
+    scale = pixels / (1920 * 1080) if pixels else 1.0
+    return duration * config.transcode_cpu_seconds_per_second * scale
+
+
+class MediaPlannerPP(FFmpegPostProcessor):
+    """
+    FFmpegVideoConvertor (preferedformat: mp4) の代わりに使う後処理。
+    ダウンロードしたファイルを ffprobe で調べ、何もしない・コピーでMP4に入れ直す・
+    必要なストリームだけ再エンコードする、のうち最も安い方法でMP4にする。
+    結果は on_plan に {"action", "cpu_seconds", "cpu_seconds_saved", ...} の辞書で通知される
+    """
+
+    def __init__(self, downloader=None, on_plan: Optional[Callable[[dict], None]] = None) -> None:
+        super().__init__(downloader)
+        self.on_plan = on_plan
+
+    @PostProcessor._restrict_to(images=False)
+    def run(self, info: dict):
+        filename, source_ext = info["filepath"], info["ext"].lower()
+        try:
+            metadata = self.get_metadata_object(filename)
+        except (PostProcessingError, OSError, ValueError) as e:
+            self.report_warning(f"ffprobeで調べられなかったため変換しません: {e}")
+            return [], info
+
+        action, codec_args = plan_conversion(metadata, source_ext)
+        # 以前の FFmpegVideoConvertor は mp4 なら何もせず、それ以外は常に全ストリームを再エンコードしていた
+        baseline = estimate_transcode_cpu(metadata) if source_ext != "mp4" else 0.0
+        cpu_seconds = 0.0
+        files_to_delete = []
+        if action != NO_OP:
+            outpath = replace_extension(filename, "mp4", source_ext)
+            temppath = prepend_extension(outpath, "temp") if outpath == filename else outpath
+            self.to_screen(f'{action.title()} "{filename}" to mp4 ({" ".join(codec_args)})')
+            cpu_seconds = self._run_measured(filename, temppath, codec_args)
+            if temppath != outpath:
+                os.replace(temppath, outpath)
+            else:
+                files_to_delete.append(filename)
+            info["filepath"] = outpath
+            info["format"] = info["ext"] = "mp4"
+        if action == TRANSCODE and "copy" not in codec_args:
+            # 全ストリームを再エンコードした場合は以前と同じ処理なので節約はない
+            baseline = cpu_seconds
+
+        if self.on_plan:
+            self.on_plan(
+                {
+                    "action": action,
+                    "codec_args": codec_args,
+                    "source_ext": source_ext,
+                    "cpu_seconds": cpu_seconds,
+                    # 見積もりが実測より小さくても、全ストリームの再エンコードより多くかかることはない
+                    "cpu_seconds_saved": max(0.0, baseline - cpu_seconds),
+                }
+            )
+        return files_to_delete, info
+
+    def _run_measured(self, path: str, outpath: str, codec_args: List[str]) -> float:
+        """
+        ffmpeg を実行し、そのプロセスが使ったCPU時間 (ユーザー + システム) を返す。
+        他のジョブのffmpegと区別するため、getrusage ではなく wait4 でこのプロセスの分だけを取得する
+        """
+        self.check_version()
+        command = [self.executable, "-y", "-loglevel", "error", "-i", path]
+        # 字幕は FFmpegVideoRemuxer と同じく mov_text にする。-c:s は -c copy より後に指定する必要がある
+        command += [*FFmpegPostProcessor.stream_copy_opts(False), *codec_args, "-c:s", "mov_text"]
+        command += ["-movflags", "+faststart", outpath]
+        process = subprocess.Popen(command, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        stderr = process.stderr.read().decode("utf-8", "replace")
+        process.stderr.close()
+        _, status, usage = os.wait4(process.pid, 0)
+        process.returncode = os.waitstatus_to_exitcode(status)
+        if process.returncode != 0:
+            if os.path.exists(outpath):
+                os.remove(outpath)
+            message = stderr.strip().splitlines()[-1] if stderr.strip() else f"exit code {process.returncode}"
+            raise PostProcessingError(message)
+        return usage.ru_utime + usage.ru_stime
+
+
+class OptionalEmbedThumbnailPP(EmbedThumbnailPP):
+    """
+    埋め込めなくてもジョブを失敗させない EmbedThumbnail。
+    opus など mutagen が必要な形式で mutagen が無い場合は警告を出し、サムネイルを別ファイルとして残す
+    """
+
+    def run(self, info: dict):
+        try:
+            return super().run(info)
+        except PostProcessingError as e:
+            self.report_warning(f"サムネイルを埋め込めませんでした: {e}")
+            return [], info
@@ -0,0 +1,96 @@
+import asyncio
+from typing import Callable, Iterator, Optional
+
+from yt_dlp import YoutubeDL
+from yt_dlp.utils import match_filter_func
+
+from bandwidth_scheduler import JobPriority
+from download_queue import DownloadJob, DownloadQueue
+
+# 展開済みで未着手のジョブがこの件数を超えたら、次のエントリの取得を待たせる
+PENDING_LIMIT_PER_WORKER = 4
+
+
+def _is_nested_playlist(entry: dict) -> bool:
+    """
+    チャンネルのタブなど、さらに展開が必要なエントリかどうか
+    """
+    if entry.get("_type") == "playlist":
+        return True
+    ie_key = entry.get("ie_key") or ""
+    return entry.get("_type") == "url" and (ie_key.endswith("Tab") or "Playlist" in ie_key)
+
+
+def iter_playlist_entries(url: str, ydl_opts: dict, match_filter: Optional[str] = None) -> Iterator[dict]:
+    """
+    プレイリスト・チャンネルのエントリをフラット抽出で1件ずつ返すジェネレータ。
+    エントリはページ単位で取得されるため、全件の情報がメモリに載ることはない。
+    match_filter (yt-dlpの --match-filter 形式) はフラット抽出で得られる項目だけで判定する
+    """
+    filter_func = match_filter_func(match_filter) if match_filter else None
+    opts = {
+        **ydl_opts,
+        "extract_flat": "in_playlist",
+        "lazy_playlist": True,
+        "quiet": True,
+    }
+    with YoutubeDL(opts) as ydl:
+        yield from _iter_entries(ydl, url, filter_func)
+
+
+def _iter_entries(ydl: YoutubeDL, url: str, filter_func: Optional[Callable]) -> Iterator[dict]:
+    # process=False の場合 entries はジェネレータのまま返り、必要になった分だけ取得される
+    info = ydl.extract_info(url, download=False, process=False)
+    if info.get("_type") not in ("playlist", "multi_video"):
+        yield info
+        return
+
+    for entry in info.get("entries") or []:
+        if not entry:
+            continue
+        if _is_nested_playlist(entry):
+            yield from _iter_entries(ydl, entry.get("url") or entry["webpage_url"], filter_func)
+            continue
+        if filter_func and filter_func(entry, incomplete=True) is not None:
+            continue
+        yield entry
+
+
+async def expand_into_queue(
+    queue: DownloadQueue,
+    url: str,
+    save_folder: str,
+    quality: str,
+    ydl_opts: dict,
+    match_filter: Optional[str] = None,
+    on_job: Optional[Callable[[DownloadJob], None]] = None,
+    priority: JobPriority = JobPriority.NORMAL,
+) -> int:
+    """
+    プレイリストを展開しながらジョブをキューに投入し、投入した件数を返す。
+    最初のページが取得できた時点でダウンロードが始まり、
+    待機中のジョブが溜まりすぎた場合は展開を一時停止する
+    """
+    entries = iter_playlist_entries(url, ydl_opts, match_filter)
+    count = 0
+    try:
+        while True:
+            entry = await asyncio.to_thread(next, entries, None)
+            if entry is None:
+                break
+            entry_url = entry.get("webpage_url") or entry.get("url")
+            if not entry_url:
+                continue
+            job = queue.submit(entry_url, save_folder, quality, title=entry.get("title"), priority=priority)
+            count += 1
+            if on_job:
+                on_job(job)
+            while queue.pending_count > queue.max_workers * PENDING_LIMIT_PER_WORKER:
+                await asyncio.sleep(0.5)
+    finally:
+        try:
+            entries.close()
+        except ValueError:
+            # キャンセル時は別スレッドでジェネレータが実行中のことがあり、閉じられない
+            pass
+    return count
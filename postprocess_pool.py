@@ -0,0 +1,41 @@
+import os
+import threading
+from contextlib import contextmanager
+from typing import Callable, Iterator, Optional
+
+import config
+
+
+class PostprocessPool:
+    """
+    CPUを使う後処理 (結合・変換・サムネイル埋め込み) の同時実行数を workers 件に制限するクラス。
+    ダウンロードを終えたジョブは slot() で後処理の枠を待つ間にダウンロードの枠を次のジョブに渡すため、
+    次の動画のダウンロードと前の動画の後処理が並行して進む。
+    枠を待つジョブが workers 件以上ある場合は渡さず、ダウンロードを後処理の速さに合わせる
+    """
+
+    def __init__(self, workers: Optional[int] = config.postprocess_workers) -> None:
+        self.workers = max(1, workers or os.cpu_count() or 1)
+        self._slots = threading.BoundedSemaphore(self.workers)
+        self._waiting = 0
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def slot(self, on_handoff: Optional[Callable[[], None]] = None) -> Iterator[None]:
+        """
+        後処理の枠を確保する。待ちに空きがあれば、枠を待つ前に on_handoff を呼ぶ
+        """
+        with self._lock:
+            handoff = self._waiting < self.workers
+            self._waiting += 1
+        try:
+            if handoff and on_handoff:
+                on_handoff()
+            self._slots.acquire()
+        finally:
+            with self._lock:
+                self._waiting -= 1
+        try:
+            yield
+        finally:
+            self._slots.release()
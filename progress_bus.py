@@ -0,0 +1,68 @@
+import threading
+import tkinter as tk
+from collections import deque
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+import config
+
+
+class ProgressBus:
+    """
+    ワーカースレッドからUIへの通知を中継するクラス。
+    publish() はキーごとに最新の通知だけを保持し、post() は全件を順番に保持する。
+    保持した通知はTkのメインスレッドで一定間隔ごとにまとめて処理されるため、
+    ワーカースレッドがTkに直接触れることはない。
+    """
+
+    def __init__(
+        self,
+        root: tk.Tk,
+        fps: int = config.progress_fps,
+        after_flush: Optional[Callable[[], None]] = None,
+    ) -> None:
+        self.root = root
+        self.interval_ms = max(1, 1000 // fps)
+        self.after_flush = after_flush
+        self._latest: Dict[Hashable, Tuple[Callable[..., Any], tuple]] = {}
+        self._posted: deque = deque()
+        self._lock = threading.Lock()
+        self._running = False
+
+    def publish(self, key: Hashable, callback: Callable[..., Any], *args: Any) -> None:
+        """
+        key の状態を更新する。次の反映までに同じキーで複数回呼ばれた場合は最後の1件だけが処理される
+        """
+        with self._lock:
+            self._latest[key] = (callback, args)
+
+    def post(self, callback: Callable[..., Any], *args: Any) -> None:
+        """
+        間引かずに必ず1回実行したい処理 (メッセージボックスなど) を登録する
+        """
+        with self._lock:
+            self._posted.append((callback, args))
+
+    def start(self) -> None:
+        if not self._running:
+            self._running = True
+            self.root.after(self.interval_ms, self._flush)
+
+    def stop(self) -> None:
+        self._running = False
+
+    def _flush(self) -> None:
+        if not self._running:
+            return
+        with self._lock:
+            latest, self._latest = self._latest, {}
+            posted, self._posted = self._posted, deque()
+
+        try:
+            for callback, args in latest.values():
+                callback(*args)
+            if (latest or posted) and self.after_flush:
+                self.after_flush()
+            for callback, args in posted:
+                callback(*args)
+        finally:
+            self.root.after(self.interval_ms, self._flush)
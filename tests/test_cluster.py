@@ -0,0 +1,131 @@
+"""
+コーディネーターとワーカーのテスト。リースの期限切れによる貸し直し、ハートビートによる延長、
+終了するワーカーからの返却を確かめ、2つのワーカーのうち1つを強制終了しても全ジョブが終わることを確かめる
+"""
+
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT))
+sys.path.insert(0, str(REPO_ROOT / "benchmarks"))
+
+from coordinator import Coordinator, CoordinatorServer  # noqa: E402
+from download_queue import JobStatus  # noqa: E402
+from standin_server import StandinServer  # noqa: E402
+
+# ワーカーのハートビートの間隔 (config.worker_heartbeat_interval) より長くする
+LEASE_SECONDS = 8
+
+
+def _wait_until(predicate, timeout: float) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.1)
+    return False
+
+
+def test_expired_lease_is_leased_to_another_worker():
+    coordinator = Coordinator(lease_seconds=0.2)
+    job = coordinator.submit("https://example.com/video", "720")
+    [leased] = coordinator.lease("w0", 1)
+    lease_id = leased.lease_id
+
+    time.sleep(0.3)
+    assert [j.job_id for j in coordinator.lease("w1", 1)] == [job.job_id]
+    assert job.worker_id == "w1"
+    assert job.attempts == 2
+
+    # 期限が切れたワーカーの報告は受け付けず、手放すよう指示する
+    report = {"job_id": job.job_id, "lease_id": lease_id}
+    assert coordinator.heartbeat("w0", [report]) == ([], [job.job_id])
+    assert not coordinator.complete("w0", {**report, "status": JobStatus.DONE.value})
+    assert job.status == JobStatus.RUNNING
+
+
+def test_heartbeat_renews_lease():
+    coordinator = Coordinator(lease_seconds=0.5)
+    job = coordinator.submit("https://example.com/video", "720")
+    coordinator.lease("w0", 1)
+    report = {"job_id": job.job_id, "lease_id": job.lease_id, "progress": 50.0}
+
+    for _ in range(5):
+        time.sleep(0.2)
+        assert coordinator.heartbeat("w0", [report]) == ([], [])
+    assert coordinator.lease("w1", 1) == []
+    assert job.worker_id == "w0"
+    assert job.progress == 50.0
+
+
+def test_release_requeues_without_counting_attempt():
+    coordinator = Coordinator(lease_seconds=30, max_attempts=1)
+    job = coordinator.submit("https://example.com/video", "720")
+    coordinator.lease("w0", 1)
+
+    assert coordinator.release("w0", job.job_id, job.lease_id)
+    assert job.status == JobStatus.QUEUED
+    assert job.attempts == 0
+    assert [j.job_id for j in coordinator.lease("w1", 1)] == [job.job_id]
+
+
+def test_fails_after_max_attempts():
+    coordinator = Coordinator(lease_seconds=0.1, max_attempts=2)
+    job = coordinator.submit("https://example.com/video", "720")
+    for worker_id in ("w0", "w1"):
+        assert coordinator.lease(worker_id, 1)
+        time.sleep(0.2)
+
+    coordinator.snapshot()
+    assert job.status == JobStatus.FAILED
+    assert coordinator.lease("w2", 1) == []
+
+
+def _start_worker(coordinator_url: str, worker_id: str, home: str, output: str) -> subprocess.Popen:
+    return subprocess.Popen(
+        [sys.executable, "yt_downloader_cluster.py", "worker", coordinator_url, "-o", output, "-j", "1",
+         "--worker-id", worker_id, "--no-tools"],
+        cwd=REPO_ROOT,
+        env={**os.environ, "HOME": home},
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+
+
+def test_killed_worker_jobs_are_finished_by_another_worker():
+    coordinator = Coordinator(lease_seconds=LEASE_SECONDS)
+    server = CoordinatorServer(coordinator, port=0)
+    with StandinServer(rate_limit=1_000_000) as standin, \
+            tempfile.TemporaryDirectory(prefix="yt-downloader-test-home-") as home, \
+            tempfile.TemporaryDirectory(prefix="yt-downloader-test-out-") as output:
+        standin.prepare_media(3_000_000)
+        url = server.start()
+        jobs = [coordinator.submit(standin.url(f"media/video.mp4?{index}"), "720") for index in range(3)]
+        workers = {
+            worker_id: _start_worker(url, worker_id, home, os.path.join(output, worker_id))
+            for worker_id in ("w0", "w1")
+        }
+        try:
+            assert _wait_until(lambda: {job.worker_id for job in jobs} >= {"w0", "w1"}, timeout=30)
+            [killed] = [job for job in jobs if job.worker_id == "w0"]
+            workers["w0"].kill()
+            workers["w0"].wait()
+
+            assert _wait_until(lambda: all(job.is_finished for job in coordinator.snapshot()), timeout=60)
+        finally:
+            for process in workers.values():
+                if process.poll() is None:
+                    process.send_signal(signal.SIGTERM)
+                    process.wait(timeout=30)
+            server.stop()
+
+    assert [job.status for job in jobs] == [JobStatus.DONE] * len(jobs)
+    assert killed.worker_id == "w1"
+    assert killed.attempts == 2
+    assert all(job.worker_id == "w1" for job in jobs if job is not killed)
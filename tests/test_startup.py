@@ -0,0 +1,55 @@
+"""
+起動時間の予算のテスト。GUIのモジュールを新しいプロセスで読み込み、
+benchmarks/run_benchmarks.py の STARTUP_BUDGETS に収まることと、
+重いモジュール (yt_dlp, requests) を読み込んでいないことを確かめる
+"""
+
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT / "benchmarks"))
+
+from run_benchmarks import DEFERRED_MODULES, STARTUP_BUDGETS  # noqa: E402
+
+IMPORT_SCRIPT = """
+import json, sys, time
+started = time.perf_counter()
+import yt_downloader
+imported = time.perf_counter()
+print(json.dumps({
+    "import_seconds": imported - started,
+    "loaded": [name for name in %r if name in sys.modules],
+}))
+""" % (DEFERRED_MODULES,)
+
+# 1回目は .pyc の作成やディスクの読み込みで遅くなるため、複数回の最小値で判定する
+RUNS = 3
+
+
+def _measure_import(home: str) -> dict:
+    completed = subprocess.run(
+        [sys.executable, "-c", IMPORT_SCRIPT],
+        cwd=REPO_ROOT,
+        env={**os.environ, "HOME": home},
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def test_import_is_within_budget_and_defers_heavy_modules():
+    with tempfile.TemporaryDirectory(prefix="yt-downloader-test-home-") as home:
+        runs = [_measure_import(home) for _ in range(RUNS)]
+
+    for run in runs:
+        assert run["loaded"] == [], f"起動時に読み込まれています: {run['loaded']}"
+    import_seconds = min(run["import_seconds"] for run in runs)
+    assert import_seconds < STARTUP_BUDGETS["import_seconds"], (
+        f"import に {import_seconds:.3f} 秒かかりました (予算: {STARTUP_BUDGETS['import_seconds']} 秒)"
+    )
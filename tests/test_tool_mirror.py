@@ -0,0 +1,75 @@
+"""
+ツールのミラーのテスト。tool_mirror export で作ったフォルダを config.tool_mirrors に指定してツールを入れ、
+公開URL (ローカルの代替サーバー) に取りに行かないことを確かめる。
+ミラーが無い・中身が壊れている場合は公開URLから取得してインストールできることを確かめる
+"""
+
+import asyncio
+import sys
+from pathlib import Path
+
+import pytest
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT))
+sys.path.insert(0, str(REPO_ROOT / "benchmarks"))
+
+import config  # noqa: E402
+import tool_manager  # noqa: E402
+import tool_mirror  # noqa: E402
+from standin_server import StandinServer  # noqa: E402
+
+ALL_READY = {name: True for name in tool_manager.ToolBootstrap.TOOLS}
+
+
+@pytest.fixture
+def standin(monkeypatch):
+    """ツールの公開URLを代替サーバーに向ける"""
+    with StandinServer() as server:
+        server.prepare_tools()
+        monkeypatch.setattr(config, "ffmpeg_url", server.url("tools/ffmpeg.zip"))
+        monkeypatch.setattr(config, "ffprobe_url", server.url("tools/ffprobe.zip"))
+        monkeypatch.setattr(config, "atomicparsley_url", server.url("tools/AtomicParsley.zip"))
+        monkeypatch.setattr(config, "yt_dlp_url", server.url("tools/yt-dlp_macos"))
+        monkeypatch.setattr(config, "tool_mirrors", [])
+        yield server
+
+
+@pytest.fixture
+def mirror(standin, tmp_path) -> Path:
+    mirror_dir = tmp_path / "mirror"
+    assert tool_mirror.main(["export", str(mirror_dir)]) == 0
+    return mirror_dir
+
+
+def _install(save_dir: Path) -> dict:
+    return asyncio.run(tool_manager.ToolBootstrap(tool_manager.ToolManager(save_dir)).run())
+
+
+def test_installs_from_offline_mirror(standin, mirror, tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "tool_mirrors", [str(mirror)])
+    requests_before = standin.request_count
+
+    assert _install(tmp_path / "tools") == ALL_READY
+    assert standin.request_count == requests_before
+
+
+def test_falls_back_when_mirror_is_missing(standin, tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "tool_mirrors", [str(tmp_path / "missing")])
+    requests_before = standin.request_count
+
+    assert _install(tmp_path / "tools") == ALL_READY
+    assert standin.request_count > requests_before
+
+
+def test_falls_back_when_mirror_is_corrupt(standin, mirror, tmp_path, monkeypatch):
+    for path in (mirror / tool_mirror.OBJECTS_DIR).iterdir():
+        path.write_bytes(b"corrupt")
+    monkeypatch.setattr(config, "tool_mirrors", [str(mirror)])
+    requests_before = standin.request_count
+
+    assert _install(tmp_path / "tools") == ALL_READY
+    assert standin.request_count > requests_before
+    # 壊れたファイルではなく公開URLのファイルがキャッシュに入っている
+    sums = tool_mirror.parse_sums((tmp_path / "tools" / "cache" / tool_mirror.SUMS_FILE).read_text(encoding="utf-8"))
+    assert sums["ffmpeg.zip"] == tool_mirror.file_sha256(standin.root_dir / "tools" / "ffmpeg.zip")
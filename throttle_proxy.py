@@ -0,0 +1,134 @@
+import socket
+import socketserver
+import sys
+import threading
+from typing import Callable, Optional
+from urllib.parse import urlsplit
+
+import config
+
+# 接続先から一度に読むバイト数。読むたびに帯域を報告する
+CHUNK_SIZE = 64 * 1024
+
+# リクエストのヘッダーの上限 (バイト)
+MAX_HEAD_SIZE = 64 * 1024
+
+
+class _Server(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, report: Callable[[str, int], None], timeout: float) -> None:
+        super().__init__(("127.0.0.1", 0), _RelayHandler)
+        self.report = report
+        self.connect_timeout = timeout
+
+    def handle_error(self, request, client_address) -> None:
+        # ffmpeg はシークのたびに接続を切ることがあるため、切断はエラーとして表示しない
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+class _RelayHandler(socketserver.StreamRequestHandler):
+    server: _Server
+
+    def handle(self) -> None:
+        head = b""
+        while not head.endswith(b"\r\n\r\n"):
+            line = self.rfile.readline(MAX_HEAD_SIZE)
+            if not line or len(head) + len(line) > MAX_HEAD_SIZE:
+                return
+            head += line
+        request_line, _, headers = head.partition(b"\r\n")
+        method, target, version = (request_line.split(b" ", 2) + [b"", b""])[:3]
+        if method == b"CONNECT":
+            # https はトンネルを中継する。暗号化されたまま流すため中身は見ない
+            host, _, port = target.decode("ascii").rpartition(":")
+            address = (host.strip("[]"), int(port))
+        else:
+            # http はプロキシ向けの形式 (GET http://host/path) を接続先向けの形式 (GET /path) に直して送る
+            parts = urlsplit(target.decode("ascii"))
+            if parts.scheme != "http" or not parts.hostname:
+                self.wfile.write(b"HTTP/1.1 400 Bad Request\r\nContent-Length: 0\r\n\r\n")
+                return
+            address = (parts.hostname, parts.port or 80)
+            path = (parts.path or "/") + (f"?{parts.query}" if parts.query else "")
+            head = b" ".join([method, path.encode("ascii"), version]) + b"\r\n" + headers
+        try:
+            upstream = socket.create_connection(address, timeout=self.server.connect_timeout)
+        except OSError:
+            self.wfile.write(b"HTTP/1.1 502 Bad Gateway\r\nContent-Length: 0\r\n\r\n")
+            return
+        with upstream:
+            upstream.settimeout(None)
+            if method == b"CONNECT":
+                self.wfile.write(b"HTTP/1.1 200 Connection established\r\n\r\n")
+                self.wfile.flush()
+            else:
+                upstream.sendall(head)
+            sender = threading.Thread(target=self._send_upstream, args=(upstream,), daemon=True)
+            sender.start()
+            self._receive_upstream(upstream)
+            sender.join()
+
+    def _send_upstream(self, upstream: socket.socket) -> None:
+        # ヘッダーの後に読み込み済みのデータがあれば、バッファから先に送る
+        try:
+            while True:
+                data = self.rfile.read1(CHUNK_SIZE)
+                if not data:
+                    break
+                upstream.sendall(data)
+            upstream.shutdown(socket.SHUT_WR)
+        except OSError:
+            pass
+
+    def _receive_upstream(self, upstream: socket.socket) -> None:
+        stream = f"proxy:{self.client_address[1]}"
+        received = 0
+        try:
+            while True:
+                data = upstream.recv(CHUNK_SIZE)
+                if not data:
+                    break
+                self.request.sendall(data)
+                received += len(data)
+                # 割り当てを超えていればここで待つため、ffmpeg の受信もその分だけ遅れる
+                self.server.report(stream, received)
+        except Exception:
+            # 切断されたときのほか、中止などで報告先が例外を送出したときも接続を切り、ffmpeg の取得を終わらせる
+            pass
+        finally:
+            for sock in (self.request, upstream):
+                try:
+                    sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+
+
+class ThrottleProxy:
+    """
+    ffmpeg が取得する範囲のダウンロードを帯域の割り当てに従わせるローカルのHTTPプロキシ。
+    yt-dlp は範囲の取得を ffmpeg に任せ、ffmpeg は終わるまで進捗を報告しないため、進捗フックでは帯域を抑えられない。
+    ffmpeg の接続をこのプロキシで中継し、受信したバイト数を report(ストリーム名, 累計バイト数) で報告する。
+    report が戻るまで次を読まないため、割り当てを超えた分だけ ffmpeg の受信が待たされる
+
+        with ThrottleProxy(report) as proxy_url:
+            ...  # proxy_url を yt-dlp の proxy に指定して ffmpeg で取得する
+    """
+
+    def __init__(self, report: Callable[[str, int], None], timeout: float = config.fetch_timeout) -> None:
+        self.report = report
+        self.timeout = timeout
+        self._server: Optional[_Server] = None
+
+    def __enter__(self) -> str:
+        self._server = _Server(self.report, self.timeout)
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def __exit__(self, *exc_info) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+        self._server = None
@@ -1,23 +1,61 @@
+import asyncio
 import os
 import subprocess
+import threading
 import zipfile
+from contextlib import contextmanager
+from enum import Enum
 from pathlib import Path
-
-import requests
+from typing import TYPE_CHECKING, Callable, Dict, Iterable, Iterator, List, Optional
 
 import config
+from tool_manifest import ToolManifest, file_lock, file_sha256
+from tool_mirror import ToolSources
+
+# requests の読み込みは起動時間に響くため、ダウンロードが必要になるまで遅らせる
+if TYPE_CHECKING:
+    from file_fetcher import FileFetcher, ProgressCallback
+
+_path_lock = threading.Lock()
 
 
 class ToolManager:
-    def __init__(self, save_dir=None):
+    def __init__(self, save_dir=None, mirrors: Optional[List[str]] = None):
         """
         macOSでは ~/Library/Application Support/yt-downloader/tools をデフォルト保存先とします。
+        保存先のフォルダは最初のダウンロード時に作成します。
+        mirrors を省略すると config.tool_mirrors のミラーを公開URLより先に試します。
         """
         if save_dir is None:
             self.save_dir = Path.home() / "Library" / "Application Support" / "yt-downloader" / "tools"
-            self.save_dir.mkdir(parents=True, exist_ok=True)
         else:
             self.save_dir = Path(save_dir)
+        self._fetcher: Optional["FileFetcher"] = None
+        self.manifest = ToolManifest(self.save_dir / "manifest.json")
+        self.sources = ToolSources(
+            config.tool_mirrors if mirrors is None else mirrors,
+            self.save_dir / "cache" if config.tool_cache_enabled else None,
+            lambda: self.fetcher,
+        )
+
+    @property
+    def fetcher(self) -> "FileFetcher":
+        if self._fetcher is None:
+            from file_fetcher import FileFetcher
+
+            self._fetcher = FileFetcher()
+        return self._fetcher
+
+    @contextmanager
+    def install_lock(self, tool_name: str) -> Iterator[None]:
+        """
+        ツールの確認・インストールの間、同じ保存先を使う他のプロセスと排他する。
+        同じマシンの複数のワーカーが同時に .part やマニフェストを書き換えないようにする
+        """
+        with file_lock(self.save_dir / "locks" / f"{tool_name}.lock"):
+            # 待っている間に他のプロセスがインストールした結果を読み直す
+            self.manifest.reload()
+            yield
 
     def _get_tool_path(self, tool_name: str) -> Path:
         """
@@ -38,41 +76,83 @@ class ToolManager:
         tool_path = self._get_tool_path(tool_name)  # save_dir 内のツールのパスを取得
         return tool_path.exists() and tool_path.is_file()
 
-    def download_file(self, url: str, save_path: str) -> bool:
+    def _add_save_dir_to_path(self) -> None:
+        """
+        save_dir を PATH に追加する。複数スレッドから呼ばれても重複追加しない
+        """
+        with _path_lock:
+            paths = os.environ.get("PATH", "").split(os.pathsep)
+            if str(self.save_dir) not in paths:
+                os.environ["PATH"] += os.pathsep + str(self.save_dir)
+
+    def _is_up_to_date(self, tool_name: str, url: str) -> bool:
         """
-        指定URLのファイルをダウンロードし、save_pathに保存する
+        インストール済みのツールをマニフェストと照合し、再インストール不要なら True を返す。
+        TTLが切れている場合のみハッシュを検証するため、通常の起動ではファイルを読まない
         """
+        tool_path = self._get_tool_path(tool_name)
+        entry = self.manifest.get(tool_name)
+        if entry is None:
+            # マニフェスト導入前にインストールされたツールはそのまま登録する
+            self.manifest.record(tool_name, url, tool_path, self._read_version(tool_name))
+            return True
+        if entry["url"] != url:
+            return False
+        if not self.manifest.is_expired(tool_name, config.tool_update_check_ttl):
+            return True
+        if entry["sha256"] != file_sha256(tool_path):
+            print(f"{tool_name}のハッシュが一致しないため再インストールします")
+            return False
+        self.manifest.mark_checked(tool_name)
+        return True
+
+    def _read_version(self, tool_name: str) -> Optional[str]:
+        """
+        ツールのバージョン表示の1行目を返す。取得できなければ None
+        """
+        flag = "-version" if tool_name in ("ffmpeg", "ffprobe") else "--version"
         try:
-            response = requests.get(url, stream=True)
-            response.raise_for_status()  # ステータスコード200以外で例外発生
-            with open(save_path, "wb") as file:
-                for chunk in response.iter_content(chunk_size=1024):
-                    file.write(chunk)
+            result = subprocess.run(
+                [str(self._get_tool_path(tool_name)), flag], capture_output=True, text=True, timeout=10
+            )
+        except (OSError, subprocess.SubprocessError):
+            return None
+        lines = result.stdout.strip().splitlines()
+        return lines[0] if result.returncode == 0 and lines else None
+
+    def download_file(self, url: str, save_path: str, progress_callback: Optional["ProgressCallback"] = None) -> bool:
+        """
+        指定URLのファイルをキャッシュ・ミラー・URLの順に探して取得し、save_pathに保存する
+        """
+        import requests
+
+        try:
+            Path(save_path).parent.mkdir(parents=True, exist_ok=True)
+            # 取得中の内容は .part に書き込まれ、完了時に save_path へリネームされる
+            self.sources.fetch(url, Path(save_path), progress_callback)
             return True
-        except requests.RequestException as e:
+        except (requests.RequestException, OSError) as e:
             print(f"ダウンロードエラー: {e}")
             return False
 
-    def check_and_download_ffmpeg(self) -> bool:
+    def check_and_download_ffmpeg(self, progress_callback: Optional["ProgressCallback"] = None) -> bool:
         """
         ffmpegをシステムパスもしくは同梱ツールとして確認し、なければダウンロードして解凍する
         """
         ffmpeg_path = self._get_tool_path("ffmpeg")  # macOSなら拡張子不要
-        if self.is_tool_installed("ffmpeg"):
-            return True
-        if ffmpeg_path.exists():
-            # PATHに追加
-            os.environ["PATH"] += os.pathsep + str(self.save_dir)
-            return True
-
         # mac向けのバイナリ配布URL例: https://evermeet.cx/ffmpeg/
         # 必要に応じてバージョン、URLを修正してください
         url = config.ffmpeg_url
+        if self.is_tool_installed("ffmpeg") and self._is_up_to_date("ffmpeg", url):
+            # PATHに追加
+            self._add_save_dir_to_path()
+            return True
+
         zip_path = self._get_tool_path("ffmpeg.zip")
 
         try:
             # ダウンロード
-            if self.download_file(url, str(zip_path)):
+            if self.download_file(url, str(zip_path), progress_callback):
                 # ZIP解凍: Python標準ライブラリのzipfileを使用
                 with zipfile.ZipFile(zip_path, "r") as zf:
                     zf.extractall(self.save_dir)
@@ -88,9 +168,10 @@ class ToolManager:
 
                 # 実行権限を付与（念のため）
                 ffmpeg_path.chmod(0o755)
+                self.manifest.record("ffmpeg", url, ffmpeg_path, self._read_version("ffmpeg"))
 
                 # パスに追加
-                os.environ["PATH"] += os.pathsep + str(self.save_dir)
+                self._add_save_dir_to_path()
                 zip_path.unlink(missing_ok=True)
                 return True
         except Exception as e:
@@ -99,24 +180,22 @@ class ToolManager:
 
         return False
     
-    def check_and_download_ffprobe(self) -> bool:
+    def check_and_download_ffprobe(self, progress_callback: Optional["ProgressCallback"] = None) -> bool:
         """
         ffprobeをシステムパスもしくは同梱ツールとして確認し、なければダウンロードして解凍する
         """
         ffprobe_path = self._get_tool_path("ffprobe")  # macOSなら拡張子不要
-        if self.is_tool_installed("ffprobe"):
-            return True
-        if ffprobe_path.exists():
+        url = config.ffprobe_url
+        if self.is_tool_installed("ffprobe") and self._is_up_to_date("ffprobe", url):
             # PATHに追加
-            os.environ["PATH"] += os.pathsep + str(self.save_dir)
+            self._add_save_dir_to_path()
             return True
 
-        url = config.ffprobe_url
         zip_path = self._get_tool_path("ffprobe.zip")
 
         try:
             # ダウンロード
-            if self.download_file(url, str(zip_path)):
+            if self.download_file(url, str(zip_path), progress_callback):
                 # ZIP解凍: Python標準ライブラリのzipfileを使用
                 with zipfile.ZipFile(zip_path, "r") as zf:
                     zf.extractall(self.save_dir)
@@ -132,9 +211,10 @@ class ToolManager:
 
                 # 実行権限を付与（念のため）
                 ffprobe_path.chmod(0o755)
+                self.manifest.record("ffprobe", url, ffprobe_path, self._read_version("ffprobe"))
 
                 # パスに追加
-                os.environ["PATH"] += os.pathsep + str(self.save_dir)
+                self._add_save_dir_to_path()
                 zip_path.unlink(missing_ok=True)
                 return True
         except Exception as e:
@@ -143,51 +223,53 @@ class ToolManager:
 
         return False
 
-    def check_and_download_yt_dlp(self) -> bool:
+    def check_and_download_yt_dlp(self, progress_callback: Optional["ProgressCallback"] = None) -> bool:
         """
         yt-dlpを同梱ツールとして確認し、なければダウンロード
         """
         yt_dlp_path = self._get_tool_path("yt-dlp")  # macOSなら拡張子不要
-
-        # システムインストール済みならOK
-        if self.is_tool_installed("yt-dlp"):
-            return True
-
-        # 保存先にファイルがあるか
-        if yt_dlp_path.exists():
-            # アップデート試行 (macOSの場合、'-U'で動くかはビルド方法により異なる)
-            subprocess.run([str(yt_dlp_path), "-U"], check=False)
-            return True
-
         # macOS向け最新リリース (アーキテクチャに合わせて"_macos"などを選択)
         # https://github.com/yt-dlp/yt-dlp/releases/latest
         url = config.yt_dlp_url
-        if self.download_file(url, str(yt_dlp_path)):
+
+        # 保存先にファイルがあり、取得元URLが変わっていなければ再ダウンロード不要
+        entry = self.manifest.get("yt-dlp")
+        if self.is_tool_installed("yt-dlp") and (entry is None or entry["url"] == url):
+            # アップデートの確認はTTLが切れたときだけ行う
+            # (macOSの場合、'-U'で動くかはビルド方法により異なる)
+            if self.manifest.is_expired("yt-dlp", config.tool_update_check_ttl):
+                try:
+                    subprocess.run([str(yt_dlp_path), "-U"], check=False, timeout=300)
+                except (OSError, subprocess.SubprocessError) as e:
+                    print(f"yt-dlpのアップデートに失敗しました: {e}")
+                self.manifest.record("yt-dlp", url, yt_dlp_path, self._read_version("yt-dlp"))
+            self._add_save_dir_to_path()
+            return True
+
+        if self.download_file(url, str(yt_dlp_path), progress_callback):
             yt_dlp_path.chmod(0o755)
-            os.environ["PATH"] += os.pathsep + str(self.save_dir)
+            self.manifest.record("yt-dlp", url, yt_dlp_path, self._read_version("yt-dlp"))
+            self._add_save_dir_to_path()
             return True
 
         return False
 
-    def check_and_download_atomicparsley(self) -> bool:
+    def check_and_download_atomicparsley(self, progress_callback: Optional["ProgressCallback"] = None) -> bool:
         """
         AtomicParsleyを同梱ツールとして確認し、なければダウンロード
         """
 
         atomic_path = self._get_tool_path("AtomicParsley")
+        url = config.atomicparsley_url
 
-        # システムインストール済みならOK
-        if self.is_tool_installed("AtomicParsley"):
-            return True
-
-        if atomic_path.exists():
-            os.environ["PATH"] += os.pathsep + str(self.save_dir)
+        # インストール済みかつマニフェストと一致すればOK
+        if self.is_tool_installed("AtomicParsley") and self._is_up_to_date("AtomicParsley", url):
+            self._add_save_dir_to_path()
             return True
 
-        url = config.atomicparsley_url
         zip_path = self._get_tool_path("AtomicParsley.zip")
 
-        if self.download_file(url, str(zip_path)):
+        if self.download_file(url, str(zip_path), progress_callback):
             try:
                 with zipfile.ZipFile(zip_path, "r") as zf:
                     zf.extractall(self.save_dir)
@@ -199,7 +281,8 @@ class ToolManager:
                 if extracted_ap.exists():
                     extracted_ap.rename(atomic_path)
                     atomic_path.chmod(0o755)
-                    os.environ["PATH"] += os.pathsep + str(self.save_dir)
+                    self.manifest.record("AtomicParsley", url, atomic_path, self._read_version("AtomicParsley"))
+                    self._add_save_dir_to_path()
                     return True
                 else:
                     print("解凍後のAtomicParsleyが見つかりませんでした")
@@ -211,31 +294,103 @@ class ToolManager:
         return False
 
 
+class ToolStatus(Enum):
+    """ブートストラップ中の各ツールの状態"""
+
+    CHECKING = "checking"
+    DOWNLOADING = "downloading"
+    READY = "ready"
+    FAILED = "failed"
+
+
+# ブートストラップの進捗通知先 (tool_name, status, downloaded_bytes, total_bytes)
+BootstrapCallback = Callable[[str, ToolStatus, int, int], None]
+
+
+class ToolBootstrap:
+    """
+    不足しているツールをasyncioループ上で並列に確認・ダウンロードする。
+    各ツールは準備ができ次第 wait_for() で待っている処理に通知される。
+    """
+
+    TOOLS = {
+        "ffmpeg": "check_and_download_ffmpeg",
+        "ffprobe": "check_and_download_ffprobe",
+        "yt-dlp": "check_and_download_yt_dlp",
+        "AtomicParsley": "check_and_download_atomicparsley",
+    }
+
+    def __init__(self, tool_manager: ToolManager, on_progress: Optional[BootstrapCallback] = None) -> None:
+        self.tool_manager = tool_manager
+        self.on_progress = on_progress
+        self.status: Dict[str, ToolStatus] = {name: ToolStatus.CHECKING for name in self.TOOLS}
+        self._events: Dict[str, asyncio.Event] = {}
+
+    def _event(self, tool_name: str) -> asyncio.Event:
+        # asyncio.Event はループ上で生成する必要があるため遅延生成する
+        if tool_name not in self._events:
+            self._events[tool_name] = asyncio.Event()
+        return self._events[tool_name]
+
+    def _notify(self, tool_name: str, status: ToolStatus, downloaded: int = 0, total: int = 0) -> None:
+        self.status[tool_name] = status
+        if self.on_progress:
+            self.on_progress(tool_name, status, downloaded, total)
+
+    async def run(self) -> Dict[str, bool]:
+        """
+        全ツールを並列に準備し、ツール名ごとの成否を返す
+        """
+        results = await asyncio.gather(*(self._install(name) for name in self.TOOLS))
+        return dict(zip(self.TOOLS, results))
+
+    async def _install(self, tool_name: str) -> bool:
+        last_percent = -1
+
+        def progress(downloaded: int, total: int) -> None:
+            nonlocal last_percent
+            # チャンクごとに通知すると多すぎるため1%単位に間引く
+            percent = downloaded * 100 // total if total else -1
+            if percent != last_percent or not total:
+                last_percent = percent
+                self._notify(tool_name, ToolStatus.DOWNLOADING, downloaded, total)
+
+        self._notify(tool_name, ToolStatus.CHECKING)
+        method = getattr(self.tool_manager, self.TOOLS[tool_name])
+
+        def install() -> bool:
+            with self.tool_manager.install_lock(tool_name):
+                return method(progress)
+
+        try:
+            ok = await asyncio.to_thread(install)
+        except Exception as e:
+            print(f"{tool_name}の準備中にエラーが発生しました: {e}")
+            ok = False
+        self._notify(tool_name, ToolStatus.READY if ok else ToolStatus.FAILED)
+        self._event(tool_name).set()
+        return ok
+
+    async def wait_for(self, tool_names: Iterable[str]) -> None:
+        """
+        指定ツールの準備完了を待つ。いずれかが失敗していれば RuntimeError を送出する
+        """
+        for tool_name in tool_names:
+            await self._event(tool_name).wait()
+            if self.status[tool_name] != ToolStatus.READY:
+                raise RuntimeError(f"{tool_name}のインストールに失敗しました")
+
+
 def main():
-    tm = ToolManager()
-    print("Checking ffmpeg...")
-    if tm.check_and_download_ffmpeg():
-        print("ffmpeg OK")
-    else:
-        print("ffmpeg install failed")
-    
-    print("Checking ffprobe...")
-    if tm.check_and_download_ffprobe():
-        print("ffprobe OK")
-    else:
-        print("ffprobe install failed")
-
-    print("Checking yt-dlp...")
-    if tm.check_and_download_yt_dlp():
-        print("yt-dlp OK")
-    else:
-        print("yt-dlp install failed")
-
-    print("Checking AtomicParsley...")
-    if tm.check_and_download_atomicparsley():
-        print("AtomicParsley OK")
-    else:
-        print("AtomicParsley install failed")
+    def report(tool_name: str, status: ToolStatus, downloaded: int, total: int) -> None:
+        if status == ToolStatus.CHECKING:
+            print(f"Checking {tool_name}...")
+        elif status == ToolStatus.READY:
+            print(f"{tool_name} OK")
+        elif status == ToolStatus.FAILED:
+            print(f"{tool_name} install failed")
+
+    asyncio.run(ToolBootstrap(ToolManager(), report).run())
 
 
 if __name__ == "__main__":
@@ -0,0 +1,110 @@
+import fcntl
+import hashlib
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterator, Optional
+
+
+def file_sha256(path: Path) -> str:
+    """
+    ファイルのSHA-256を計算する
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+@contextmanager
+def file_lock(path: Path) -> Iterator[None]:
+    """
+    path をロックファイルとして、他のプロセスと排他する。
+    同じマシンで複数のワーカーがツールの保存先を共有するときに使う
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "a") as file:
+        fcntl.flock(file.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(file.fileno(), fcntl.LOCK_UN)
+
+
+class ToolManifest:
+    """
+    インストール済みツールの情報 (バージョン、取得元URL、ハッシュ、最終確認時刻) を
+    JSONファイルに保存・管理するクラス。
+    ブートストラップ中は複数スレッドから更新されるためロックで保護する。
+    他のプロセスも同じファイルを更新するため、書き込みはファイルをロックして読み直してから行う。
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = Path(path)
+        self._entries: Optional[Dict[str, dict]] = None
+        self._lock = threading.Lock()
+
+    def _load(self) -> Dict[str, dict]:
+        # 起動時に読み込まずに済むよう、初回アクセス時に読み込む
+        if self._entries is None:
+            try:
+                self._entries = json.loads(self.path.read_text(encoding="utf-8")).get("tools", {})
+            except (OSError, ValueError):
+                self._entries = {}
+        return self._entries
+
+    @contextmanager
+    def _updating(self) -> Iterator[Dict[str, dict]]:
+        with self._lock, file_lock(self.path.with_name(self.path.name + ".lock")):
+            self._entries = None
+            entries = self._load()
+            yield entries
+            self._save()
+
+    def _save(self) -> None:
+        tmp_path = self.path.with_name(self.path.name + ".tmp")
+        tmp_path.write_text(json.dumps({"tools": self._entries}, indent=2, ensure_ascii=False), encoding="utf-8")
+        os.replace(tmp_path, self.path)
+
+    def reload(self) -> None:
+        """次のアクセス時にファイルから読み直す"""
+        with self._lock:
+            self._entries = None
+
+    def get(self, tool_name: str) -> Optional[dict]:
+        with self._lock:
+            entry = self._load().get(tool_name)
+            return dict(entry) if entry else None
+
+    def record(self, tool_name: str, url: str, tool_path: Path, version: Optional[str]) -> None:
+        """
+        インストール・更新したツールの情報を記録する
+        """
+        sha256 = file_sha256(tool_path)
+        now = time.time()
+        with self._updating() as entries:
+            entries[tool_name] = {
+                "version": version,
+                "url": url,
+                "sha256": sha256,
+                "installed_at": now,
+                "checked_at": now,
+            }
+
+    def mark_checked(self, tool_name: str) -> None:
+        with self._updating() as entries:
+            entry = entries.get(tool_name)
+            if entry is not None:
+                entry["checked_at"] = time.time()
+
+    def is_expired(self, tool_name: str, ttl: float) -> bool:
+        """
+        前回の確認から ttl 秒以上経過していれば True
+        """
+        entry = self.get(tool_name)
+        return entry is None or time.time() - entry.get("checked_at", 0) >= ttl
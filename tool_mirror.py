@@ -0,0 +1,217 @@
+import argparse
+import os
+import shutil
+import sys
+import threading
+from pathlib import Path
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional
+from urllib.parse import quote, unquote, urlsplit
+
+import config
+from tool_manifest import file_lock, file_sha256
+
+if TYPE_CHECKING:
+    from file_fetcher import FileFetcher, ProgressCallback
+
+# ファイル名とハッシュの一覧 (sha256sum の出力と同じ形式)
+SUMS_FILE = "SHA256SUMS"
+# 内容のハッシュを名前にしたファイルを置くフォルダ
+OBJECTS_DIR = "sha256"
+
+
+def tool_urls() -> List[str]:
+    return [config.ffmpeg_url, config.ffprobe_url, config.atomicparsley_url, config.yt_dlp_url]
+
+
+def tool_file_name(url: str) -> str:
+    return os.path.basename(unquote(urlsplit(url).path))
+
+
+def parse_sums(text: str) -> Dict[str, str]:
+    """sha256sum 形式の一覧を {ファイル名: ハッシュ} にする"""
+    sums = {}
+    for line in text.splitlines():
+        digest, _, name = line.strip().partition(" ")
+        name = name.strip().lstrip("*")
+        if len(digest) == 64 and name:
+            sums[name] = digest.lower()
+    return sums
+
+
+def link_or_copy(source: Path, dest: Path) -> None:
+    """
+    source を dest にハードリンクする。別のボリュームにある場合や他のユーザーのファイルの場合はコピーする。
+    他のユーザーのファイルにリンクすると、実行権限の付与 (chmod) が失敗するため
+    """
+    dest.unlink(missing_ok=True)
+    if source.stat().st_uid == os.getuid():
+        try:
+            os.link(source, dest)
+            return
+        except OSError:
+            pass
+    shutil.copyfile(source, dest)
+
+
+def _is_http(source: str) -> bool:
+    return urlsplit(source).scheme in ("http", "https")
+
+
+def _local_dir(source: str) -> Path:
+    if source.startswith("file://"):
+        return Path(unquote(urlsplit(source).path))
+    return Path(source).expanduser()
+
+
+class ToolSources:
+    """
+    ツールのファイルを、ローカルのキャッシュ → 設定したミラー → 公開URL の順に探して取得するクラス。
+    ミラーはローカルのフォルダ (共有フォルダを含む) かHTTPのURLで、キャッシュと同じく SHA256SUMS と
+    ハッシュを名前にしたファイル (sha256/<ハッシュ>)、または公開URLと同じ名前のファイルを置く。
+    一覧にハッシュがあるファイルは内容を検証し、一致しなければ次の取得元を試す。
+    取得したファイルはキャッシュにハードリンクで残すため、同じファイルを再びダウンロードせずに済む。
+    ハードリンクするのは自分のキャッシュとの間だけで、ミラーのファイルはコピーする
+    """
+
+    def __init__(
+        self, mirrors: List[str], cache_dir: Optional[Path], fetcher: Callable[[], "FileFetcher"]
+    ) -> None:
+        self.mirrors = list(mirrors)
+        self.cache_dir = Path(cache_dir) if cache_dir else None
+        self._fetcher = fetcher
+        # HTTPのミラーの一覧は1回だけ取得する
+        self._http_sums: Dict[str, Dict[str, str]] = {}
+        self._lock = threading.Lock()
+
+    def _sums(self, source: str) -> Dict[str, str]:
+        import requests
+
+        if not _is_http(source):
+            try:
+                return parse_sums((_local_dir(source) / SUMS_FILE).read_text(encoding="utf-8"))
+            except OSError:
+                return {}
+        with self._lock:
+            if source in self._http_sums:
+                return self._http_sums[source]
+        try:
+            response = self._fetcher().session.get(f"{source.rstrip('/')}/{SUMS_FILE}", timeout=config.fetch_timeout)
+            sums = parse_sums(response.text) if response.ok else {}
+        except requests.RequestException:
+            sums = {}
+        with self._lock:
+            self._http_sums[source] = sums
+        return sums
+
+    def _get(self, source: str, relative: str, save_path: Path, progress_callback, link: bool) -> None:
+        if _is_http(source):
+            self._fetcher().fetch(f"{source.rstrip('/')}/{quote(relative)}", str(save_path), progress_callback)
+            return
+        path = _local_dir(source) / relative
+        if not path.is_file():
+            raise FileNotFoundError(path)
+        if link:
+            link_or_copy(path, save_path)
+        else:
+            # ミラーのファイルにリンクすると、インストール時の chmod や展開がミラーの内容を変えてしまうためコピーする
+            save_path.unlink(missing_ok=True)
+            shutil.copyfile(path, save_path)
+        if progress_callback:
+            size = path.stat().st_size
+            progress_callback(size, size)
+
+    def fetch(self, url: str, save_path: Path, progress_callback: Optional["ProgressCallback"] = None) -> str:
+        """
+        url のファイルを save_path に保存し、取得元 (キャッシュ・ミラー・url) を返す。
+        どこからも取得できなければ、公開URLからの取得の例外 (requests.RequestException か OSError) を送出する
+        """
+        import requests
+
+        save_path = Path(save_path)
+        name = tool_file_name(url)
+        cache = str(self.cache_dir) if self.cache_dir else None
+        for source in ([cache] if cache else []) + self.mirrors:
+            digest = self._sums(source).get(name)
+            candidates = ([f"{OBJECTS_DIR}/{digest}"] if digest else []) + [name]
+            for candidate in candidates:
+                try:
+                    self._get(source, candidate, save_path, progress_callback, link=source == cache)
+                except (requests.RequestException, OSError):
+                    continue
+                if digest and file_sha256(save_path) != digest:
+                    print(f"{source} の {name} のハッシュが一致しないため使いません")
+                    save_path.unlink(missing_ok=True)
+                    continue
+                if source != cache:
+                    self.store(save_path, name)
+                return source
+
+        self._fetcher().fetch(url, str(save_path), progress_callback)
+        self.store(save_path, name)
+        return url
+
+    def store(self, path: Path, name: str) -> None:
+        """
+        ファイルをキャッシュに追加する。同じ名前の古い内容は、他の名前から参照されていなければ削除する
+        """
+        if self.cache_dir is None:
+            return
+        digest = file_sha256(path)
+        objects_dir = self.cache_dir / OBJECTS_DIR
+        sums_path = self.cache_dir / SUMS_FILE
+        try:
+            # 同じキャッシュを使う他のプロセスと、一覧の読み書きが重ならないようにする
+            with self._lock, file_lock(self.cache_dir / (SUMS_FILE + ".lock")):
+                objects_dir.mkdir(parents=True, exist_ok=True)
+                if not (objects_dir / digest).exists():
+                    link_or_copy(path, objects_dir / digest)
+                try:
+                    sums = parse_sums(sums_path.read_text(encoding="utf-8"))
+                except OSError:
+                    sums = {}
+                previous = sums.get(name)
+                sums[name] = digest
+                if previous and previous != digest and previous not in sums.values():
+                    (objects_dir / previous).unlink(missing_ok=True)
+                tmp_path = sums_path.with_name(SUMS_FILE + ".tmp")
+                tmp_path.write_text("".join(f"{h}  {n}\n" for n, h in sorted(sums.items())), encoding="utf-8")
+                os.replace(tmp_path, sums_path)
+        except OSError as e:
+            # キャッシュに残せなくてもツールのインストールは続ける
+            print(f"ツールのキャッシュへの保存に失敗しました: {e}")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(
+        description="ツールのミラーを作る。作ったフォルダをそのまま、または python -m http.server で公開して "
+        "config.tool_mirrors に指定する"
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+    export = commands.add_parser("export", help="現在の設定のツールを取得してフォルダに置く")
+    export.add_argument("directory", help="ミラーのフォルダ。既にあるファイルは取得し直さない")
+    args = parser.parse_args(argv)
+
+    import requests
+
+    from file_fetcher import FileFetcher
+
+    fetcher = FileFetcher()
+    directory = Path(args.directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    sources = ToolSources(config.tool_mirrors, directory, lambda: fetcher)
+    status = 0
+    for url in tool_urls():
+        name = tool_file_name(url)
+        download_path = directory / f"{name}.download"
+        try:
+            print(f"{name}: {sources.fetch(url, download_path)}")
+        except (requests.RequestException, OSError) as e:
+            print(f"{name}: 取得に失敗しました: {e}")
+            status = 1
+        finally:
+            download_path.unlink(missing_ok=True)
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,125 @@
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Dict, Optional
+
+# 接続と Cookie の扱いに関わるオプション。これらが同じ YoutubeDL は1つのセッションを共有できる
+SESSION_OPTIONS = (
+    "cookiefile",
+    "proxy",
+    "nocheckcertificate",
+    "source_address",
+    "socket_timeout",
+    "http_headers",
+    "impersonate",
+    "compat_opts",
+)
+
+
+class YdlSession:
+    """
+    複数の YoutubeDL で共有する Cookie とHTTPの接続プール。
+    Cookie ファイルの解析と接続の確立は最初に使われたときに1回だけ行い、以降のジョブは同じものを使う
+    """
+
+    def __init__(self, params: dict) -> None:
+        from yt_dlp import YoutubeDL
+
+        # Cookie と接続プールはこの YoutubeDL が持ち、他の YoutubeDL に貸し出す
+        self._owner = YoutubeDL({**params, "quiet": True, "no_warnings": True})
+        self.users = 0
+        # Cookie の設定が変わった後は新しいジョブに使わず、使用中のジョブが終わったら閉じる
+        self.stale = False
+
+    @property
+    def cookiejar(self):
+        return self._owner.cookiejar
+
+    @property
+    def request_director(self):
+        return self._owner._request_director
+
+    def save_cookies(self) -> None:
+        try:
+            self._owner.save_cookies()
+        except OSError as e:
+            print(f"Cookieを保存できませんでした: {e}")
+
+    def close(self, save_cookies: bool = True) -> None:
+        if save_cookies:
+            self.save_cookies()
+        # 接続プールは一度でも通信していれば作られている
+        director = self._owner.__dict__.pop("_request_director", None)
+        if director is not None:
+            director.close()
+
+
+class YdlSessionPool:
+    """
+    オプションごとの YdlSession を保持するクラス。
+    Cookie ファイルの内容の有無はメモリに保持し、Cookie の設定が保存されたときだけ読み直す。
+    セッションは使い終わるたびに Cookie をファイルに書き戻す (yt-dlp が YoutubeDL を閉じるときと同じ)
+    """
+
+    def __init__(self, cookie_file: Path) -> None:
+        self.cookie_file = Path(cookie_file)
+        self._cookie_options: Optional[dict] = None
+        self._sessions: Dict[str, YdlSession] = {}
+        self._lock = threading.Lock()
+
+    def cookie_options(self) -> dict:
+        """YoutubeDL に渡す Cookie のオプション。Cookie が設定されていなければ空の辞書"""
+        with self._lock:
+            if self._cookie_options is None:
+                try:
+                    has_cookies = bool(self.cookie_file.read_text(encoding="utf-8").strip())
+                except FileNotFoundError:
+                    has_cookies = False
+                self._cookie_options = {"cookiefile": str(self.cookie_file)} if has_cookies else {}
+            return dict(self._cookie_options)
+
+    def save_cookie_file(self, text: str) -> None:
+        """
+        Cookie の設定を保存し、古い Cookie を持つセッションを無効にする。
+        使用中のセッションが古い Cookie を書き戻さないよう、無効にしてから書き込む
+        """
+        with self._lock:
+            for session in self._sessions.values():
+                session.stale = True
+            idle = [session for session in self._sessions.values() if session.users == 0]
+            self._sessions.clear()
+            self.cookie_file.parent.mkdir(parents=True, exist_ok=True)
+            self.cookie_file.write_text(text, encoding="utf-8")
+            os.chmod(str(self.cookie_file), 0o600)  # ユーザーのみ読み書き可能に設定
+            self._cookie_options = None
+        for session in idle:
+            session.close(save_cookies=False)
+
+    def acquire(self, params: dict) -> YdlSession:
+        """params と接続の設定が同じセッションを返す。使い終わったら release() を呼ぶこと"""
+        key = json.dumps({name: params.get(name) for name in SESSION_OPTIONS}, sort_keys=True, default=str)
+        with self._lock:
+            session = self._sessions.get(key)
+            if session is None:
+                session = self._sessions[key] = YdlSession(params)
+            session.users += 1
+            return session
+
+    def release(self, session: YdlSession) -> None:
+        with self._lock:
+            session.users -= 1
+            if session.users > 0:
+                return
+            if not session.stale:
+                session.save_cookies()
+                return
+        session.close(save_cookies=False)
+
+    def close(self) -> None:
+        """全てのセッションの Cookie を保存して接続を閉じる"""
+        with self._lock:
+            sessions = list(self._sessions.values())
+            self._sessions.clear()
+        for session in sessions:
+            session.close()
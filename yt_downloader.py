@@ -1,26 +1,37 @@
-import asyncio
-import os
+import argparse
 import tkinter as tk
 from concurrent.futures import Future
-from pathlib import Path
-from threading import Thread
 from tkinter import filedialog, messagebox, ttk
-from typing import Optional
-
-from yt_dlp import YoutubeDL
+from typing import Callable, Dict, List, Optional
 
 import config
-import tool_manager
-
-
-class DownloadState:
-    """ダウンロード状態を管理するクラス"""
-
-    def __init__(self):
-        self.is_downloading = False
-        self.stop_requested = False
-        self.current_download_task: Optional[Future] = None
-        self.ydl: Optional[YoutubeDL] = None
+from bandwidth_scheduler import JobPriority
+from download_queue import DownloadJob, JobStatus, parse_sections
+from downloader_core import COOKIE_FILE, DownloaderCore, available_heights
+from progress_bus import ProgressBus
+from tool_manager import ToolStatus
+
+JOB_STATUS_LABELS = {
+    JobStatus.QUEUED: "待機中",
+    JobStatus.RUNNING: "ダウンロード中",
+    JobStatus.DONE: "完了",
+    JobStatus.FAILED: "失敗",
+    JobStatus.CANCELLED: "中止",
+    JobStatus.SKIPPED: "スキップ (取得済み)",
+}
+
+PRIORITY_LABELS = {
+    JobPriority.HIGH: "高",
+    JobPriority.NORMAL: "通常",
+    JobPriority.LOW: "低",
+}
+
+TOOL_STATUS_LABELS = {
+    ToolStatus.CHECKING: "確認中",
+    ToolStatus.DOWNLOADING: "ダウンロード中",
+    ToolStatus.READY: "OK",
+    ToolStatus.FAILED: "失敗",
+}
 
 
 class UIState:
@@ -28,9 +39,15 @@ class UIState:
 
     def __init__(self):
         self.save_folder_var = tk.StringVar()
-        self.url_var = tk.StringVar()
         self.quality_var = tk.StringVar()
-        self.progress_var = tk.DoubleVar()
+        self.concurrency_var = tk.IntVar(value=config.max_concurrent_downloads)
+        # 全体の帯域の上限 (MB/s)。0 で無制限
+        self.bandwidth_limit_var = tk.StringVar(value=f"{(config.bandwidth_limit or 0) / 1024 / 1024:g}")
+        self.priority_var = tk.StringVar(value=PRIORITY_LABELS[JobPriority.NORMAL])
+        self.expand_playlist_var = tk.BooleanVar(value=False)
+        self.playlist_filter_var = tk.StringVar()
+        # 取得する時間の範囲 (例: 1:30-2:00, 10:00-10:30)。空なら動画全体
+        self.clip_var = tk.StringVar()
 
 
 class YouTubeDownloaderUI:
@@ -40,6 +57,7 @@ class YouTubeDownloaderUI:
         self.root = root
         self.downloader = downloader
         self.state = UIState()
+        self.tool_status: Dict[str, str] = {}
         self.create_ui()
 
     def create_ui(self) -> None:
@@ -47,7 +65,9 @@ class YouTubeDownloaderUI:
         self._create_save_folder_section()
         self._create_url_section()
         self._create_quality_section()
-        self._create_progress_section()
+        self._create_playlist_section()
+        self._create_concurrency_section()
+        self._create_job_list_section()
         self._create_button_section()
 
     def _create_save_folder_section(self) -> None:
@@ -58,8 +78,19 @@ class YouTubeDownloaderUI:
         )
 
     def _create_url_section(self) -> None:
-        tk.Label(self.root, text="動画URL:").grid(row=1, column=0, padx=5, pady=5)
-        tk.Entry(self.root, textvariable=self.state.url_var, width=40).grid(row=1, column=1, padx=5, pady=5)
+        tk.Label(self.root, text="動画URL:\n(1行に1件)").grid(row=1, column=0, padx=5, pady=5)
+        self.url_text = tk.Text(self.root, width=40, height=4)
+        self.url_text.grid(row=1, column=1, padx=5, pady=5)
+        self.url_text.bind("<<Modified>>", self._on_url_modified)
+        self._prefetch_after_id: Optional[str] = None
+
+    def _on_url_modified(self, _event: tk.Event) -> None:
+        # <<Modified>> はフラグを戻すまで再発火しないため毎回リセットする
+        self.url_text.edit_modified(False)
+        # 入力中の連続した変更はまとめて1回だけ先読みする
+        if self._prefetch_after_id:
+            self.root.after_cancel(self._prefetch_after_id)
+        self._prefetch_after_id = self.root.after(500, self.downloader.prefetch_urls)
 
     def _create_quality_section(self) -> None:
         tk.Label(self.root, text="画質:").grid(row=2, column=0, padx=5, pady=5)
@@ -73,23 +104,114 @@ class YouTubeDownloaderUI:
         self.quality_combobox.set(config.quality_options[config.quality_default_idx])
         self.quality_combobox.grid(row=2, column=1, padx=5, pady=5)
 
-    def _create_progress_section(self) -> None:
-        self.progress_bar = ttk.Progressbar(
-            self.root, variable=self.state.progress_var, maximum=100, mode="determinate"
+        frame = tk.Frame(self.root)
+        frame.grid(row=2, column=2, padx=5, pady=5, sticky="w")
+        tk.Label(frame, text="範囲:").pack(side=tk.LEFT)
+        tk.Entry(frame, textvariable=self.state.clip_var, width=12).pack(side=tk.LEFT)
+
+    def update_quality_options(self, heights: List[int]) -> None:
+        """
+        先読みした動画で実際に選べる解像度を画質の選択肢に反映する。空なら既定の選択肢に戻す
+        """
+        selected = self.state.quality_var.get()
+        current = selected.split()[0].replace("p", "")
+        # 音声のみ・情報のみのモードは動画の解像度に関係なく選べる
+        modes = [option for option in config.quality_options if not option[0].isdigit()]
+        if not heights:
+            self.quality_combobox.config(values=config.quality_options)
+            if selected not in config.quality_options:
+                self.quality_combobox.set(config.quality_options[config.quality_default_idx])
+            return
+
+        labels = {option.split()[0]: option for option in config.quality_options}
+        values = [labels.get(f"{height}p", f"{height}p") for height in heights]
+        self.quality_combobox.config(values=values + modes)
+        if selected in modes:
+            return
+        # 選択中の画質がなければ、それ以下で最も高い画質 (なければ最低画質) を選ぶ
+        current_height = int(current) if current.isdigit() else heights[0]
+        candidates = [height for height in heights if height <= current_height]
+        self.quality_combobox.set(values[heights.index(candidates[0])] if candidates else values[-1])
+
+    def _create_playlist_section(self) -> None:
+        tk.Label(self.root, text="プレイリスト:").grid(row=3, column=0, padx=5, pady=5)
+        frame = tk.Frame(self.root)
+        frame.grid(row=3, column=1, padx=5, pady=5, sticky="w")
+        tk.Checkbutton(frame, text="展開する", variable=self.state.expand_playlist_var).pack(side=tk.LEFT)
+        tk.Label(frame, text="フィルタ:").pack(side=tk.LEFT)
+        # yt-dlp の --match-filter 形式 (例: duration < 600)
+        tk.Entry(frame, textvariable=self.state.playlist_filter_var, width=22).pack(side=tk.LEFT)
+
+    def _create_concurrency_section(self) -> None:
+        tk.Label(self.root, text="同時ダウンロード数:").grid(row=4, column=0, padx=5, pady=5)
+        frame = tk.Frame(self.root)
+        frame.grid(row=4, column=1, columnspan=2, padx=5, pady=5, sticky="w")
+        tk.Spinbox(
+            frame,
+            from_=1,
+            to=config.max_concurrent_downloads_limit,
+            textvariable=self.state.concurrency_var,
+            command=self.downloader.update_concurrency,
+            state="readonly",
+            width=5,
+        ).pack(side=tk.LEFT)
+
+        tk.Label(frame, text="帯域上限 (MB/s, 0で無制限):").pack(side=tk.LEFT, padx=(10, 0))
+        bandwidth_spinbox = tk.Spinbox(
+            frame,
+            from_=0,
+            to=1000,
+            increment=0.5,
+            textvariable=self.state.bandwidth_limit_var,
+            command=self.downloader.update_bandwidth_limit,
+            width=6,
+        )
+        bandwidth_spinbox.pack(side=tk.LEFT)
+        bandwidth_spinbox.bind("<Return>", lambda _: self.downloader.update_bandwidth_limit())
+        bandwidth_spinbox.bind("<FocusOut>", lambda _: self.downloader.update_bandwidth_limit())
+
+        # 新しく追加するジョブの優先度。変更すると一覧で選択中のジョブにも反映する
+        tk.Label(frame, text="優先度:").pack(side=tk.LEFT, padx=(10, 0))
+        priority_combobox = ttk.Combobox(
+            frame,
+            textvariable=self.state.priority_var,
+            values=list(PRIORITY_LABELS.values()),
+            state="readonly",
+            width=5,
+        )
+        priority_combobox.pack(side=tk.LEFT)
+        priority_combobox.bind("<<ComboboxSelected>>", lambda _: self.downloader.update_priority())
+
+    def selected_priority(self) -> JobPriority:
+        label = self.state.priority_var.get()
+        return next(priority for priority, text in PRIORITY_LABELS.items() if text == label)
+
+    def _create_job_list_section(self) -> None:
+        self.job_tree = ttk.Treeview(
+            self.root, columns=("title", "status", "priority", "progress", "speed"), show="headings", height=8
         )
-        self.progress_bar.grid(row=3, column=0, columnspan=3, padx=5, pady=5, sticky="ew")
-        self.progress_bar.grid_remove()
+        self.job_tree.heading("title", text="動画")
+        self.job_tree.heading("status", text="状態")
+        self.job_tree.heading("priority", text="優先度")
+        self.job_tree.heading("progress", text="進捗")
+        self.job_tree.heading("speed", text="速度")
+        self.job_tree.column("title", width=260)
+        self.job_tree.column("priority", width=50, anchor="center")
+        self.job_tree.column("status", width=100, anchor="center")
+        self.job_tree.column("progress", width=70, anchor="e")
+        self.job_tree.column("speed", width=90, anchor="e")
+        self.job_tree.grid(row=5, column=0, columnspan=3, padx=5, pady=5, sticky="ew")
 
         self.status_label = tk.Label(self.root, text="")
-        self.status_label.grid(row=4, column=0, columnspan=3, padx=5, pady=5)
+        self.status_label.grid(row=6, column=0, columnspan=3, padx=5, pady=5)
 
     def _create_button_section(self) -> None:
         tk.Button(self.root, text="Cookie設定", command=self.downloader.set_cookies).grid(
-            row=5, column=0, padx=5, pady=5
+            row=7, column=0, padx=5, pady=5
         )
 
         self.download_button = tk.Button(self.root, text="ダウンロード開始", command=self.downloader.start_download)
-        self.download_button.grid(row=5, column=1, padx=5, pady=5)
+        self.download_button.grid(row=7, column=1, padx=5, pady=5)
 
         self.stop_button = tk.Button(
             self.root,
@@ -97,14 +219,56 @@ class YouTubeDownloaderUI:
             command=self.downloader.stop_download,
             state=tk.DISABLED,
         )
-        self.stop_button.grid(row=5, column=2, padx=5, pady=5)
+        self.stop_button.grid(row=7, column=2, padx=5, pady=5)
+
+        self.tool_status_label = tk.Label(self.root, text="", fg="gray")
+        self.tool_status_label.grid(row=8, column=0, columnspan=3, padx=5, pady=5)
 
     def choose_save_folder(self) -> None:
         folder = filedialog.askdirectory()
         if folder:
             self.state.save_folder_var.set(folder)
 
-    def show_cookie_dialog(self, current_cookies: str) -> None:
+    def get_urls(self) -> List[str]:
+        return [line.strip() for line in self.url_text.get("1.0", tk.END).splitlines() if line.strip()]
+
+    def clear_urls(self) -> None:
+        self.url_text.delete("1.0", tk.END)
+
+    def selected_job_ids(self) -> List[int]:
+        return [int(item) for item in self.job_tree.selection()]
+
+    def update_job_row(self, job: DownloadJob) -> None:
+        """ジョブ一覧の該当行を最新の状態に更新する"""
+        status = JOB_STATUS_LABELS[job.status]
+        if job.status == JobStatus.FAILED and job.error:
+            status = f"{status}: {job.error}"
+        elif job.duplicate_of is not None and not job.is_finished:
+            status = f"{status} (#{job.duplicate_of} と重複)"
+        speed = f"{job.speed / 1024 / 1024:.1f} MB/s" if job.speed else ""
+        values = (job.title or job.url, status, PRIORITY_LABELS[job.priority], f"{job.progress:.1f}%", speed)
+
+        item = str(job.job_id)
+        if self.job_tree.exists(item):
+            self.job_tree.item(item, values=values)
+        else:
+            self.job_tree.insert("", tk.END, iid=item, values=values)
+
+    def update_tool_status(self, tool_name: str, status: ToolStatus, downloaded: int, total: int) -> None:
+        """ツール準備の進捗をステータス欄に表示する"""
+        text = TOOL_STATUS_LABELS[status]
+        if status == ToolStatus.DOWNLOADING:
+            text = f"{downloaded * 100 / total:.0f}%" if total else f"{downloaded / 1024 / 1024:.1f} MB"
+        self.tool_status[tool_name] = text
+
+        if all(value == TOOL_STATUS_LABELS[ToolStatus.READY] for value in self.tool_status.values()):
+            self.tool_status_label.config(text="ツールの準備が完了しました")
+        else:
+            self.tool_status_label.config(
+                text="ツール: " + ", ".join(f"{name} {value}" for name, value in self.tool_status.items())
+            )
+
+    def show_cookie_dialog(self, current_cookies: str, on_save: Callable[[str], None]) -> None:
         cookie_window = tk.Toplevel(self.root)
         cookie_window.title("Cookie設定")
         cookie_window.geometry("600x400")
@@ -119,11 +283,7 @@ class YouTubeDownloaderUI:
         button_frame.pack(side=tk.BOTTOM, fill=tk.X, padx=5, pady=5)
 
         def save_cookies() -> None:
-            cookie_dir = Path.home() / "Library" / "Application Support" / "yt-downloader"
-            cookie_dir.mkdir(exist_ok=True, parents=True)
-            cookie_file = cookie_dir / "cookies.txt"
-            cookie_file.write_text(text_area.get("1.0", tk.END).rstrip(), encoding="utf-8")
-            os.chmod(str(cookie_file), 0o600)  # ユーザーのみ読み書き可能に設定
+            on_save(text_area.get("1.0", tk.END).rstrip())
             cookie_window.destroy()
 
         tk.Button(button_frame, text="保存", command=save_cookies).pack(side=tk.LEFT, padx=5)
@@ -138,207 +298,196 @@ class YouTubeDownloader:
         self.root.title("YouTube Downloader")
         self.root.resizable(width=False, height=False)
 
-        self.download_state = DownloadState()
         self.ui = YouTubeDownloaderUI(root, self)
+        self.progress_bus = ProgressBus(root, after_flush=self._refresh_summary)
+        self.progress_bus.start()
+        self.batch_jobs: List[DownloadJob] = []
+
+        self.core = DownloaderCore(
+            max_workers=self.ui.state.concurrency_var.get(),
+            on_job_update=self._on_job_update,
+            on_tool_progress=self._on_tool_progress,
+        )
 
-        self.asyncio_loop = asyncio.new_event_loop()
-        self.thread = Thread(target=self._start_asyncio_loop, daemon=True)
-        self.thread.start()
-
-    def _start_asyncio_loop(self) -> None:
-        asyncio.set_event_loop(self.asyncio_loop)
-        self.asyncio_loop.run_forever()
+    def start_background_tasks(self) -> None:
+        """
+        ウィンドウの表示後に、ツールの確認とyt-dlpの読み込みをバックグラウンドで始め、
+        前回終わらなかったジョブを再開する
+        """
+        self.start_tool_bootstrap()
+        self.core.preload()
+        resumed = self.core.resume_unfinished()
+        if resumed:
+            self.batch_jobs.extend(resumed)
+            self.ui.stop_button.config(state=tk.NORMAL)
+
+    def start_tool_bootstrap(self) -> None:
+        """不足しているツールの取得をバックグラウンドで開始する"""
+        for tool_name in self.core.tool_bootstrap.TOOLS:
+            self.ui.update_tool_status(tool_name, ToolStatus.CHECKING, 0, 0)
+        self.core.start_tool_bootstrap()
+
+    def _on_tool_progress(self, tool_name: str, status: ToolStatus, downloaded: int, total: int) -> None:
+        self.progress_bus.publish(("tool", tool_name), self.ui.update_tool_status, tool_name, status, downloaded, total)
 
     def start_download(self) -> None:
-        url = self.ui.state.url_var.get().strip()
+        urls = self.ui.get_urls()
         save_folder = self.ui.state.save_folder_var.get()
+        quality = self.ui.state.quality_var.get().split()[0].replace("p", "")
+        priority = self.ui.selected_priority()
 
-        if not url or not save_folder:
+        if not urls or not save_folder:
             messagebox.showerror("エラー", "URLまたは保存フォルダを指定してください")
             return
+        try:
+            sections = parse_sections(self.ui.state.clip_var.get())
+        except ValueError as e:
+            messagebox.showerror("エラー", str(e))
+            return
 
-        self._prepare_download_ui()
-        self.download_state.current_download_task = asyncio.run_coroutine_threadsafe(
-            self.download_video(), self.asyncio_loop
-        )
-
-    def _prepare_download_ui(self) -> None:
-        self.ui.progress_bar.grid()
-        self.ui.state.progress_var.set(0)
-        self.ui.status_label.config(text="ダウンロードを開始します...")
-        self.download_state.is_downloading = True
-        self.download_state.stop_requested = False
-        self.ui.download_button.config(state=tk.DISABLED)
+        if self.ui.state.expand_playlist_var.get():
+            if sections:
+                messagebox.showerror("エラー", "範囲はプレイリストの展開と同時に指定できません")
+                return
+            match_filter = self.ui.state.playlist_filter_var.get().strip() or None
+            for url in urls:
+                expansion = self.core.expand_playlist(
+                    url, save_folder, quality, match_filter, on_job=self.batch_jobs.append, priority=priority
+                )
+                expansion.add_done_callback(self._on_playlist_expanded)
+        else:
+            for url in urls:
+                self.batch_jobs.append(self.core.submit(url, save_folder, quality, priority, sections))
+        self.ui.clear_urls()
         self.ui.stop_button.config(state=tk.NORMAL)
 
-    def stop_download(self) -> None:
-        self.download_state.stop_requested = True
-        if self.download_state.ydl:
-            self.download_state.ydl._download_retcode = 1
-            self.download_state.ydl = None
-
-        if self.download_state.current_download_task and not self.download_state.current_download_task.done():
-            self.download_state.current_download_task.cancel()
-            self.download_state.current_download_task = None
+    def _on_playlist_expanded(self, expansion: Future) -> None:
+        if not expansion.cancelled() and expansion.exception() is not None:
+            self.progress_bus.post(
+                messagebox.showerror, "エラー", f"プレイリストの展開に失敗しました: {expansion.exception()}"
+            )
+        # 展開終了時点で全ジョブが完了している場合に備えてサマリーを更新する
+        self.progress_bus.post(self._refresh_summary)
 
-        self._reset_ui_after_stop()
+    def stop_download(self) -> None:
+        """選択中のジョブを中止する。選択がなければ全ジョブを中止する"""
+        job_ids = self.ui.selected_job_ids()
+        if job_ids:
+            for job_id in job_ids:
+                self.core.cancel(job_id)
+        else:
+            self.core.cancel_all()
+
+    def update_concurrency(self) -> None:
+        self.core.set_max_workers(self.ui.state.concurrency_var.get())
+
+    def update_bandwidth_limit(self) -> None:
+        try:
+            limit = float(self.ui.state.bandwidth_limit_var.get())
+        except ValueError:
+            return
+        self.core.set_bandwidth_limit(max(0.0, limit) * 1024 * 1024)
 
-    def _reset_ui_after_stop(self) -> None:
-        self.download_state.is_downloading = False
-        self.ui.status_label.config(text="ダウンロードを中止しました")
-        self.ui.progress_bar.grid_remove()
-        self.ui.download_button.config(state=tk.NORMAL)
-        self.ui.stop_button.config(state=tk.DISABLED)
+    def update_priority(self) -> None:
+        """選択中のジョブの優先度を変更する。実行中のジョブは帯域の配分がすぐに変わる"""
+        priority = self.ui.selected_priority()
+        for job_id in self.ui.selected_job_ids():
+            self.core.set_priority(job_id, priority)
 
     def set_cookies(self) -> None:
         try:
             current_cookies = self._load_current_cookies()
-            self.ui.show_cookie_dialog(current_cookies)
+            self.ui.show_cookie_dialog(current_cookies, self.core.save_cookies)
         except Exception as e:
             messagebox.showerror("エラー", f"エラーが発生しました: {e}")
 
     def _load_current_cookies(self) -> str:
         try:
-            cookie_file = Path.home() / "Library" / "Application Support" / "yt-downloader" / "cookies.txt"
-            return cookie_file.read_text(encoding="utf-8")
+            return COOKIE_FILE.read_text(encoding="utf-8")
         except FileNotFoundError:
             return ""
 
-    async def download_video(self) -> None:
-        url = self.ui.state.url_var.get().strip()
-        save_folder = self.ui.state.save_folder_var.get()
-        quality = self.ui.state.quality_var.get().split()[0].replace("p", "")
-
-        if not self._validate_download_params(url, save_folder):
+    def prefetch_urls(self) -> None:
+        """
+        入力されたURLの動画情報をバックグラウンドで取得してキャッシュする。
+        最後のURLの情報が揃ったら画質の選択肢を実際のフォーマットに合わせる
+        """
+        urls = self.ui.get_urls()
+        if not urls or self.ui.state.expand_playlist_var.get():
+            self.ui.update_quality_options([])
             return
+        prefetches = [self.core.prefetch(url) for url in urls[-config.prefetch_max_urls :]]
+        prefetches[-1].add_done_callback(self._on_prefetched)
 
-        ydl_opts = self._create_ydl_options(save_folder, quality)
-
-        if self.download_state.stop_requested:
+    def _on_prefetched(self, prefetch: Future) -> None:
+        if prefetch.cancelled() or prefetch.exception() is not None:
             return
-
-        try:
-            self.download_state.ydl = YoutubeDL(ydl_opts)
-            if not self.download_state.stop_requested and self.download_state.ydl:
-
-                async def download_with_check():
-                    if self.download_state.stop_requested or not self.download_state.ydl:
-                        return
-                    await asyncio.to_thread(self.download_state.ydl.download, [url])
-                    if self.download_state.stop_requested:
-                        return
-
-                await asyncio.wait_for(download_with_check(), timeout=None)
-
-            if self.download_state.is_downloading and not self.download_state.stop_requested:
-                self._show_success_message()
-        except Exception as e:
-            if self.download_state.is_downloading and not self.download_state.stop_requested:
-                self._show_error_message(str(e))
-        finally:
-            self._cleanup_after_download()
-
-    def _validate_download_params(self, url: str, save_folder: str) -> bool:
-        if not url or not save_folder:
-            messagebox.showerror("エラー", "URLまたは保存フォルダを指定してください")
-            self.ui.download_button.config(state=tk.NORMAL)
-            self.ui.stop_button.config(state=tk.DISABLED)
-            return False
-        return True
-
-    def _create_ydl_options(self, save_folder: str, quality: str) -> dict:
-        ydl_opts = {
-            "outtmpl": os.path.join(save_folder, "%(title)s.%(ext)s"),
-            "format": f"bv*[vcodec*=avc1][height<={quality}]+bestaudio[ext=m4a]/"
-            f"bv*[vcodec*=avc1][height<={quality}]+234/best",
-            "merge_output_format": "mp4",
-            "no_check_certificates": True,
-            "verbose": True,
-            "no_warnings": False,
-            "progress_hooks": [self.update_progress],
-            "postprocessors": [
-                {
-                    "key": "FFmpegVideoConvertor",
-                    "preferedformat": "mp4",
-                },
-                {
-                    "key": "EmbedThumbnail",
-                },
-            ],
-            "quiet": False,
-        }
-
-        tool_manager_instance = tool_manager.ToolManager()
-        ffmpeg_path = tool_manager_instance.save_dir / "ffmpeg"
-        ydl_opts["ffmpeg_location"] = str(ffmpeg_path)
-
-        cookie_file = Path.home() / "Library" / "Application Support" / "yt-downloader" / "cookies.txt"
-        if cookie_file.exists() and cookie_file.read_text(encoding="utf-8").strip():
-            ydl_opts["cookiefile"] = str(cookie_file)
-
-        return ydl_opts
-
-    def _show_success_message(self) -> None:
-        self.root.after(0, lambda: messagebox.showinfo("成功", "動画のダウンロードが完了しました！"))
-        self.root.after(0, self.ui.progress_bar.grid_remove)
-
-    def _show_error_message(self, error_msg: str) -> None:
-        self.root.after(
-            0,
-            lambda: messagebox.showerror("エラー", f"動画のダウンロードに失敗しました: {error_msg}"),
+        self.progress_bus.publish("quality", self.ui.update_quality_options, available_heights(prefetch.result()))
+
+    def _on_job_update(self, job: DownloadJob) -> None:
+        """
+        キューからの状態通知。任意のスレッドから高頻度で呼ばれるため、
+        ProgressBus に最新状態だけを渡して一定間隔でまとめて反映する
+        """
+        self.progress_bus.publish(("job", job.job_id), self.ui.update_job_row, job)
+
+    def _refresh_summary(self) -> None:
+        """ProgressBus の反映ごとに1回だけ呼ばれ、全体の件数と完了通知を更新する"""
+        counts = self.core.queue.counts()
+        text = (
+            f"実行中: {counts[JobStatus.RUNNING]}件, 待機中: {counts[JobStatus.QUEUED]}件, "
+            f"完了: {counts[JobStatus.DONE]}件, 失敗: {counts[JobStatus.FAILED]}件"
         )
-        self.root.after(0, self.ui.progress_bar.grid_remove)
-
-    def _cleanup_after_download(self) -> None:
-        self.download_state.is_downloading = False
-        self.download_state.stop_requested = False
-        self.download_state.ydl = None
-        self.root.after(0, lambda: self.ui.download_button.config(state=tk.NORMAL))
-        self.root.after(0, lambda: self.ui.stop_button.config(state=tk.DISABLED))
-
-    def update_progress(self, data: dict) -> None:
-        if self.download_state.stop_requested or not self.download_state.is_downloading:
-            raise Exception("Download cancelled")
-
-        if data["status"] == "downloading":
-            self._update_download_progress(data)
-        elif data["status"] == "finished":
-            self._update_finished_progress()
-
-    def _update_download_progress(self, data: dict) -> None:
-        try:
-            downloaded = data.get("downloaded_bytes", 0)
-            total = data.get("total_bytes") or data.get("total_bytes_estimate", 0)
-
-            if total > 0:
-                percent = (downloaded / total) * 100
-                speed = data.get("speed", 0)
-                speed_str = f"{speed / 1024 / 1024:.1f} MB/s" if speed else "計算中..."
-
-                self.root.after(0, lambda: self.ui.state.progress_var.set(percent))
-                self.root.after(
-                    0,
-                    lambda: self.ui.status_label.config(text=f"ダウンロード中: {percent:.1f}%, 速度: {speed_str}"),
-                )
-        except Exception:
-            pass
-
-    def _update_finished_progress(self) -> None:
-        self.root.after(0, lambda: self.ui.state.progress_var.set(100))
-        self.root.after(0, lambda: self.ui.status_label.config(text="ダウンロード完了！"))
-
-
-def main() -> None:
+        if counts[JobStatus.SKIPPED]:
+            text += f", スキップ: {counts[JobStatus.SKIPPED]}件"
+        if self.core.playlist_expansions:
+            text += " (プレイリスト展開中)"
+        self.ui.status_label.config(text=text)
+        if not self.core.playlist_expansions and self.batch_jobs and all(job.is_finished for job in self.batch_jobs):
+            batch_counts = {status: 0 for status in JobStatus}
+            for job in self.batch_jobs:
+                batch_counts[job.status] += 1
+            self.batch_jobs = []
+            self.ui.stop_button.config(state=tk.DISABLED)
+            self.progress_bus.post(self._show_summary_message, batch_counts)
+
+    def _show_summary_message(self, counts: dict) -> None:
+        if counts[JobStatus.FAILED]:
+            messagebox.showerror(
+                "エラー",
+                f"{counts[JobStatus.FAILED]}件の動画のダウンロードに失敗しました。詳細は一覧を確認してください",
+            )
+        elif (counts[JobStatus.DONE] or counts[JobStatus.SKIPPED]) and not counts[JobStatus.CANCELLED]:
+            messagebox.showinfo("成功", "動画のダウンロードが完了しました！")
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="YouTube Downloader")
+    parser.add_argument(
+        "--api", action="store_true", help="ローカルHTTP APIを開き、他のツールからもジョブを投入できるようにする"
+    )
+    parser.add_argument("--api-port", type=int, default=config.api_port, help="APIの待ち受けポート")
+    # .app から起動した場合にOSが付ける引数は無視する
+    return parser.parse_known_args(argv)[0]
+
+
+def main(argv=None) -> None:
+    args = parse_args(argv)
     root = tk.Tk()
-    _ = YouTubeDownloader(root)
-
-    tool_manager_instance = tool_manager.ToolManager()
-    tool_manager_instance.check_and_download_ffmpeg()
-    tool_manager_instance.check_and_download_ffprobe()
-    tool_manager_instance.check_and_download_yt_dlp()
-    tool_manager_instance.check_and_download_atomicparsley()
-
-    root.mainloop()
+    downloader = YouTubeDownloader(root)
+    # ウィンドウの表示もアイドル時に行われるため、その後に重い処理を始める
+    root.after_idle(downloader.start_background_tasks)
+    server = None
+    if args.api:
+        from api_server import ApiServer
+
+        server = ApiServer(downloader.core, port=args.api_port)
+        server.start()
+    try:
+        root.mainloop()
+    finally:
+        if server is not None:
+            server.stop()
 
 
 if __name__ == "__main__":
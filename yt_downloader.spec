@@ -6,7 +6,7 @@ a = Analysis(
     pathex=[],
     binaries=[],
     datas=[],
-    hiddenimports=[],
+    hiddenimports=['mutagen'],
     hookspath=[],
     hooksconfig={},
     runtime_hooks=[],
@@ -0,0 +1,268 @@
+import argparse
+import json
+import sys
+import threading
+import time
+from typing import Iterable, List, TextIO
+
+import config
+from api_server import ApiServer
+from bandwidth_scheduler import JobPriority
+from download_queue import DownloadJob, JobStatus, Section, parse_sections
+from downloader_core import APP_SUPPORT_DIR, AUDIO_ONLY, METADATA_ONLY, DownloaderCore, metrics_entry
+
+# 同じジョブの進捗を出力する最短間隔 (秒)
+PROGRESS_INTERVAL = 1.0
+
+# GUIが再開するジョブと混ざらないよう、CLIの未完了ジョブは別のファイルに記録する
+CLI_JOURNAL_FILE = APP_SUPPORT_DIR / "cli-jobs.sqlite3"
+
+
+class JsonLinesReporter:
+    """ジョブの進捗と結果をJSON Lines形式で出力するクラス"""
+
+    def __init__(self, out: TextIO) -> None:
+        self.out = out
+        self._lock = threading.Lock()
+        self._last_progress = {}
+
+    def emit(self, event: str, **fields) -> None:
+        with self._lock:
+            self.out.write(json.dumps({"event": event, "time": time.time(), **fields}, ensure_ascii=False) + "\n")
+            self.out.flush()
+
+    def on_job_update(self, job: DownloadJob) -> None:
+        # 進捗だけの通知は間引き、状態の変化は必ず出力する
+        now = time.monotonic()
+        last_status, last_time = self._last_progress.get(job.job_id, (None, 0.0))
+        if job.status == last_status and now - last_time < PROGRESS_INTERVAL:
+            return
+        self._last_progress[job.job_id] = (job.status, now)
+
+        if job.is_finished:
+            self.emit("result", **job_result(job))
+        else:
+            self.emit(
+                "progress",
+                job_id=job.job_id,
+                url=job.url,
+                title=job.title,
+                status=job.status.value,
+                progress=round(job.progress, 1),
+                speed=job.speed,
+            )
+
+
+def job_result(job: DownloadJob) -> dict:
+    elapsed = job.finished_at - job.started_at if job.started_at and job.finished_at else None
+    metrics = metrics_entry(job)
+    return {
+        "job_id": job.job_id,
+        "url": job.url,
+        "title": job.title,
+        "status": job.status.value,
+        "output_path": job.output_path,
+        # 範囲を指定した場合は範囲ごとのファイル
+        "output_paths": job.output_paths,
+        "bytes": job.downloaded_bytes,
+        # 範囲を指定したジョブで、動画全体を取得した場合と比べて取得せずに済んだバイト数
+        "bytes_avoided": metrics["bytes_avoided"],
+        "elapsed": elapsed,
+        "duplicate_of": job.duplicate_of,
+        "error": job.error,
+        # 工程ごとの所要時間 (秒)。個々のスパンは計測ログに記録される
+        "stages": metrics["stages"],
+        "fragments": metrics["fragments"],
+        "fragment_concurrency": metrics["fragment_concurrency"],
+        "retries": metrics["retries"],
+        "peak_speed": metrics["peak_speed"],
+        "media_plan": metrics["media_plan"],
+    }
+
+
+def read_urls(sources: Iterable[TextIO]) -> List[str]:
+    """
+    1行に1件のURLを読み込む。空行と # で始まる行は無視する
+    """
+    urls = []
+    for source in sources:
+        for line in source:
+            line = line.strip()
+            if line and not line.startswith("#"):
+                urls.append(line)
+    return urls
+
+
+def parse_rate(value: str) -> float:
+    """50K や 4.2M のような指定をバイト/秒に変換する"""
+    from yt_dlp.utils import parse_bytes
+
+    rate = parse_bytes(value)
+    if rate is None:
+        raise argparse.ArgumentTypeError(f"帯域の指定が正しくありません: {value}")
+    return rate
+
+
+def parse_quality(value: str) -> str:
+    """720p のようにGUIの表記で指定しても、GUIやAPIと同じく高さの数字にそろえる"""
+    quality = value.strip().lower().replace("p", "")
+    if quality not in (AUDIO_ONLY, METADATA_ONLY) and not quality.isdigit():
+        raise argparse.ArgumentTypeError(f"画質の指定が正しくありません: {value}")
+    return quality
+
+
+def parse_clip(value: str) -> List[Section]:
+    try:
+        return parse_sections(value)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="GUIを使わずにURLの一覧をまとめてダウンロードする")
+    parser.add_argument("urls", nargs="*", help="ダウンロードするURL")
+    parser.add_argument(
+        "-i",
+        "--input",
+        type=argparse.FileType("r", encoding="utf-8"),
+        action="append",
+        help="URLの一覧ファイル (1行に1件、- で標準入力)。URLもファイルも指定がなければ標準入力から読む",
+    )
+    parser.add_argument(
+        "-o", "--output", help="保存フォルダ。--resume や --serve だけを指定する場合は省略できる"
+    )
+    parser.add_argument(
+        "-q",
+        "--quality",
+        type=parse_quality,
+        default=config.quality_options[config.quality_default_idx].split()[0].replace("p", ""),
+        help="最大解像度 (高さ)。例: 720。audio で音声のみ、metadata で動画の情報・サムネイル・字幕のみを保存する",
+    )
+    parser.add_argument(
+        "-j", "--jobs", type=int, default=config.max_concurrent_downloads, help="同時ダウンロード数"
+    )
+    parser.add_argument(
+        "-r", "--limit-rate", type=parse_rate, help="全ダウンロード合計の帯域の上限 (バイト/秒)。例: 50K, 4.2M"
+    )
+    parser.add_argument(
+        "--priority",
+        choices=[priority.name.lower() for priority in JobPriority],
+        default=JobPriority.NORMAL.name.lower(),
+        help="投入するジョブの優先度。帯域の上限がある場合、優先度の重みで配分される",
+    )
+    parser.add_argument(
+        "--clip",
+        type=parse_clip,
+        action="append",
+        help="取得する時間の範囲。例: 1:30-2:00 (複数指定可)。範囲を含む部分だけを取得し、範囲ごとのファイルに保存する",
+    )
+    parser.add_argument(
+        "--resume", action="store_true", help="前回中断したCLIのジョブを途中のファイルから再開する"
+    )
+    parser.add_argument("--playlist", action="store_true", help="プレイリスト・チャンネルを展開する")
+    parser.add_argument("--match-filter", help="プレイリスト展開時のフィルタ (yt-dlp の --match-filter 形式)")
+    parser.add_argument(
+        "--serve",
+        action="store_true",
+        help="ローカルHTTP APIでジョブを受け付け続ける (Ctrl+C で終了)。-o はAPIで保存先を省略したときに使う",
+    )
+    parser.add_argument("--port", type=int, default=config.api_port, help="--serve の待ち受けポート")
+    parser.add_argument(
+        "--no-tools",
+        action="store_true",
+        help="ffmpeg等のツールをダウンロードせず、PATH上のものを使う",
+    )
+    parser.add_argument(
+        "--tool-mirror",
+        action="append",
+        help="ツールの取得元のミラー (フォルダかURL、複数指定可)。指定すると config.tool_mirrors の代わりに使う",
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    urls = list(args.urls)
+    if args.input or not (urls or args.resume or args.serve):
+        urls += read_urls(args.input or [sys.stdin])
+    if not urls and not args.resume and not args.serve:
+        print("URLが指定されていません", file=sys.stderr)
+        return 2
+    if urls and not args.output:
+        print("保存フォルダ (-o) が指定されていません", file=sys.stderr)
+        return 2
+    if args.clip and args.playlist:
+        print("--clip は --playlist と同時に指定できません", file=sys.stderr)
+        return 2
+    sections = [section for clip in args.clip or [] for section in clip]
+
+    reporter = JsonLinesReporter(sys.stdout)
+    core = DownloaderCore(
+        max_workers=args.jobs,
+        on_job_update=reporter.on_job_update,
+        manage_tools=not args.no_tools,
+        # 標準出力はJSON Lines専用にするため、yt-dlpの画面出力を止める
+        ydl_overrides={"quiet": True, "verbose": False, "noprogress": True},
+        journal_path=CLI_JOURNAL_FILE,
+        tool_mirrors=args.tool_mirror,
+    )
+    if not args.no_tools:
+        core.start_tool_bootstrap()
+    if args.limit_rate:
+        core.set_bandwidth_limit(args.limit_rate)
+    priority = JobPriority[args.priority.upper()]
+
+    started_at = time.time()
+    jobs: List[DownloadJob] = core.resume_unfinished() if args.resume else []
+    expansions = []
+    for url in urls:
+        if args.playlist:
+            expansions.append(
+                core.expand_playlist(url, args.output, args.quality, args.match_filter, jobs.append, priority)
+            )
+        else:
+            jobs.append(core.submit(url, args.output, args.quality, priority, sections))
+
+    server = None
+    if args.serve:
+        server = ApiServer(core, port=args.port, default_save_folder=args.output)
+        reporter.emit("serving", url=server.start())
+
+    try:
+        while (
+            server is not None
+            or not all(expansion.done() for expansion in expansions)
+            or not all(job.is_finished for job in jobs)
+        ):
+            time.sleep(0.2)
+    except KeyboardInterrupt:
+        core.cancel_all()
+        if server is not None:
+            server.stop()
+            # APIから投入されたジョブも結果に含める
+            jobs = list(core.queue.jobs.values())
+        while not all(job.is_finished for job in jobs):
+            time.sleep(0.2)
+
+    for expansion in expansions:
+        if not expansion.cancelled() and expansion.exception() is not None:
+            reporter.emit("error", message=f"プレイリストの展開に失敗しました: {expansion.exception()}")
+
+    elapsed = time.time() - started_at
+    counts = {status: 0 for status in JobStatus}
+    for job in jobs:
+        counts[job.status] += 1
+    total_bytes = sum(job.downloaded_bytes for job in jobs)
+    reporter.emit(
+        "summary",
+        jobs=len(jobs),
+        **{status.value: count for status, count in counts.items()},
+        bytes=total_bytes,
+        elapsed=elapsed,
+        throughput=total_bytes / elapsed if elapsed > 0 else 0.0,
+    )
+    return 1 if counts[JobStatus.FAILED] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
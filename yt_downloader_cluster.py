@@ -0,0 +1,84 @@
+import argparse
+import signal
+import sys
+import time
+
+import config
+from cluster_worker import Worker
+from coordinator import Coordinator, CoordinatorServer
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="ダウンロードキューを複数のマシンで分担する")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    coordinator = commands.add_parser("coordinator", help="キューを持ち、ワーカーにジョブを貸し出す")
+    coordinator.add_argument("--host", default="127.0.0.1", help="待ち受けるアドレス。他のマシンから使う場合は 0.0.0.0")
+    coordinator.add_argument("--port", type=int, default=config.coordinator_port, help="待ち受けポート")
+    coordinator.add_argument("--token", help="APIトークン。ループバック以外で待ち受ける場合は必須")
+    coordinator.add_argument(
+        "--lease-seconds", type=float, default=config.lease_seconds, help="ハートビートが途絶えてから貸し直すまでの秒数"
+    )
+
+    worker = commands.add_parser("worker", help="コーディネーターからジョブを借りてダウンロードする")
+    worker.add_argument("coordinator_url", help="コーディネーターのURL。例: http://192.168.1.10:8766")
+    worker.add_argument("-o", "--output", required=True, help="保存フォルダ")
+    worker.add_argument(
+        "-j", "--jobs", type=int, default=config.max_concurrent_downloads, help="同時に借りるジョブの数"
+    )
+    worker.add_argument("--worker-id", help="ワーカーの名前。省略時はホスト名とスレッドIDから作る")
+    worker.add_argument("--token", help="コーディネーターのAPIトークン")
+    worker.add_argument(
+        "--no-tools",
+        action="store_true",
+        help="ffmpeg等のツールをダウンロードせず、PATH上のものを使う",
+    )
+    worker.add_argument(
+        "--tool-mirror",
+        action="append",
+        help="ツールの取得元のミラー (フォルダかURL、複数指定可)。指定すると config.tool_mirrors の代わりに使う",
+    )
+    return parser.parse_args(argv)
+
+
+def run_coordinator(args: argparse.Namespace) -> int:
+    server = CoordinatorServer(Coordinator(lease_seconds=args.lease_seconds), args.host, args.port, args.token)
+    print(f"Coordinator listening on {server.start()}", flush=True)
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.stop()
+    return 0
+
+
+def run_worker(args: argparse.Namespace) -> int:
+    worker = Worker(
+        args.coordinator_url,
+        args.output,
+        worker_id=args.worker_id,
+        capacity=args.jobs,
+        token=args.token,
+        manage_tools=not args.no_tools,
+        tool_mirrors=args.tool_mirror,
+        # 複数のジョブの出力が混ざって読めないため、yt-dlpの画面出力を止める
+        ydl_overrides={"quiet": True, "verbose": False, "noprogress": True},
+    )
+    # SIGTERM でも実行中のジョブを中止してから終了する
+    signal.signal(signal.SIGTERM, lambda *_: worker.stop())
+    try:
+        worker.run()
+    except KeyboardInterrupt:
+        worker.stop()
+    return 0
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    if args.command == "coordinator":
+        return run_coordinator(args)
+    return run_worker(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())